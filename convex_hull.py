@@ -61,6 +61,46 @@ class hull2D:
 
     ######################################################################
 
+
+class hull2D_accumulator(hull2D):
+    """Accumulates points (e.g. the left and right ends of raster scan lines)
+    and keeps only the points that can still be on the convex hull.
+
+    Points are buffered and folded into the hull whenever the buffer grows
+    larger than the current hull, so the total work grows linearly with the
+    number of points added instead of re-sorting everything on every add.
+    """
+    def __init__(self,min_buffer=1024):
+        self.min_buffer = min_buffer
+        self.hull    = []
+        self.pending = []
+
+    def add_point(self,x,y):
+        self.pending.append((x,y))
+        if len(self.pending) > max(self.min_buffer,2*len(self.hull)):
+            self.reduce()
+
+    def add_row(self,left,right,y):
+        self.add_point(left,y)
+        self.add_point(right,y)
+
+    def reduce(self):
+        if self.pending != []:
+            self.hull = self.convex_hull(self.hull+self.pending)
+            self.pending = []
+
+    def ecoords(self):
+        """Return the hull in the same format as convexHullecoords()
+        (an empty list if no points were added)."""
+        self.reduce()
+        if self.hull == []:
+            return []
+        ecoords=[]
+        for point in self.hull:
+            ecoords.append([point[0],point[1],1])
+        ecoords.append(ecoords[0])
+        return ecoords
+
     
 if __name__ == '__main__':
     my_hull=hull2D()
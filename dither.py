@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+    Halftone (dithering) methods for raster engraving
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from PIL import Image
+from interpolate import interpolate
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY=False
+
+
+class Dither:
+    '''
+    Converts a gray scale ("L" mode) image into a bilevel ("1" mode) image.
+
+    Floyd-Steinberg uses the C implementation built into PIL.  Jarvis and
+    Stucki error diffusion are computed with NumPy one anti-diagonal
+    "wavefront" at a time: every pixel on the line x + 3*y = t only
+    receives error from pixels on earlier lines, so the whole line can be
+    processed with a few array operations.  The image is worked through in
+    bands of rows so memory use does not depend on the image height.
+    Bayer and clustered dot screening are plain threshold maps.
+    '''
+    FLOYD_STEINBERG = "Floyd-Steinberg"
+    JARVIS          = "Jarvis"
+    STUCKI          = "Stucki"
+    BAYER           = "Bayer"
+    CLUSTERED_DOT   = "Clustered-Dot"
+    METHODS = (FLOYD_STEINBERG, JARVIS, STUCKI, BAYER, CLUSTERED_DOT)
+
+    # (dx, dy, weight) error diffusion taps
+    KERNELS = {
+        JARVIS: [( 1,0,7),( 2,0,5),
+                 (-2,1,3),(-1,1,5),( 0,1,7),( 1,1,5),( 2,1,3),
+                 (-2,2,1),(-1,2,3),( 0,2,5),( 1,2,3),( 2,2,1)],
+        STUCKI: [( 1,0,8),( 2,0,4),
+                 (-2,1,2),(-1,1,4),( 0,1,8),( 1,1,4),( 2,1,2),
+                 (-2,2,1),(-1,2,2),( 0,2,4),( 1,2,2),( 2,2,1)],
+        }
+
+    CLUSTERED_DOT_MAP = [[12, 5, 6,13],
+                         [ 4, 0, 1, 7],
+                         [11, 3, 2, 8],
+                         [15,10, 9,14]]
+
+    def __init__(self,band_rows=2048):
+        self.band_rows = band_rows
+
+    def available(self,method):
+        return method==self.FLOYD_STEINBERG or NUMPY
+
+    def make_lut(self,x,y):
+        '''
+        Sample a darkness curve (lists of x and y values between 0 and 255,
+        e.g. from generate_bezier) at every gray level.  The result can be
+        passed to PIL's Image.point().
+        '''
+        interp = interpolate(x, y)
+        lut=[]
+        for val in range(0,256):
+            lut.append(int(round(interp[val])))
+        return lut
+
+    def halftone(self,image,npixels,lut=None,method=FLOYD_STEINBERG):
+        '''
+        Dither the image at the halftone cell size (npixels image pixels per
+        cell) and scale the result back up to the original image size.
+        '''
+        wim,him = image.size
+        nw=int(wim / npixels)
+        nh=int(him / npixels)
+        image_temp = image.convert("L").resize((nw,nh))
+        if lut != None:
+            image_temp = image_temp.point(lut)
+        image_temp = self.dither(image_temp,method)
+        return image_temp.resize((wim,him))
+
+    def dither(self,image,method=FLOYD_STEINBERG):
+        image = image.convert("L")
+        if not self.available(method):
+            method = self.FLOYD_STEINBERG
+
+        if method == self.FLOYD_STEINBERG:
+            return image.convert('1')
+        elif method in self.KERNELS:
+            return self.error_diffusion(image,self.KERNELS[method])
+        elif method == self.BAYER:
+            return self.ordered(image,self.bayer_map(8))
+        elif method == self.CLUSTERED_DOT:
+            return self.ordered(image,numpy.array(self.CLUSTERED_DOT_MAP))
+        else:
+            raise Exception("Unknown halftone method: %s" %(method))
+
+    def bayer_map(self,n):
+        bayer = numpy.array([[0]])
+        while bayer.shape[0] < n:
+            bayer = numpy.block([[4*bayer  , 4*bayer+2],
+                                 [4*bayer+3, 4*bayer+1]])
+        return bayer
+
+    def ordered(self,image,rank_map):
+        wim,him = image.size
+        nmap = rank_map.size
+        mh,mw = rank_map.shape
+        thresholds = ((rank_map+0.5)*255.0/nmap).astype(numpy.float32)
+        tiled = numpy.tile(thresholds,(him//mh+1,wim//mw+1))[:him,:wim]
+        pixels = numpy.asarray(image)
+        return self.bilevel(pixels >= tiled)
+
+    def bilevel(self,white):
+        im = Image.fromarray(white.astype(numpy.uint8)*255,"L")
+        return im.convert('1',dither=Image.NONE)
+
+    def error_diffusion(self,image,kernel):
+        wim,him = image.size
+        pixels = numpy.asarray(image)
+        total  = float(sum([tap[2] for tap in kernel]))
+        pad_x  = max([abs(tap[0]) for tap in kernel])
+        pad_y  = max([tap[1] for tap in kernel])
+        # slope of the wavefront lines (x + a*y = t)
+        a = 1
+        for dx,dy,wgt in kernel:
+            if dy > 0:
+                a = max(a,(-dx)//dy+1)
+
+        stride = wim+2*pad_x
+        band_rows = max(1,min(self.band_rows,him))
+        buf = numpy.zeros((band_rows+pad_y,stride),numpy.float32)
+        flat = buf.ravel()
+        out  = numpy.empty((him,wim),numpy.bool_)
+        taps = [(dy*stride+dx,wgt/total) for dx,dy,wgt in kernel]
+
+        for y0 in range(0,him,band_rows):
+            rows = min(band_rows,him-y0)
+            # carry the error diffused past the previous band
+            buf[:pad_y,:]  = buf[band_rows:band_rows+pad_y,:]
+            buf[pad_y:,:]  = 0.0
+            buf[:rows,pad_x:pad_x+wim] += pixels[y0:y0+rows,:]
+            out_flat = out[y0:y0+rows].ravel()
+            step  = stride-a
+            ostep = wim-a
+            for t in range(0,wim+a*(rows-1)):
+                ymin = max(0,(t-wim)//a+1)
+                ymax = min(rows-1,t//a)
+                if ymin > ymax:
+                    continue
+                n  = ymax-ymin+1
+                i0 = ymin*stride+t-a*ymin+pad_x
+                i1 = i0+(n-1)*step+1
+                vals  = flat[i0:i1:step]
+                white = vals >= 128.0
+                err   = vals-255.0*white
+                o0 = ymin*wim+t-a*ymin
+                out_flat[o0:o0+(n-1)*ostep+1:ostep] = white
+                for offset,wgt in taps:
+                    flat[i0+offset:i1+offset:step] += err*wgt
+        return self.bilevel(out)
+
+
+if __name__ == '__main__':
+    # Benchmark each method: python dither.py [size]
+    import sys
+    from time import time
+    size = 10000
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    grad = Image.linear_gradient("L").resize((size,size))
+    dith = Dither()
+    for method in Dither.METHODS:
+        t0 = time()
+        im = dith.dither(grad,method)
+        t1 = time()
+        level = sum(im.convert("L").histogram()[128:])/float(size*size)
+        print("%-16s %dx%d: %6.2fs  white fraction %.3f" %(method,size,size,t1-t0,level))
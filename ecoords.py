@@ -23,6 +23,7 @@ class ECoord:
         
     def reset(self):
         self.image      = None
+        self.image_ystep= 1
         self.reset_path()
 
     def reset_path(self):
@@ -83,8 +84,18 @@ class ECoord:
         self.computeEcoordsLen()
         self.data_sorted=data_sorted
 
-    def set_image(self,PIL_image):
+    def set_raster(self,ecoords,length,n_scanlines,data_sorted=True):
+        # Raster ecoords (a list, raster run arrays or a TiledRaster) with
+        # the engraving length and number of scan lines found while
+        # scanning.  The image and image_ystep are kept (see set_image).
+        self.set_ecoords(ecoords,data_sorted)
+        self.len = length
+        self.n_scanlines = n_scanlines
+
+    def set_image(self,PIL_image,ystep=1):
+        # ystep is the spacing of the image rows in mils
         self.image = PIL_image
+        self.image_ystep = ystep
         self.reset_path()
 
     def computeEcoordsLen(self):  
@@ -94,6 +105,11 @@ class ECoord:
         if self.ecoords == [] :
             self.len=0
             return
+        if hasattr(self.ecoords,"path_lengths"):
+            # Raster run arrays work out the lengths themselves
+            self.len,self.move,self.bounds = self.ecoords.path_lengths()
+            self.gcode_time = 0
+            return
         on = 0
         move = 0
         time = 0
@@ -26,12 +26,508 @@ from shutil import copyfile
 from math import *
 from interpolate import interpolate
 from time import time
+from itertools import chain
+import multiprocessing
 from LaserSpeed import LaserSpeed
 
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY=False
+
+##############################################################################
+def distance_code(dist_mils):
+    # Codes for a distance of 0 to 254 mils
+    code = []
+    if dist_mils==0:
+        pass
+    elif dist_mils < 26:  # codes  "a" through  "y"
+        code.append(96+dist_mils)
+    elif dist_mils < 52:  # codes "|a" through "|z"
+        code.append(124)
+        code.append(96+dist_mils-25)
+    elif dist_mils < 255:
+        num_str =  "%03d" %(dist_mils)
+        code.append(ord(num_str[0]))
+        code.append(ord(num_str[1]))
+        code.append(ord(num_str[2]))
+    else:
+        raise Exception("Error in EGV distance_code(): dist_mils=",dist_mils)
+    return tuple(code)
+
+# The distance codes for 0 to 254 mils.  Longer distances are a "z"
+# (255 mils) for every 255 mils followed by the code of the remainder.
+DISTANCE_CODES = tuple([distance_code(d) for d in range(255)])
+
+
+##############################################################################
+#  The one wire CRC algorithm is derived from the OneWire.cpp Library
+#  The library location: http://www.pjrc.com/teensy/td_libs_OneWire.html
+def crc_table_entry(value):
+    # CRC of the eight bits of value (the same steps as OneWire.cpp)
+    crc = value
+    for j in range(8):
+        mix = crc & 0x01
+        crc >>= 1
+        if (mix):
+            crc ^= 0x8C
+    return crc
+
+# The CRC after one more byte is CRC_TABLE[crc ^ byte]
+CRC_TABLE = tuple([crc_table_entry(v) for v in range(256)])
+
+def onewire_crc(line):
+    crc=0
+    for inbyte in line:
+        crc = CRC_TABLE[crc ^ inbyte]
+    return crc
+
+
+##############################################################################
+class EgvSink:
+    '''
+    Collects EGV data in a bytearray.  Pass it (or a plain bytearray) to
+    egv() as the target so the codes are stored one byte each instead of as
+    a list of Python ints.
+
+    If out is given (e.g. the write() method of a file opened in binary
+    mode, or a function that sends the data on to the laser) the data is
+    handed to it in chunks of about chunk_size bytes as it is made, and
+    only the part that has not been passed on yet is kept in memory.  The
+    last hold bytes are not passed on until flush() is called so they can
+    still be changed (see write_egv_job).
+    '''
+    def __init__(self, out=None, chunk_size=64*1024, hold=0):
+        self.data       = bytearray()
+        self.out        = out
+        self.chunk_size = chunk_size
+        self.hold       = hold
+        self.limit      = chunk_size+hold
+        self.nbytes     = 0 # bytes passed on to out
+
+    def append(self,code):
+        self.data.append(code)
+        if self.out != None and len(self.data) >= self.limit:
+            self.flush(self.hold)
+
+    def extend(self,codes):
+        self.data.extend(codes)
+        if self.out != None and len(self.data) >= self.limit:
+            self.flush(self.hold)
+
+    def flush(self,hold=0):
+        # pass on everything except the last hold bytes
+        n = len(self.data)-hold
+        if self.out != None and n > 0:
+            chunk = self.data
+            self.data = chunk[n:]
+            del chunk[n:]
+            self.out(chunk)
+            self.nbytes = self.nbytes+n
+
+    def getbuffer(self):
+        # View of the data that has not been passed on (no copy)
+        return memoryview(self.data)
+
+    def __len__(self):
+        return self.nbytes+len(self.data)
+
+
+def write_egv_job(operations,sink,update_gui=None,stop_calc=None):
+    '''
+    Write a complete job into sink (an EgvSink made with hold=4): the "I"
+    that starts the job followed by every pass of every operation.
+    operations is a list of (encode, passes) where encode is an
+    EgvOperation (or any function called as encode(target,update_gui,
+    stop_calc)) or the data of one pass if it has already been made.
+    Each pass ends with "FNSE", the "F" is changed to "@" when more data
+    follows.
+
+    Operations with a single pass are written straight into the sink so
+    the data can be passed on while it is being made.
+    '''
+    sink.append(ord("I"))
+    for encode,passes in operations:
+        if not callable(encode):
+            data = encode
+        elif passes > 1:
+            data = bytearray()
+            encode(data,update_gui,stop_calc)
+        else:
+            data = None
+        for k in range(passes):
+            if len(sink) > 4:
+                sink.data[-4]=ord("@")
+            if data == None:
+                encode(sink,update_gui,stop_calc)
+            else:
+                sink.extend(data)
+    sink.flush()
+
+
+class EgvJob:
+    '''
+    A job made of segments (the data of one operation) that are each sent
+    passes times after the header.  The data of a segment is stored once
+    however many passes it has: chunks() gives views of the stored data
+    for every pass and only the byte that links a pass to the next one is
+    changed ("F" of the closing "FNSE" becomes "@").  The stored data
+    itself is not changed so it can be shared (see EgvCache).
+    '''
+    def __init__(self,header=b"I"):
+        self.header   = bytearray(header)
+        self.segments = []
+
+    def append(self,data,passes=1):
+        if passes > 0 and len(data) > 0:
+            self.segments.append((data,passes))
+
+    def __len__(self):
+        nbytes = len(self.header)
+        for data,passes in self.segments:
+            nbytes = nbytes+len(data)*passes
+        return nbytes
+
+    def chunks(self,chunk_size=64*1024):
+        yield self.header
+        for iseg in range(len(self.segments)):
+            data,passes = self.segments[iseg]
+            view = memoryview(data)
+            n = len(data)
+            for k in range(passes):
+                last = iseg == len(self.segments)-1 and k == passes-1
+                if last or n < 4:
+                    end = n
+                else:
+                    end = n-4
+                for i in range(0,end,chunk_size):
+                    piece = view[i:min(i+chunk_size,end)]
+                    if sys.version_info[0] < 3:
+                        # Python 2 memoryview items are strings
+                        piece = bytearray(piece)
+                    yield piece
+                if end < n:
+                    yield bytearray([ord("@")])+bytearray(view[n-3:])
+
+    def tobytes(self):
+        data = bytearray()
+        for chunk in self.chunks():
+            data.extend(chunk)
+        return data
+
+
+def make_egv_job(operations,update_gui=None,stop_calc=None):
+    '''
+    Make the EGV data of each operation once and return the job as an
+    EgvJob.  operations is the same as for write_egv_job.
+    '''
+    job = EgvJob()
+    for encode,passes in operations:
+        if callable(encode):
+            data = bytearray()
+            encode(data,update_gui,stop_calc)
+        else:
+            data = encode
+        job.append(data,passes)
+    return job
+
+
+class EgvOperation:
+    '''
+    One operation of a job (vector cut, raster engrave, ...): the ecoords
+    and the keyword arguments of egv.make_egv_data.  Calling it writes the
+    EGV data into target.  It can be pickled so the data can be made in
+    another process (see encode_operations).
+    '''
+    def __init__(self,ecoords,**kwargs):
+        self.ecoords = ecoords
+        self.kwargs  = kwargs
+
+    def __call__(self,target,update_gui=None,stop_calc=None):
+        egv_inst = egv(target=target)
+        egv_inst.make_egv_data(self.ecoords,update_gui=update_gui,stop_calc=stop_calc,**self.kwargs)
+
+    def use_pool(self):
+        # ecoords that are not a plain list (e.g. a TiledRaster that reads its
+        # image band by band) and operations that start their own pool of
+        # processes are made in this process
+        return isinstance(self.ecoords,list) and self.kwargs.get("processes",1) <= 1
+
+
+def encode_operation(operation):
+    data = bytearray()
+    operation(data)
+    return data
+
+
+def encode_operations(operations,processes,update_gui=None,stop_calc=None):
+    '''
+    Make the EGV data of several independent operations at the same time,
+    one operation per process.  Operations that can not be sent to another
+    process are made here while the pool works on the others.  Returns the
+    data of each operation in the same order as operations.
+    '''
+    if stop_calc == None:
+        stop_calc=[]
+        stop_calc.append(0)
+    if update_gui == None:
+        update_gui = lambda msg=None,bgcolor=None: False
+    pool_ops = [k for k in range(len(operations)) if operations[k].use_pool()]
+    if processes < 2 or len(operations) < 2 or pool_ops == []:
+        pool_ops = []
+    results = [None]*len(operations)
+    pool = None
+    try:
+        if pool_ops != []:
+            pool = multiprocessing.Pool(min(processes,len(pool_ops)))
+            for k in pool_ops:
+                results[k] = pool.apply_async(encode_operation,(operations[k],))
+        for k in range(len(operations)):
+            if results[k] == None:
+                results[k] = bytearray()
+                operations[k](results[k],update_gui,stop_calc)
+        for i in range(len(pool_ops)):
+            k = pool_ops[i]
+            while not results[k].ready():
+                update_gui("Generating EGV Data: Waiting for %d Operations" %(len(pool_ops)-i))
+                if stop_calc[0]==True:
+                    raise Exception("Action Stopped by User.")
+                results[k].wait(0.1)
+            results[k] = results[k].get()
+    finally:
+        if pool != None:
+            pool.terminate()
+    return results
+
+
+##############################################################################
+class RapidPlanner:
+    '''
+    Chooses how egv.make_egv_data makes each laser off move in vector
+    data, by the time each way is expected to take:
+
+    SLOW  - move at the cut speed without leaving compact mode
+    FAST  - rapid_move_fast: stop, move at the controller's rapid speed
+            and start again (N...SE)
+    RAPID - rapid_move_slow with a Rapid_Feed_Rate: change to that speed,
+            move and change back
+
+    The speeds are the ones the controller really uses for the speed
+    codes (LaserSpeed gear model).  Stopping and starting again is taken
+    to cost the same as turning around at the end of a raster line, using
+    the times measured for the raster engraving time estimate.  FAST is not
+    used when a Rapid_Feed_Rate is set (e.g. for the rotary) since that
+    asks for laser off moves at that speed.
+
+    old_time and new_time add up the expected time of the moves made the
+    old way (FAST unless shorter than min_rapid in x and y) and the chosen
+    way.
+    '''
+    SLOW  = "slow"
+    FAST  = "fast"
+    RAPID = "rapid"
+    # same estimate as the job time in k40_whisperer
+    RAPID_SPEED = 100.0 # mm/s
+
+    def __init__(self,board_name="LASER-M2",rapid_speed=RAPID_SPEED,min_rapid=5):
+        self.board       = board_name.split('-')[1]
+        self.rapid_speed = rapid_speed
+        self.min_rapid   = min_rapid
+        self.speeds      = {}
+        self.old_time    = 0.0
+        self.new_time    = 0.0
+
+    @staticmethod
+    def accel_time(mm_per_second):
+        # measured time to turn around at the end of a raster line
+        feed = mm_per_second*60.0/25.4 # in/min
+        if feed <= 300:
+            return 8.3264*feed**(-0.7451)
+        return 2.5913*feed**(-0.4795)
+
+    def mils_per_second(self,Feed):
+        if Feed not in self.speeds:
+            speed_text = LaserSpeed.get_code_from_speed(Feed, 0, board=self.board)
+            speed = LaserSpeed.get_speed_from_code(speed_text, board=self.board)
+            self.speeds[Feed] = speed*1000.0/25.4
+        return self.speeds[Feed]
+
+    def slow_time(self,dx,dy,Feed):
+        return (abs(dx)+abs(dy))/self.mils_per_second(Feed)
+
+    def fast_time(self,dx,dy,Feed):
+        # see rapid_move_fast
+        pad = 3
+        if pad == -dx:
+            pad = pad+3
+        return 2*pad/self.mils_per_second(Feed) + self.accel_time(Feed) + \
+               (abs(dx+pad)+abs(dy-pad))/(self.rapid_speed*1000.0/25.4)
+
+    def rapid_time(self,dx,dy,Feed,Rapid_Feed_Rate):
+        # see change_speed, each change moves out and back 5 mils in x and y
+        cspad = 5
+        return 4*cspad/self.mils_per_second(Feed) + self.accel_time(Feed) + \
+               4*cspad/self.mils_per_second(Rapid_Feed_Rate) + self.accel_time(Rapid_Feed_Rate) + \
+               (abs(dx)+abs(dy))/self.mils_per_second(Rapid_Feed_Rate)
+
+    def choose(self,dx,dy,Feed,Rapid_Feed_Rate=0):
+        options = {self.SLOW: self.slow_time(dx,dy,Feed)}
+        if Rapid_Feed_Rate:
+            options[self.RAPID] = self.rapid_time(dx,dy,Feed,Rapid_Feed_Rate)
+            old = self.RAPID
+        else:
+            options[self.FAST] = self.fast_time(dx,dy,Feed)
+            if (abs(dx) < self.min_rapid) and (abs(dy) < self.min_rapid):
+                old = self.SLOW
+            else:
+                old = self.FAST
+        best = old
+        for option in options:
+            if options[option] < options[best]:
+                best = option
+        self.old_time = self.old_time + options[old]
+        self.new_time = self.new_time + options[best]
+        return best
+
+    def time_saved(self):
+        return self.old_time-self.new_time
+
+    def plan(self,ecoords,Feed,Rapid_Feed_Rate=0,scale=1000.0):
+        '''
+        Choose the laser off moves between the loops of vector ecoords the
+        way make_egv_data does, without making the data (e.g. for the job
+        time estimate).  Returns the expected time saved in seconds.
+        '''
+        if len(ecoords) == 0:
+            return self.time_saved()
+        lastx     = int(round(ecoords[0][0]*scale,0))
+        lasty     = int(round(ecoords[0][1]*scale,0))
+        last_loop = ecoords[0][2]
+        laser     = False
+        rapid_dx  = 0
+        rapid_dy  = 0
+        for i in range(1,len(ecoords)):
+            x    = int(round(ecoords[i][0]*scale,0))
+            y    = int(round(ecoords[i][1]*scale,0))
+            loop = ecoords[i][2]
+            if ( loop == last_loop) and (not laser):
+                laser = True
+            elif ( loop != last_loop) and (laser):
+                laser = False
+            dx = x - lastx
+            dy = y - lasty
+            if (abs(dx)+abs(dy))>0:
+                if not laser:
+                    rapid_dx = rapid_dx + dx
+                    rapid_dy = rapid_dy + dy
+                elif rapid_dx != 0 or rapid_dy != 0:
+                    self.choose(rapid_dx,rapid_dy,Feed,Rapid_Feed_Rate)
+                    rapid_dx = 0
+                    rapid_dy = 0
+            lastx     = x
+            lasty     = y
+            last_loop = loop
+        return self.time_saved()
+
+
+class FeedPolicy:
+    '''
+    Groups the feed rates of G-code ecoords ([x, y, loop, feed, spindle]
+    with the feed in in/min, as used by make_egv_data with Feed=None).
+    make_egv_data changes the speed, which stops the head, every time the
+    feed of a cut is different from the one before, so CAM output that
+    varies the feed a little along curves makes a lot of speed changes.
+
+    Each feed (in mm/s) is limited to min_feed..max_feed (0 for no
+    limit) and rounded to a multiple of step (0 to leave it).  A cut with
+    a feed within tolerance (a fraction, 0.05 is 5%) of the feed of the
+    group before it joins that group and uses its feed.
+
+    apply() keeps the number of speed changes before and after in
+    changes_before and changes_after.
+    '''
+    FEED_SCALE = 25.4/60.0 # in/min to mm/s, same as make_egv_data
+
+    def __init__(self,tolerance=0.0,min_feed=0.0,max_feed=0.0,step=0.0):
+        self.tolerance      = tolerance
+        self.min_feed       = min_feed
+        self.max_feed       = max_feed
+        self.step           = step
+        self.changes_before = 0
+        self.changes_after  = 0
+
+    def enabled(self):
+        return self.tolerance > 0 or self.min_feed > 0 or self.max_feed > 0 or self.step > 0
+
+    def limit(self,feed):
+        if self.min_feed > 0:
+            feed = max(feed,self.min_feed)
+        if self.max_feed > 0:
+            feed = min(feed,self.max_feed)
+        if self.step > 0:
+            feed = max(1,int(round(feed/self.step)))*self.step
+        return feed
+
+    @staticmethod
+    def cuts(ecoords):
+        # True for the points make_egv_data cuts to (same loop as the point before)
+        cut = [False]
+        for i in range(1,len(ecoords)):
+            cut.append(ecoords[i][2] == ecoords[i-1][2] and ecoords[i][:2] != ecoords[i-1][:2])
+        return cut
+
+    def speed_changes(self,ecoords):
+        # counted the same way make_egv_data changes the speed
+        if ecoords == []:
+            return 0
+        cut = self.cuts(ecoords)
+        Feed = round(ecoords[0][3]*self.FEED_SCALE,2)
+        changes = 0
+        for i in range(1,len(ecoords)):
+            if cut[i]:
+                Feed_current = round(ecoords[i][3]*self.FEED_SCALE,2)
+                if Feed != Feed_current:
+                    Feed = Feed_current
+                    changes = changes+1
+        return changes
+
+    def apply(self,ecoords):
+        '''
+        Returns a copy of ecoords with the grouped feeds
+        '''
+        self.changes_before = self.speed_changes(ecoords)
+        cut = self.cuts(ecoords)
+        result = []
+        group = None
+        for i in range(len(ecoords)):
+            point = list(ecoords[i])
+            # the first point sets the starting speed, moves between cuts
+            # use the speed that is set
+            if i == 0 or cut[i]:
+                feed = self.limit(point[3]*self.FEED_SCALE)
+                if group == None or abs(feed-group) > self.tolerance*group:
+                    group = feed
+            point[3] = group/self.FEED_SCALE
+            result.append(point)
+        self.changes_after = self.speed_changes(result)
+        return result
+
+    def changes_removed(self):
+        return self.changes_before-self.changes_after
+
+
 ##############################################################################
 class egv:
     def __init__(self, target=lambda s: sys.stdout.write(s)):
-        self.write = target
+        # target is either a function called with each code or something
+        # with append() and extend() (bytearray, EgvSink, list) that the
+        # codes are added to directly
+        if hasattr(target,"append") and hasattr(target,"extend"):
+            self.write       = target.append
+            self.write_codes = target.extend
+        else:
+            self.write = target
         self.Modal_dir  = 0
         self.Modal_dist = 0
         self.Modal_on   = False
@@ -54,6 +550,10 @@ class egv:
         # V is the start of 7 digits indicating the feed rate 255 255 1
         # CUT_TYPE cutting/marking, Engraving=G followed by the raster step in thousandths of an inch 
 
+    def write_codes(self,codes):
+        for code in codes:
+            self.write(code)
+
     def move(self,direction,distance,laser_on=False,angle_dirs=None):
 
         if angle_dirs==None:
@@ -94,8 +594,7 @@ class egv:
     def flush(self,laser_on=None):
         if self.Modal_dist > 0:
             self.write(self.Modal_dir)
-            for code in self.make_distance(self.Modal_dist):
-                self.write(code)
+            self.write_codes(self.make_distance(self.Modal_dist))
         if (laser_on!=None) and (laser_on!=self.Modal_on):
             if laser_on:
                 self.write(self.ON)
@@ -104,50 +603,26 @@ class egv:
             self.Modal_on   = laser_on
         self.Modal_dist = 0
 
-        
-    #  The one wire CRC algorithm is derived from the OneWire.cpp Library
-    #  The library location: http://www.pjrc.com/teensy/td_libs_OneWire.html
+
     def OneWireCRC(self,line):
-        crc=0
-        for i in range(len(line)):
-            inbyte=line[i]
-            for j in range(8):
-                mix = (crc ^ inbyte) & 0x01
-                crc >>= 1
-                if (mix):
-                    crc ^= 0x8C
-                inbyte >>= 1
-        return crcS
+        return onewire_crc(line)
 
 
     def make_distance(self,dist_mils):
-        dist_mils=float(dist_mils)
-        if abs(dist_mils-round(dist_mils,0)) > 0.000001:
-            raise Exception('Distance values should be integer value (inches*1000)')
-        DIST=0.0
-        code = []
-        v122 = 255
-        dist_milsA = int(dist_mils)
-        
-        for i in range(0,int(floor(dist_mils/v122))):
-            code.append(122)
-            dist_milsA = dist_milsA-v122
-            DIST = DIST+v122
-        if dist_milsA==0:
-            pass
-        elif dist_milsA < 26:  # codes  "a" through  "y"
-            code.append(96+dist_milsA)
-        elif dist_milsA < 52:  # codes "|a" through "|z"
-            code.append(124)
-            code.append(96+dist_milsA-25)
-        elif dist_milsA < 255:
-            num_str =  "%03d" %(int(round(dist_milsA)))
-            code.append(ord(num_str[0]))
-            code.append(ord(num_str[1]))
-            code.append(ord(num_str[2]))
-        else:
-            raise Exception("Error in EGV make_distance_in(): dist_milsA=",dist_milsA)
-        return code
+        '''
+        Returns the distance codes for dist_mils as a tuple (see
+        DISTANCE_CODES)
+        '''
+        if not isinstance(dist_mils,int):
+            dist_mils=float(dist_mils)
+            if abs(dist_mils-round(dist_mils,0)) > 0.000001:
+                raise Exception('Distance values should be integer value (inches*1000)')
+            dist_mils = int(dist_mils)
+        if dist_mils < 255:
+            return DISTANCE_CODES[dist_mils]
+        # "z" moves 255 mils
+        n255,dist_milsA = divmod(dist_mils,255)
+        return (122,)*n255 + DISTANCE_CODES[dist_milsA]
     
     def make_dir_dist(self,dxmils,dymils,laser_on=False):
         adx = abs(dxmils)
@@ -185,7 +660,6 @@ class egv:
         elif dxmils==dymils:
             self.move(self.ANGLE,abs(dxmils),laser_on=Spindle,angle_dirs=[XCODE,YCODE])
         else:
-            h=[]
             if adx > ady:
                 slope = ady/adx
                 n = int(abs(dxmils))
@@ -197,38 +671,15 @@ class egv:
                 CODE  = YCODE
                 CODE1 = XCODE
 
-            for i in range(1,n+1):
-                h.append(round(i*slope,0))
-
-            Lh=0.0
-            d1=0.0
-            d2=0.0
-            d1cnt=0.0
-            d2cnt=0.0
-            for i in range(len(h)):
-                if h[i]==Lh:
-                    d1=d1+1
-                    if d2>0.0:
-                        self.move(self.ANGLE,d2,laser_on=Spindle,angle_dirs=[XCODE,YCODE])
-                        d2cnt=d2cnt+d2
-                        d2=0.0
+            d1cnt=0
+            d2cnt=0
+            for diagonal,length in self.cut_line_runs(n,slope):
+                if diagonal:
+                    self.move(self.ANGLE,length,laser_on=Spindle,angle_dirs=[XCODE,YCODE])
+                    d2cnt=d2cnt+length
                 else:
-                    d2=d2+1
-                    if d1>0.0:
-                        self.move(CODE,d1,laser_on=Spindle)
-                        d1cnt=d1cnt+d1
-                        d1=0.0
-                Lh=h[i]
-
-            if d1>0.0:
-                self.move(CODE,d1,laser_on=Spindle)
-                d1cnt=d1cnt+d1
-                d1=0.0
-            if d2>0.0:
-                self.move(self.ANGLE,d2,laser_on=Spindle,angle_dirs=[XCODE,YCODE])
-                d2cnt=d2cnt+d2
-                d2=0.0
-
+                    self.move(CODE,length,laser_on=Spindle)
+                    d1cnt=d1cnt+length
         
             DX = d2cnt
             DY = (d1cnt+d2cnt)
@@ -240,6 +691,53 @@ class egv:
                 raise Exception("egv.py: Error delta =%f" %(error))
 
 
+    def cut_line_runs(self,n,slope):
+        '''
+        Split a sloped line that is n mils long along its major axis into
+        runs of straight and diagonal steps.  Step i (1..n) is diagonal
+        when round(i*slope) is larger than for step i-1.  Returns a list of
+        (diagonal, length) tuples.
+
+        Only the positions of the less common kind of step are searched
+        for (from an estimate, checked with the same rounding), so the
+        work depends on the number of runs and not on the length.
+        '''
+        m = int(round(n*slope,0))
+        diag_rare = 2*m <= n
+        if diag_rare:
+            # diagonal steps up to step i
+            count   = lambda i: round(i*slope,0)
+            rate    = slope
+            nevents = m
+        else:
+            # straight steps up to step i
+            count   = lambda i: i-round(i*slope,0)
+            rate    = 1.0-slope
+            nevents = n-m
+
+        runs = []
+        last = 0
+        for k in range(1,nevents+1):
+            x = (k-0.5)/rate
+            i = int(ceil(x))
+            if not (1e-6 < (i-x)*rate < rate-1e-6) or i <= last or i > n:
+                # too close to a rounding tie to trust the estimate
+                i = min(max(i,last+1),n)
+                while count(i) < k:
+                    i = i+1
+                while i-1 > last and count(i-1) >= k:
+                    i = i-1
+            if i-last > 1:
+                runs.append((not diag_rare,i-last-1))
+            if runs and runs[-1][0] == diag_rare:
+                runs[-1] = (diag_rare,runs[-1][1]+1)
+            else:
+                runs.append((diag_rare,1))
+            last = i
+        if n > last:
+            runs.append((not diag_rare,n-last))
+        return runs
+
     def make_speed(self,Feed=None,board_name="LASER-M2",Raster_step=0):
         board_code = board_name.split('-')[1]
         speed_text = LaserSpeed.get_code_from_speed(Feed, abs(Raster_step), board=board_code)
@@ -274,6 +772,234 @@ class egv:
         return e0,e1,e2
 
 
+    def raster_scanlines(self,ecoords_in,Raster_step,FlipXoffset,update_gui,scale=1000.0):
+        '''
+        Returns (first_scan, scanlines, number of scanlines) with the scan
+        lines in the order they are engraved.  The points of the scan lines
+        are in mils with FlipXoffset applied (see ecoord_adj).
+        '''
+        if hasattr(ecoords_in,"scanlines"):
+            # Tiled raster data generates its scan lines band by band
+            scanline  = ecoords_in.scanlines(bottom_up=(Raster_step > 0.0),reverse_x=bool(FlipXoffset))
+            scanline  = (self.scan_adj(scan,scale,FlipXoffset) for scan in scanline)
+            nscanline = ecoords_in.n_scanlines
+        else:
+            update_gui("Preprocessing Raster Data")
+            nscanline,scanline = self.scanline_rows(ecoords_in,Raster_step,FlipXoffset,scale)
+        first_scan = next(scanline)
+        scanline   = chain([first_scan],scanline)
+        update_gui("Raster Data Ready")
+        return first_scan,scanline,nscanline
+
+    def scan_adj(self,scan,scale,FlipXoffset):
+        return [list(self.ecoord_adj(point,scale,FlipXoffset)) for point in scan]
+
+    def scanline_rows(self,ecoords_in,Raster_step,FlipXoffset,scale):
+        '''
+        Split a list of raster points into scan lines (runs of points with
+        the same y), converted to mils.  The rows are engraved from the end
+        of the list back to the start for a positive Raster_step, and the
+        points of each row are in reverse order with FlipXoffset.  All the
+        points are converted at once and each row is made from a slice of
+        them when it is needed, so the time is linear in the number of
+        points.  Returns the number of rows and a generator of the rows.
+        '''
+        n = len(ecoords_in)
+        if NUMPY:
+            points = numpy.array(ecoords_in,dtype=numpy.float64).reshape(n,-1)
+            if FlipXoffset > 0:
+                x = numpy.rint((FlipXoffset-points[:,0])*scale)
+            else:
+                x = numpy.rint(points[:,0]*scale)
+            y = numpy.rint(points[:,1]*scale)
+            x = x.astype(numpy.int64).tolist()
+            y = y.astype(numpy.int64).tolist()
+            loop = [e[2] for e in ecoords_in]
+            starts = (numpy.flatnonzero(points[1:,1] != points[:-1,1])+1).tolist()
+        else:
+            x = []
+            y = []
+            loop = []
+            starts = []
+            for i in range(n):
+                e0,e1,e2 = self.ecoord_adj(ecoords_in[i],scale,FlipXoffset)
+                x.append(e0)
+                y.append(e1)
+                loop.append(e2)
+                if i > 0 and ecoords_in[i][1] != ecoords_in[i-1][1]:
+                    starts.append(i)
+        bounds = list(zip([0]+starts,starts+[n]))
+        if Raster_step > 0.0:
+            bounds.reverse()
+        def rows():
+            for a,b in bounds:
+                row = [[e0,y[a],e2] for e0,e2 in zip(x[a:b],loop[a:b])]
+                if FlipXoffset:
+                    row.reverse()
+                yield row
+        return len(bounds),rows()
+
+    def raster_line(self,scan,state,Raster_step,Rapid_Feed_Rate,Feed,board_name):
+        '''
+        Write the EGV data for one raster scan line.  state holds
+        [lastx, lasty, sign, Rapid_flag] and is updated for the next line.
+        '''
+        lastx,lasty,sign,Rapid_flag = state
+        ######################################
+        ## Flip direction and reset loop    ##
+        ######################################
+        sign      = -sign
+        last_loop =  None
+        y         =  scan[0][1]
+        dy        =  y-lasty
+        if sign == 1:
+            xr = scan[0][0]
+        else:
+            xr = scan[-1][0]
+        dxr = xr - lastx
+        ######################################
+        ## Make Rapid move if needed        ##
+        ######################################
+        if abs(dy-Raster_step) != 0 and not Rapid_flag: 
+
+            if dxr*sign < 0:
+                yoffset = -Raster_step*3
+            else:
+                yoffset = -Raster_step
+
+            if (dy+yoffset)*(abs(yoffset)/yoffset) < 0:
+                self.flush(laser_on=False)
+
+                if not Rapid_Feed_Rate:
+                    self.write(ord("N"))
+                    self.make_dir_dist(0,dy+yoffset)
+                    self.flush(laser_on=False)
+                    self.write(ord("S"))
+                    self.write(ord("E"))
+                else:
+                    DX=0
+                    DY=dy+yoffset
+                    self.raster_rapid_move_slow(DX,DY,Raster_step,Rapid_Feed_Rate,Feed,board_name)
+
+                Rapid_flag=True
+            else:
+                adj_steps = int(dy/Raster_step)
+                for stp in range(1,adj_steps):
+
+                    adj_dist=5
+                    self.make_dir_dist(sign*adj_dist,0)
+                    lastx = lastx + sign*adj_dist
+
+                    sign  = -sign
+                    if sign == 1:
+                        xr = scan[0][0]
+                    else:
+                        xr = scan[-1][0]
+                    dxr = xr - lastx
+            lasty = y
+
+
+        ######################################
+        if sign == 1:
+            rng = range(0,len(scan),1)
+        else:
+            rng = range(len(scan)-1,-1,-1)
+        ######################################
+        ## Pad row end if needed ##
+        ###########################
+        pad = 2
+        if (dxr*sign <= 0.0):
+            if (Rapid_flag == False):
+                self.make_dir_dist(-sign*pad,0)
+                self.make_dir_dist( dxr,0)
+                self.make_dir_dist( sign*pad,0)
+            else:
+                self.make_dir_dist( dxr,0)
+            lastx = lastx+dxr
+
+        Rapid_flag=False
+        ######################################   
+        for j in rng:
+            x  = scan[j][0]
+            dx = x - lastx
+            ##################################
+            loop = scan[j][2]
+            if loop==last_loop:
+                self.make_cut_line(dx,0,True)
+            else:
+                if dx*sign > 0.0:
+                    self.make_dir_dist(dx,0)
+            lastx     = x
+            last_loop = loop
+        lasty = y
+        state[:] = [lastx,lasty,sign,Rapid_flag]
+
+    def raster_lines_parallel(self,scanline,nscanline,state,
+                              Raster_step,Rapid_Feed_Rate,Feed,board_name,
+                              processes,update_gui,stop_calc):
+        '''
+        Same as calling raster_line() for every scan line but the lines are
+        split into chunks that are encoded in a pool of processes.
+
+        The position and direction at the start of each chunk only depend
+        on the first and last point of the scan lines before it, so they
+        are found with a quick pass over the line ends.  The pending move
+        (modal state) is found by each worker encoding the line before its
+        chunk first.  If that does not give the same modal state as the end
+        of the previous chunk the chunk is encoded again here, so the result
+        is always the same as the serial encoder.
+        '''
+        update_gui("Generating EGV Data: Preparing Chunks")
+        scans = list(scanline)
+        nchunks = processes*4
+        size = max(1,(len(scans)+nchunks-1)//nchunks)
+
+        ends = egv(target=self.none_function)
+        line_state = list(state)
+        jobs = []
+        for i in range(len(scans)):
+            if i%size == 0:
+                if i == 0:
+                    warm_scan  = None
+                    warm_state = None
+                else:
+                    warm_scan  = scans[i-1]
+                    warm_state = prev_state
+                jobs.append([scans[i:i+size],list(line_state),warm_scan,warm_state])
+            prev_state = list(line_state)
+            ends.raster_line([scans[i][0],scans[i][-1]],line_state,Raster_step,Rapid_Feed_Rate,Feed,board_name)
+
+        modal = self.get_modal()
+        params = (Raster_step,Rapid_Feed_Rate,Feed,board_name,modal)
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap(encode_raster_chunk,[job+[params] for job in jobs])
+            for k in range(len(jobs)):
+                data,start_modal,end_modal = next(results)
+                if start_modal != modal:
+                    # restart the chunk from the modal state it really starts with
+                    self.set_modal(modal)
+                    chunk_state = list(jobs[k][1])
+                    for scan in jobs[k][0]:
+                        self.raster_line(scan,chunk_state,Raster_step,Rapid_Feed_Rate,Feed,board_name)
+                    modal = self.get_modal()
+                else:
+                    self.write_codes(data)
+                    modal = end_modal
+                update_gui("Generating EGV Data: %.1f%%" %(100.0*float(k+1)/float(len(jobs))))
+                if stop_calc[0]==True:
+                    raise Exception("Action Stopped by User.")
+        finally:
+            pool.terminate()
+        self.set_modal(modal)
+        state[:] = line_state
+
+    def get_modal(self):
+        return (self.Modal_dir,self.Modal_dist,self.Modal_on,self.Modal_AX,self.Modal_AY)
+
+    def set_modal(self,modal):
+        self.Modal_dir,self.Modal_dist,self.Modal_on,self.Modal_AX,self.Modal_AY = modal
+
     def make_egv_data(self, ecoords_in,
                             startX=0,
                             startY=0,
@@ -285,7 +1011,9 @@ class egv:
                             stop_calc=None,
                             FlipXoffset=0,
                             Rapid_Feed_Rate=0,
-                            use_laser=True):
+                            use_laser=True,
+                            processes=1,
+                            plan_rapids=False):
 
         #print("make_egv_data",Rapid_Feed_Rate,len(ecoords_in))
         #print("Rapid_Feed_Rate=",Rapid_Feed_Rate)
@@ -320,8 +1048,7 @@ class egv:
         
         if Raster_step==0:
             #self.write(ord("I"))
-            for code in speed:
-                self.write(code)
+            self.write_codes(speed)
 
             lastx,lasty,last_loop = self.ecoord_adj(ecoords_in[0],scale,FlipXoffset)
             if not Rapid_Feed_Rate:
@@ -348,6 +1075,12 @@ class egv:
             
             if Rapid_Feed_Rate:
                 self.rapid_move_slow(lastx-startX,lasty-startY,Rapid_Feed_Rate,Feed,board_name)
+            self.rapid_planner = None
+            if plan_rapids:
+                self.rapid_planner = RapidPlanner(board_name)
+            # laser off moves not made yet, several in a row are made as one
+            rapid_dx = 0
+            rapid_dy = 0
             timestamp=0
             for i in range(1,len(ecoords_in)):
                 e0,e1,e2                = self.ecoord_adj(ecoords_in[i]  ,scale,FlipXoffset)
@@ -365,9 +1098,12 @@ class egv:
                 dx = e0 - lastx
                 dy = e1 - lasty
 
-                min_rapid = 5
                 if (abs(dx)+abs(dy))>0:
                     if laser:
+                        if rapid_dx != 0 or rapid_dy != 0:
+                            self.rapid_move(rapid_dx,rapid_dy,Rapid_Feed_Rate,Feed,board_name)
+                            rapid_dx = 0
+                            rapid_dy = 0
                         if variable_feed_scale!=None:
                             Feed_current    = round(ecoords_in[i][3]*variable_feed_scale,2)
                             Spindle = ecoords_in[i][4] > 0 and use_laser
@@ -376,11 +1112,11 @@ class egv:
                                 self.flush()
                                 self.change_speed(Feed,board_name,laser_on=Spindle)
                         self.make_cut_line(dx,dy,Spindle)
+                    elif self.rapid_planner != None:
+                        rapid_dx = rapid_dx + dx
+                        rapid_dy = rapid_dy + dy
                     else:
-                        if ((abs(dx) < min_rapid) and (abs(dy) < min_rapid)) or Rapid_Feed_Rate:
-                            self.rapid_move_slow(dx,dy,Rapid_Feed_Rate,Feed,board_name)
-                        else:
-                            self.rapid_move_fast(dx,dy)
+                        self.rapid_move(dx,dy,Rapid_Feed_Rate,Feed,board_name)
                         
                 lastx     = e0
                 lasty     = e1
@@ -389,210 +1125,130 @@ class egv:
             if laser:
                 laser = False
                 
-            dx = startX-lastx
-            dy = startY-lasty
-            if ((abs(dx) < min_rapid) and (abs(dy) < min_rapid)) or Rapid_Feed_Rate:
-                self.rapid_move_slow(dx,dy,Rapid_Feed_Rate,Feed,board_name)
-            else:
-                self.rapid_move_fast(dx,dy)
+            dx = startX-lastx + rapid_dx
+            dy = startY-lasty + rapid_dy
+            self.rapid_move(dx,dy,Rapid_Feed_Rate,Feed,board_name)
 
               ###########################################################
         else: # Raster
               ###########################################################
-            Rapid_flag=True
-            ###################################################
-            scanline = []
-            scanline_y = None
-            if Raster_step < 0.0:
-                irange = range(len(ecoords_in))
+            if hasattr(ecoords_in,"blocks"):
+                # Separate islands are rastered one block after the other
+                blocks = ecoords_in.blocks
             else:
-                irange = range(len(ecoords_in)-1,-1,-1)
-            timestamp=0
-            for i in irange:
-                #if i%1000 == 0:
-                stamp=int(3*time()) #update every 1/3 of a second
-                if (stamp != timestamp):
-                    timestamp=stamp #interlock
-                    update_gui("Preprocessing Raster Data: %.1f%%" %(100.0*float(i)/float(len(ecoords_in))))
-                y    = ecoords_in[i][1]
-                if y != scanline_y:
-                    scanline.append([ecoords_in[i]])
-                    scanline_y = y
-                else:
-                    if bool(FlipXoffset) ^ bool(Raster_step > 0.0): # ^ is bitwise XOR
-                        scanline[-1].insert(0,ecoords_in[i])
-                    else:
-                        scanline[-1].append(ecoords_in[i])
-            update_gui("Raster Data Ready")
-            ###################################################
-            lastx,lasty,last_loop = self.ecoord_adj(scanline[0][0],scale,FlipXoffset)
+                blocks = [ecoords_in]
+            scans  = self.raster_scanlines(blocks[0],Raster_step,FlipXoffset,update_gui,scale)
+            blockX = startX
+            blockY = startY
+            for iblock in range(len(blocks)):
+                first_scan,scanline,nscanline = scans
+                Rapid_flag=True
+                lastx,lasty,last_loop = first_scan[0]
             
-            DXstart = lastx-startX
-            DYstart = lasty-startY
+                DXstart = lastx-blockX
+                DYstart = lasty-blockY
 
-            if Rapid_Feed_Rate:
-                self.make_egv_rapid(DXstart,DYstart,Rapid_Feed_Rate,board_name,finish=False)
+                if Rapid_Feed_Rate:
+                    self.make_egv_rapid(DXstart,DYstart,Rapid_Feed_Rate,board_name,finish=False)
 
-            ##self.write(ord("I"))
-            for code in speed:
-                self.write(code)
+                ##self.write(ord("I"))
+                self.write_codes(speed)
 
-            if not Rapid_Feed_Rate:
-                self.make_dir_dist(DXstart,DYstart)
+                if not Rapid_Feed_Rate:
+                    self.make_dir_dist(DXstart,DYstart)
 
-            #insert "NRB"
-            self.flush(laser_on=False)
-            self.write(ord("N"))
-            if (Raster_step < 0.0):
-                self.write(ord("R"))
-            else:
-                self.write(ord("L"))
-            self.write(ord("B"))
-            # Insert "S1E"
-            self.write(ord("S"))
-            self.write(ord("1"))
-            self.write(ord("E"))
-            dx_last   = 0
-
-            sign = -1
-            cnt = 1
-            timestamp=0
-            for scan_raw in scanline:
-                scan = []
-                for point in scan_raw:
-                    e0,e1,e2 = self.ecoord_adj(point,scale,FlipXoffset)
-                    scan.append([e0,e1,e2])
-                stamp=int(3*time()) #update every 1/3 of a second
-                if (stamp != timestamp):
-                    timestamp=stamp #interlock
-                    update_gui("Generating EGV Data: %.1f%%" %(100.0*float(cnt)/float(len(scanline))))
-                    if stop_calc[0]==True:
-                        raise Exception("Action Stopped by User.")
-                cnt = cnt+1
-                ######################################
-                ## Flip direction and reset loop    ##
-                ######################################
-                sign      = -sign
-                last_loop =  None
-                y         =  scan[0][1]
-                dy        =  y-lasty
-                if sign == 1:
-                    xr = scan[0][0]
+                #insert "NRB"
+                self.flush(laser_on=False)
+                self.write(ord("N"))
+                if (Raster_step < 0.0):
+                    self.write(ord("R"))
                 else:
-                    xr = scan[-1][0]
-                dxr = xr - lastx
-                ######################################
-                ## Make Rapid move if needed        ##
-                ######################################
-                if abs(dy-Raster_step) != 0 and not Rapid_flag: 
-                    
-                    if dxr*sign < 0:
-                        yoffset = -Raster_step*3
-                    else:
-                        yoffset = -Raster_step
-                        
-                    if (dy+yoffset)*(abs(yoffset)/yoffset) < 0:
-                        self.flush(laser_on=False)
-
-                        if not Rapid_Feed_Rate:
-                            self.write(ord("N"))
-                            self.make_dir_dist(0,dy+yoffset)
-                            self.flush(laser_on=False)
-                            self.write(ord("S"))
-                            self.write(ord("E"))
-                        else:
-                            DX=0
-                            DY=dy+yoffset
-                            self.raster_rapid_move_slow(DX,DY,Raster_step,Rapid_Feed_Rate,Feed,board_name)
-
-                        Rapid_flag=True
-                    else:
-                        adj_steps = int(dy/Raster_step)
-                        for stp in range(1,adj_steps):
-                            
-                            adj_dist=5
-                            self.make_dir_dist(sign*adj_dist,0)
-                            lastx = lastx + sign*adj_dist
-
-                            sign  = -sign
-                            if sign == 1:
-                                xr = scan[0][0]
-                            else:
-                                xr = scan[-1][0]
-                            dxr = xr - lastx
-                    lasty = y
+                    self.write(ord("L"))
+                self.write(ord("B"))
+                # Insert "S1E"
+                self.write(ord("S"))
+                self.write(ord("1"))
+                self.write(ord("E"))
+                dx_last   = 0
 
-                        
-                ######################################
-                if sign == 1:
-                    rng = range(0,len(scan),1)
+                state = [lastx,lasty,-1,True]
+                if processes > 1:
+                    self.raster_lines_parallel(scanline,nscanline,state,
+                                               Raster_step,Rapid_Feed_Rate,Feed,board_name,
+                                               processes,update_gui,stop_calc)
                 else:
-                    rng = range(len(scan)-1,-1,-1)
-                ######################################
-                ## Pad row end if needed ##
-                ###########################
+                    cnt = 1
+                    timestamp=0
+                    for scan in scanline:
+                        stamp=int(3*time()) #update every 1/3 of a second
+                        if (stamp != timestamp):
+                            timestamp=stamp #interlock
+                            update_gui("Generating EGV Data: %.1f%%" %(100.0*float(cnt)/float(nscanline)))
+                            if stop_calc[0]==True:
+                                raise Exception("Action Stopped by User.")
+                        cnt = cnt+1
+                        self.raster_line(scan,state,Raster_step,Rapid_Feed_Rate,Feed,board_name)
+                lastx,lasty,sign,Rapid_flag = state
                 pad = 2
-                if (dxr*sign <= 0.0):
-                    if (Rapid_flag == False):
-                        self.make_dir_dist(-sign*pad,0)
-                        self.make_dir_dist( dxr,0)
-                        self.make_dir_dist( sign*pad,0)
-                    else:
-                        self.make_dir_dist( dxr,0)
-                    lastx = lastx+dxr
-                    
-                Rapid_flag=False
-                ######################################   
-                for j in rng:
-                    x  = scan[j][0]
-                    dx = x - lastx
-                    ##################################
-                    loop = scan[j][2]
-                    if loop==last_loop:
-                        self.make_cut_line(dx,0,True)
-                    else:
-                        if dx*sign > 0.0:
-                            self.make_dir_dist(dx,0)
-                    lastx     = x
-                    last_loop = loop
-                lasty = y
             
-            # Make final move to ensure last move is to the right 
-            self.make_dir_dist(pad,0)
-            lastx = lastx + pad
-            # If sign is negative the final move will have incremented the
-            # "y" position so adjust the lasty to acoomodate
-            if sign < 0:
-                lasty = lasty + Raster_step
+                # Make final move to ensure last move is to the right 
+                self.make_dir_dist(pad,0)
+                lastx = lastx + pad
+                # If sign is negative the final move will have incremented the
+                # "y" position so adjust the lasty to acoomodate
+                if sign < 0:
+                    lasty = lasty + Raster_step
 
-            self.flush(laser_on=False)
+                self.flush(laser_on=False)
 
 
-            dx_final = (startX - lastx)
-            if Raster_step < 0:
-                dy_final = (startY - lasty) + Raster_step
-            else:
-                dy_final = (startY - lasty) - Raster_step
+                if iblock < len(blocks)-1:
+                    # Return move goes to the start of the next block
+                    scans = self.raster_scanlines(blocks[iblock+1],Raster_step,FlipXoffset,update_gui,scale)
+                    endX,endY,end_loop = scans[0][0]
+                else:
+                    endX,endY = startX,startY
+
+                dx_final = (endX - lastx)
+                if Raster_step < 0:
+                    dy_final = (endY - lasty) + Raster_step
+                else:
+                    dy_final = (endY - lasty) - Raster_step
            
-            ##############################################################
-            max_return_feed = 50.0
-            final_feed = 0
-            if Rapid_Feed_Rate:
-                final_feed = Rapid_Feed_Rate
-            elif Feed > max_return_feed:
-                final_feed = max_return_feed
-
-            if final_feed:
-                self.change_speed(final_feed,board_name,laser_on=False,pad=False)
-                dy_final = dy_final + abs(Raster_step)
-                self.make_dir_dist(dx_final,dy_final)
-            else:
-                self.write(ord("N"))
-                self.make_dir_dist(dx_final,dy_final)
-                self.flush(laser_on=False)
-                self.write(ord("S"))
-                self.write(ord("E"))
-            ##############################################################
+                ##############################################################
+                max_return_feed = 50.0
+                final_feed = 0
+                if Rapid_Feed_Rate:
+                    final_feed = Rapid_Feed_Rate
+                elif Feed > max_return_feed:
+                    final_feed = max_return_feed
+
+                if final_feed:
+                    self.change_speed(final_feed,board_name,laser_on=False,pad=False)
+                    dy_final = dy_final + abs(Raster_step)
+                    self.make_dir_dist(dx_final,dy_final)
+                else:
+                    self.write(ord("N"))
+                    self.make_dir_dist(dx_final,dy_final)
+                    self.flush(laser_on=False)
+                    self.write(ord("S"))
+                    self.write(ord("E"))
+                ##############################################################
+
+                if iblock < len(blocks)-1:
+                    # End the block the same way passes are joined
+                    self.flush(laser_on=False)
+                    self.write(ord("@"))
+                    self.write(ord("N"))
+                    self.write(ord("S"))
+                    self.write(ord("E"))
+                    self.Modal_dir  = 0
+                    self.Modal_dist = 0
+                    self.Modal_on   = False
+                    self.Modal_AX   = 0
+                    self.Modal_AY   = 0
+                    blockX = endX
+                    blockY = endY
             
            
         # Append Footer
@@ -608,8 +1264,7 @@ class egv:
         speed = self.make_speed(Feed,board_name=board_name,Raster_step=0)
         if finish:
             self.write(ord("I"))
-        for code in speed:
-            self.write(code)
+        self.write_codes(speed)
         self.flush(laser_on=False)
         self.write(ord("N"))
         self.write(ord("R"))
@@ -633,6 +1288,23 @@ class egv:
         self.write(ord("E"))
         return
 
+    def rapid_move(self,dx,dy,Rapid_Feed_Rate,Feed,board_name):
+        # laser off move in vector data
+        if self.rapid_planner != None:
+            choice = self.rapid_planner.choose(dx,dy,Feed,Rapid_Feed_Rate)
+        else:
+            min_rapid = 5
+            if ((abs(dx) < min_rapid) and (abs(dy) < min_rapid)) or Rapid_Feed_Rate:
+                choice = RapidPlanner.RAPID
+            else:
+                choice = RapidPlanner.FAST
+        if choice == RapidPlanner.FAST:
+            self.rapid_move_fast(dx,dy)
+        elif choice == RapidPlanner.SLOW:
+            self.rapid_move_slow(dx,dy,0,Feed,board_name)
+        else:
+            self.rapid_move_slow(dx,dy,Rapid_Feed_Rate,Feed,board_name)
+
     def rapid_move_slow(self,dx,dy,Rapid_Feed_Rate,Feed,board_name):
         if Rapid_Feed_Rate:
             self.change_speed(Rapid_Feed_Rate,board_name,laser_on=False)
@@ -689,8 +1361,7 @@ class egv:
         self.write(ord("E"))
         speed = self.make_speed(Feed,board_name,Raster_step=Raster_step)
         #print Feed,speed
-        for code in speed:
-            self.write(code)
+        self.write_codes(speed)
         self.write(ord("N"))
         self.write(ord("R"))
         self.write(ord("B"))
@@ -706,9 +1377,159 @@ class egv:
         if laser_on:    
             self.write(self.ON)
             
-        
+
+
+def encode_raster_chunk(job):
+    '''
+    Encode a chunk of raster scan lines (used by egv.raster_lines_parallel)
+    Returns the EGV data, the modal state at the start of the chunk and the
+    modal state at the end of the chunk.
+    '''
+    scans,state,warm_scan,warm_state,params = job
+    Raster_step,Rapid_Feed_Rate,Feed,board_name,modal = params
+    data = bytearray()
+    EGV = egv(target=data)
+    EGV.set_modal(modal)
+    if warm_scan != None:
+        EGV.raster_line(warm_scan,list(warm_state),Raster_step,Rapid_Feed_Rate,Feed,board_name)
+        del data[:]
+    start_modal = EGV.get_modal()
+    for scan in scans:
+        EGV.raster_line(scan,state,Raster_step,Rapid_Feed_Rate,Feed,board_name)
+    return data,start_modal,EGV.get_modal()
+
+
+def cut_line_runs_reference(n,slope):
+    # The per mil list version of egv.cut_line_runs() (used to check it)
+    h=[]
+    for i in range(1,n+1):
+        h.append(round(i*slope,0))
+    runs=[]
+    Lh=0.0
+    for i in range(len(h)):
+        diagonal = h[i]!=Lh
+        if runs and runs[-1][0]==diagonal:
+            runs[-1]=(diagonal,runs[-1][1]+1)
+        else:
+            runs.append((diagonal,1))
+        Lh=h[i]
+    return runs
+
+
 if __name__ == "__main__":
+    # Check cut_line_runs() against the per mil version for random lines
+    import random
     EGV=egv()
+    rnd = random.Random(0)
+    ntests = 20000
+    for test in range(ntests):
+        scale = rnd.choice([10,100,1000,20000])
+        dxmils = rnd.randint(1,scale)
+        dymils = rnd.randint(1,scale)
+        if rnd.random() < 0.2:
+            # exact halves (ties in the rounding) and small ratios
+            dymils = dxmils*rnd.randint(1,8)//rnd.choice([2,4,8,16])
+        if dymils == 0 or dxmils == dymils:
+            continue
+        adx = dxmils/1000.0
+        ady = dymils/1000.0
+        if adx > ady:
+            n,slope = dxmils,ady/adx
+        else:
+            n,slope = dymils,adx/ady
+        if EGV.cut_line_runs(n,slope) != cut_line_runs_reference(n,slope):
+            raise Exception("cut_line_runs() mismatch dx=%d dy=%d" %(dxmils,dymils))
+    print("cut_line_runs: %d random lines match" %(ntests))
+
+    # make_distance() against the loop it replaced
+    def make_distance_loop(dist_mils):
+        code = []
+        dist_milsA = int(dist_mils)
+        for i in range(0,int(floor(dist_mils/255.0))):
+            code.append(122)
+            dist_milsA = dist_milsA-255
+        code.extend(distance_code(dist_milsA))
+        return code
+    for dist in range(0,3000):
+        if list(EGV.make_distance(dist)) != make_distance_loop(dist) or \
+           list(EGV.make_distance(float(dist))) != make_distance_loop(dist):
+            raise Exception("make_distance() mismatch dist=%d" %(dist))
+    print("make_distance: 0 to 2999 mils match")
+
+    class egv_loop(egv):
+        # encoder that makes the distance codes the old way every time
+        def make_distance(self,dist_mils):
+            dist_mils=float(dist_mils)
+            if abs(dist_mils-round(dist_mils,0)) > 0.000001:
+                raise Exception('Distance values should be integer value (inches*1000)')
+            return make_distance_loop(int(dist_mils))
+    nseg = 100000
+    ecoords = []
+    x,y,loop = 0.0,0.0,1
+    for i in range(nseg):
+        if rnd.random() < 0.05:
+            loop = loop+1
+        x = round(x+rnd.uniform(-0.3,0.3),3)
+        y = round(y+rnd.uniform(-0.3,0.3),3)
+        ecoords.append([x,y,loop])
+    times = []
+    outputs = []
+    for encoder in (egv_loop,egv):
+        data = bytearray()
+        t0=time()
+        encoder(target=data).make_egv_data(ecoords,Feed=20,Raster_step=0)
+        times.append(time()-t0)
+        outputs.append(data)
+    print("%d segment design: EGV %.2fs (distance loop)  %.2fs (table)  identical: %s" \
+          %(nseg,times[0],times[1],outputs[0]==outputs[1]))
+
+    t0=time()
+    for k in range(20):
+        EGV.cut_line_runs(100000,0.37)
+    t1=time()
+    for k in range(20):
+        cut_line_runs_reference(100000,0.37)
+    t2=time()
+    print("100000 mil line: runs %.4fs  per mil list %.4fs" %((t1-t0)/20,(t2-t1)/20))
+
+    # Projected time of the laser off moves with the old min_rapid rule and
+    # with the RapidPlanner, for a few kinds of design (inches)
+    def loops(centers,radius,npoints):
+        coords = []
+        for loop in range(len(centers)):
+            cx,cy = centers[loop]
+            for k in range(npoints+1):
+                a = 2*pi*k/npoints
+                coords.append([cx+radius*cos(a),cy+radius*sin(a),loop+1])
+        return coords
+    designs = [
+        ("holes 3mm, 10mm grid",     loops([(0.4*i,-0.4*j) for j in range(8) for i in range(12)],0.06,24),10.0),
+        ("text 4mm",                 loops([(0.2*(i%40)+rnd.uniform(0,0.05),-0.3*(i//40)) for i in range(400)],0.08,8),30.0),
+        ("parts 50mm, 20mm apart",   loops([(2.8*i,-1.0) for i in range(6)],1.0,4),10.0),
+        ]
+    for name,coords,feed in designs:
+        EGV = egv(target=bytearray())
+        EGV.make_egv_data(coords,Feed=feed,Raster_step=0,plan_rapids=True)
+        planner = EGV.rapid_planner
+        # the estimate leaves out the move back to the start
+        estimate = RapidPlanner().plan(coords,feed)
+        print("%-24s %3d mm/s: laser off moves %6.1fs (min_rapid)  %6.1fs (planned)  saves %.1fs  (estimate %.1fs)" \
+              %(name,feed,planner.old_time,planner.new_time,planner.time_saved(),estimate))
+
+    # G-code with the feed varied along curves (in/min), grouped by FeedPolicy
+    gcode = []
+    for loop in range(20):
+        base = rnd.choice([12.0,24.0,48.0])
+        for k in range(121):
+            a = 2*pi*k/120
+            gcode.append([loop*0.5+0.2*cos(a),0.2*sin(a),loop+1,base*(1+0.04*sin(7*a))+rnd.uniform(-0.1,0.1),1])
+    for policy in (FeedPolicy(),FeedPolicy(tolerance=0.05),FeedPolicy(step=1.0),FeedPolicy(tolerance=0.05,step=0.5,max_feed=15.0)):
+        coords = policy.apply(gcode)
+        data = bytearray()
+        egv(target=data).make_egv_data(coords,Feed=None,Raster_step=0)
+        print("G-code tolerance %.2f step %.1f max %.1f: %4d speed changes (%d in the EGV data), %d removed" \
+              %(policy.tolerance,policy.step,policy.max_feed,policy.changes_after,bytes(data).count(b"@NSE"),policy.changes_removed()))
+
     bname = "LASER-M2"
     values  = [.1,.2,.3,.4,.5,.6,.7,.8,.9,1,2,3,4,5,6,7,8,9,10,20,30,40,50,70,90,100]
     step=2
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+    Cache of the EGV data made for each operation of a job
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import hashlib
+from array import array
+from itertools import chain
+from collections import OrderedDict
+from egv import EgvSink
+
+# Change this when a change to egv.py changes the data made for the same input
+EGV_FORMAT = "egv-2"
+
+
+class EgvCache:
+    '''
+    Keeps the EGV data of the operations sent recently.  The data is
+    stored under a hash of everything make_egv_data uses: the ecoords
+    (after mirror, rotate and scale), the start position, feed rate,
+    board name, raster step, FlipXoffset and rapid feed rate.  So sending
+    an unchanged job again skips the EGV generation, and any change gives
+    a new entry.
+
+    Entries are kept in memory up to max_bytes and dropped least recently
+    used first.  If disk_cache (a RenderCache) is given the data is also
+    written there so it is still available after a restart.
+    '''
+    def __init__(self,max_bytes=128*1024*1024,disk_cache=None):
+        self.max_bytes  = max_bytes
+        self.disk_cache = disk_cache
+        self.cache      = OrderedDict()
+        self.used_bytes = 0
+        self.hits       = 0
+        self.misses     = 0
+
+    def make_key(self,operation):
+        '''
+        Returns the key of an EgvOperation or None if its ecoords can not
+        be hashed.
+        '''
+        ecoords = operation.ecoords
+        try:
+            if isinstance(ecoords,list):
+                coords = array('d',chain.from_iterable(ecoords))
+                if hasattr(coords,"tobytes"):
+                    coords = coords.tobytes()
+                else:
+                    coords = coords.tostring()
+            elif hasattr(ecoords,"cache_key"):
+                coords = ecoords.cache_key()
+            else:
+                return None
+        except:
+            return None
+        # the number of processes does not change the data
+        kwargs = sorted([(name,value) for name,value in operation.kwargs.items() if name != "processes"])
+        digest = hashlib.sha1()
+        digest.update(EGV_FORMAT.encode('utf-8'))
+        digest.update(("%s:%d:" %(type(ecoords).__name__,len(coords))).encode('utf-8'))
+        digest.update(coords)
+        digest.update(repr(kwargs).encode('utf-8'))
+        return digest.hexdigest()
+
+    def fetch(self,key):
+        if key == None:
+            return None
+        if key in self.cache:
+            data = self.cache.pop(key)
+            self.cache[key] = data
+            self.hits = self.hits+1
+            return data
+        if self.disk_cache != None:
+            data = self.disk_cache.fetch_data(key)
+            if data != None:
+                self.hits = self.hits+1
+                self.store_memory(key,data)
+                return data
+        self.misses = self.misses+1
+        return None
+
+    def store(self,key,data):
+        if key == None:
+            return
+        self.store_memory(key,data)
+        if self.disk_cache != None:
+            self.disk_cache.store_data(key,data)
+
+    def store_memory(self,key,data):
+        nbytes = len(data)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.cache:
+            self.used_bytes = self.used_bytes-len(self.cache.pop(key))
+        while self.used_bytes+nbytes > self.max_bytes and self.cache:
+            old_key,old_data = self.cache.popitem(last=False)
+            self.used_bytes = self.used_bytes-len(old_data)
+        self.cache[key] = data
+        self.used_bytes = self.used_bytes+nbytes
+
+    def clear(self):
+        self.cache.clear()
+        self.used_bytes = 0
+
+    def lookup(self,operations):
+        '''
+        operations is a list of (EgvOperation, passes) as used by
+        write_egv_job.  Returns the same list with the operations that are
+        in the cache replaced by their data and the others wrapped in a
+        CachedOperation that stores the data when it is made.
+        '''
+        result = []
+        for operation,passes in operations:
+            key  = self.make_key(operation)
+            data = self.fetch(key)
+            if data != None:
+                result.append((data,passes))
+            else:
+                result.append((CachedOperation(operation,self,key),passes))
+        return result
+
+    def stats(self):
+        return "%d hits, %d misses" %(self.hits,self.misses)
+
+
+class CachedOperation:
+    '''
+    Writes the data of an EgvOperation into the target and stores a copy
+    in the cache.  The data is passed on to the target in small chunks as
+    it is made, so it can still be streamed to the laser.
+    '''
+    def __init__(self,operation,cache,key):
+        self.operation = operation
+        self.cache     = cache
+        self.key       = key
+
+    def __call__(self,target,update_gui=None,stop_calc=None):
+        # data that is too large for the cache is not kept
+        max_bytes = self.cache.max_bytes
+        if self.cache.disk_cache != None:
+            max_bytes = max(max_bytes,self.cache.disk_cache.max_bytes)
+        data = [bytearray()]
+        def out(chunk):
+            if data[0] != None:
+                data[0].extend(chunk)
+                if len(data[0]) > max_bytes:
+                    data[0] = None
+            target.extend(chunk)
+        sink = EgvSink(out=out,chunk_size=1024)
+        self.operation(sink,update_gui,stop_calc)
+        sink.flush()
+        if data[0] != None:
+            self.store(data[0])
+
+    def store(self,data):
+        self.cache.store(self.key,data)
+
+
+if __name__ == '__main__':
+    # A second send of the same operation comes from the cache
+    import random
+    from time import time
+    from egv import EgvOperation, write_egv_job
+    random.seed(1)
+    coords = []
+    for i in range(5000):
+        coords.append([random.uniform(0,3),random.uniform(-3,0),i//4])
+    cache = EgvCache()
+    for send in range(2):
+        operations = [(EgvOperation(coords,Feed=20.0,Raster_step=0),2)]
+        t0 = time()
+        job = EgvSink()
+        write_egv_job(cache.lookup(operations),job)
+        print("send %d: %6.2fs  %d bytes  cache: %s" %(send+1,time()-t0,len(job),cache.stats()))
+    job2 = EgvSink()
+    write_egv_job(operations,job2)
+    print("same data as without the cache: %s" %(job.data == job2.data))
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+"""
+    Decoder for LHYMICRO-GL (EGV) data
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import re
+from math import sqrt
+from LaserSpeed import LaserSpeed
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY=False
+
+# Speed codes and the S1E, S1P and SE mode switches.  Everything else is
+# a one character command or a distance code.
+SPECIAL = re.compile(br"C?V[0-9]+(?:G[0-9]{3})?(?:C(?!V))?|S1E|S1P|SE")
+SPEED,S1E,SE,S1P = 1,2,3,4
+
+RIGHT = 66 #ord("B")
+LEFT  = 84 #ord("T")
+UP    = 76 #ord("L")
+DOWN  = 82 #ord("R")
+ANGLE = 77 #ord("M")
+ON    = 68 #ord("D")
+OFF   = 85 #ord("U")
+COMMANDS = b"BTLRMDUNI@F"
+
+# Speed of the moves made outside of compact mode (between "N" and "S1E"
+# or "SE").  The controller uses its own speed for these; this is only an
+# estimate for the job time.
+RAPID_SPEED = 100.0 # mm/s
+
+
+def read_egv_file(filename):
+    '''
+    Read an EGV file the same way Open_EGV does.  Returns the four values
+    of the "%" header (y start, x start, y end, x end in mils) and the
+    data with line breaks and spaces removed.
+    '''
+    fp = open(filename,"rb")
+    raw = fp.read()
+    fp.close()
+    fields = raw.split(b"%",5)
+    values = []
+    for field in fields[1:5]:
+        values.append(int(field.strip() or b"0"))
+    while len(values) < 4:
+        values.append(0)
+    if len(fields) > 5:
+        data = fields[5]
+    else:
+        data = b""
+    for c in (b"\n",b"\r",b" "):
+        data = data.replace(c,b"")
+    return values,bytearray(data)
+
+
+class EgvSegments:
+    '''
+    The motion decoded from EGV data.  Segment i goes from the end of
+    segment i-1 (or from start for the first one) to (x[i],y[i]), in mils
+    relative to the position of the head when the data started, and takes
+    time[i] seconds.  laser[i] is true if the laser is on.  With NumPy the
+    values are arrays (int32, bool and float32), otherwise lists.
+    '''
+    def __init__(self,x,y,laser,time,start=(0,0)):
+        self.x     = x
+        self.y     = y
+        self.laser = laser
+        self.time  = time
+        self.start = start
+
+    def __len__(self):
+        return len(self.x)
+
+    def x0(self):
+        return [self.start[0]]+list(self.x[:-1])
+
+    def y0(self):
+        return [self.start[1]]+list(self.y[:-1])
+
+    def total_time(self):
+        return float(sum(self.time)) if not NUMPY else float(numpy.sum(self.time,dtype=numpy.float64))
+
+    def laser_time(self):
+        if NUMPY:
+            return float(numpy.sum(self.time[self.laser],dtype=numpy.float64))
+        return sum([t for t,on in zip(self.time,self.laser) if on])
+
+    def end_position(self):
+        if len(self.x) == 0:
+            return self.start
+        return (int(self.x[-1]),int(self.y[-1]))
+
+    def bounds(self,laser_only=False):
+        '''
+        Returns (xmin,xmax,ymin,ymax) in mils of the path (or of the
+        segments with the laser on) or None if there is nothing to bound.
+        '''
+        xs = []
+        ys = []
+        x0 = self.x0()
+        y0 = self.y0()
+        if NUMPY:
+            x0 = numpy.array(x0,numpy.int32)
+            y0 = numpy.array(y0,numpy.int32)
+            keep = self.laser if laser_only else numpy.ones(len(self.x),bool)
+            if not numpy.any(keep):
+                return None
+            xs = numpy.concatenate((x0[keep],self.x[keep]))
+            ys = numpy.concatenate((y0[keep],self.y[keep]))
+            return (int(xs.min()),int(xs.max()),int(ys.min()),int(ys.max()))
+        for i in range(len(self.x)):
+            if laser_only and not self.laser[i]:
+                continue
+            xs.extend((x0[i],self.x[i]))
+            ys.extend((y0[i],self.y[i]))
+        if xs == []:
+            return None
+        return (min(xs),max(xs),min(ys),max(ys))
+
+
+class EgvReader:
+    '''
+    Decodes EGV data back into the motion of the laser head.
+
+    Moves are a direction (B right, T left, L up, R down, M diagonal in the
+    current x and y directions) followed by a distance: "z" for each 255
+    mils, then "a" to "y" (1-25), "|a" to "|z" (26-51) or three digits.
+    A direction without a distance only sets the direction.  D and U turn
+    the laser on and off.
+
+    The speed code sets the speed (LaserSpeed.parse_speed_code) and, for
+    raster engraving, the raster step.  "S1E" starts compact mode where
+    moves are made at that speed.  "N" leaves compact mode (moves are then
+    made at the controller's rapid speed), "SE" goes back to it and "@"
+    and "F" end it until the next "S1E".  In raster compact mode every
+    change of the x direction also moves one raster step in the current y
+    direction.
+
+    decode() uses NumPy to process the data in blocks when it is
+    available, decode_python() is the byte by byte version.
+    '''
+    def __init__(self,board_name="LASER-M2",rapid_speed=RAPID_SPEED,block_size=4*1024*1024):
+        self.board       = board_name.split('-')[-1]
+        self.rapid_speed = rapid_speed
+        self.block_size  = block_size
+        self.speeds      = {}
+
+    def speed(self,code):
+        '''
+        Returns (speed in mm/s, raster step in mils) of a speed code
+        '''
+        if code not in self.speeds:
+            text = code.decode('ascii')
+            code_value, gear, step_value, diagonal, raster_step = LaserSpeed.parse_speed_code(text)
+            speed = LaserSpeed.get_speed_from_code(text,board=self.board)
+            self.speeds[code] = (speed,raster_step)
+        return self.speeds[code]
+
+    def reset(self):
+        # state at the start of the data
+        self.state = {"x":0,"y":0,"xdir":1,"ydir":1,"laser":False,
+                      "compact":False,"ended":True,"speed":0.0,"raster_step":0}
+
+    def control(self,kind,text):
+        # commands that change the mode
+        state = self.state
+        if kind == SPEED:
+            state["speed"],state["raster_step"] = self.speed(text)
+        elif kind == S1E:
+            state["compact"] = True
+            state["ended"]   = False
+        elif kind == SE:
+            state["compact"] = not state["ended"]
+        elif kind == S1P or kind == ord("N") or kind == ord("I"):
+            state["compact"] = False
+        elif kind == ord("@") or kind == ord("F"):
+            state["compact"] = False
+            state["ended"]   = True
+
+    def mils_per_second(self):
+        state = self.state
+        if state["compact"] and state["speed"] > 0:
+            return state["speed"]*1000.0/25.4
+        return self.rapid_speed*1000.0/25.4
+
+    def decode(self,data):
+        if NUMPY:
+            return self.decode_numpy(data)
+        return self.decode_python(data)
+
+    ##########################################################################
+    def decode_python(self,data):
+        self.reset()
+        state = self.state
+        raw = bytes(data)
+        data = bytearray(data)
+        n = len(data)
+        xs=[]
+        ys=[]
+        laser=[]
+        times=[]
+        def add(dx,dy,on):
+            state["x"] = state["x"]+dx
+            state["y"] = state["y"]+dy
+            xs.append(state["x"])
+            ys.append(state["y"])
+            laser.append(on)
+            times.append(sqrt(dx*dx+dy*dy)/self.mils_per_second())
+
+        pos = 0
+        while pos < n:
+            match = SPECIAL.match(raw,pos)
+            if match:
+                text = match.group(0)
+                if text == b"S1E":
+                    kind = S1E
+                elif text == b"SE":
+                    kind = SE
+                elif text == b"S1P":
+                    kind = S1P
+                else:
+                    kind = SPEED
+                self.control(kind,text)
+                pos = match.end()
+                continue
+            c = data[pos]
+            pos = pos+1
+            if c in (RIGHT,LEFT,UP,DOWN,ANGLE):
+                dist,pos = self.read_distance(data,pos)
+                if c == RIGHT or c == LEFT:
+                    xdir = 1 if c == RIGHT else -1
+                    if state["compact"] and state["raster_step"] > 0 and xdir != state["xdir"]:
+                        add(0,state["ydir"]*state["raster_step"],False)
+                    state["xdir"] = xdir
+                    if dist > 0:
+                        add(xdir*dist,0,state["laser"] and state["compact"])
+                elif c == UP or c == DOWN:
+                    state["ydir"] = 1 if c == UP else -1
+                    if dist > 0:
+                        add(0,state["ydir"]*dist,state["laser"] and state["compact"])
+                elif dist > 0:
+                    add(state["xdir"]*dist,state["ydir"]*dist,state["laser"] and state["compact"])
+            elif c == ON:
+                state["laser"] = True
+            elif c == OFF:
+                state["laser"] = False
+            elif c in bytearray(COMMANDS):
+                self.control(c,None)
+        return self.segments(xs,ys,laser,times)
+
+    def read_distance(self,data,pos):
+        n = len(data)
+        dist = 0
+        while pos < n:
+            c = data[pos]
+            if c == 122: # "z"
+                dist = dist+255
+                pos = pos+1
+                continue
+            if 97 <= c <= 121: # "a" to "y"
+                dist = dist+c-96
+                pos = pos+1
+            elif c == 124 and pos+1 < n: # "|a" to "|z"
+                dist = dist+data[pos+1]-96+25
+                pos = pos+2
+            elif 48 <= c <= 57:
+                dist = dist+int(bytes(data[pos:pos+3]))
+                pos = pos+3
+            break
+        return dist,pos
+
+    def segments(self,xs,ys,laser,times):
+        if NUMPY:
+            return EgvSegments(numpy.array(xs,numpy.int32),numpy.array(ys,numpy.int32),
+                               numpy.array(laser,bool),numpy.array(times,numpy.float32))
+        return EgvSegments(xs,ys,laser,times)
+
+    ##########################################################################
+    def decode_numpy(self,data):
+        self.reset()
+        raw = bytes(data)
+        n = len(raw)
+        is_command = numpy.zeros(256,bool)
+        is_command[numpy.frombuffer(COMMANDS,numpy.uint8)] = True
+        # cut the data into blocks at command letters that are never part
+        # of a speed code or mode switch, so no token is split
+        is_cut = numpy.zeros(256,bool)
+        is_cut[numpy.frombuffer(b"BTLRMDU",numpy.uint8)] = True
+        all_bytes = numpy.frombuffer(raw,numpy.uint8)
+        parts = []
+        begin = 0
+        while begin < n:
+            end = begin+self.block_size
+            if end < n:
+                window = is_cut[all_bytes[end:end+4096]]
+                while not window.any() and end < n:
+                    end = end+4096
+                    window = is_cut[all_bytes[end:end+4096]]
+                end = min(n,end+int(numpy.argmax(window))) if window.any() else n
+            else:
+                end = n
+            parts.append(self.decode_block(raw[begin:end],is_command))
+            begin = end
+        if parts == []:
+            return self.segments([],[],[],[])
+        return EgvSegments(numpy.concatenate([p[0] for p in parts]),
+                           numpy.concatenate([p[1] for p in parts]),
+                           numpy.concatenate([p[2] for p in parts]),
+                           numpy.concatenate([p[3] for p in parts]))
+
+    def decode_block(self,raw,is_command):
+        state = self.state
+        a = numpy.frombuffer(raw,numpy.uint8)
+        n = len(a)
+        index = numpy.arange(n)
+
+        # speed codes and mode switches
+        special = numpy.zeros(n,bool)
+        spec_pos  = []
+        spec_kind = []
+        spec_text = []
+        for match in SPECIAL.finditer(raw):
+            special[match.start():match.end()] = True
+            text = match.group(0)
+            spec_pos.append(match.start())
+            spec_text.append(text)
+            if text == b"S1E":
+                spec_kind.append(S1E)
+            elif text == b"SE":
+                spec_kind.append(SE)
+            elif text == b"S1P":
+                spec_kind.append(S1P)
+            else:
+                spec_kind.append(SPEED)
+
+        # value of each distance code byte
+        vals = numpy.zeros(n,numpy.int64)
+        lower = (a >= 97) & (a <= 121)
+        vals[lower] = a[lower].astype(numpy.int64)-96
+        vals[a == 122] = 255
+        after_bar = numpy.flatnonzero((a[:-1] == 124) & ~special[:-1])+1
+        vals[after_bar] = a[after_bar].astype(numpy.int64)-96+25
+        digit = (a >= 48) & (a <= 57) & ~special
+        if digit.any():
+            first = digit.copy()
+            first[1:] &= ~digit[:-1]
+            run_start = numpy.maximum.accumulate(numpy.where(first,index,0))
+            weight = numpy.array([100,10,1])[(index-run_start)%3]
+            vals[digit] = (a[digit].astype(numpy.int64)-48)*weight[digit]
+        vals[special] = 0
+        total = numpy.concatenate(([0],numpy.cumsum(vals)))
+
+        # tokens: command letters and special codes in order
+        letters = numpy.flatnonzero(is_command[a] & ~special)
+        pos  = numpy.concatenate((letters,numpy.array(spec_pos,numpy.int64)))
+        kind = numpy.concatenate((a[letters].astype(numpy.int64),numpy.array(spec_kind,numpy.int64)))
+        order = numpy.argsort(pos,kind='mergesort')
+        pos  = pos[order]
+        kind = kind[order]
+        ntok = len(pos)
+        if ntok == 0:
+            return (numpy.zeros(0,numpy.int32),numpy.zeros(0,numpy.int32),
+                    numpy.zeros(0,bool),numpy.zeros(0,numpy.float32))
+        text_of = {}
+        for p,text in zip(spec_pos,spec_text):
+            text_of[p] = text
+        nxt  = numpy.concatenate((pos[1:],[n]))
+        dist = total[nxt]-total[pos+1]
+
+        # mode after each token (Python loop over the mode changes only)
+        is_motion = numpy.isin(kind,[RIGHT,LEFT,UP,DOWN,ANGLE,ON,OFF])
+        controls  = numpy.flatnonzero(~is_motion)
+        compact = [state["compact"]]
+        speed   = [self.mils_per_second()]
+        rstep   = [state["raster_step"]]
+        for t in controls.tolist():
+            self.control(int(kind[t]),text_of.get(int(pos[t])))
+            compact.append(state["compact"])
+            speed.append(self.mils_per_second())
+            rstep.append(state["raster_step"])
+        mode    = numpy.cumsum(~is_motion)
+        compact = numpy.array(compact,bool)[mode]
+        speed   = numpy.array(speed,numpy.float64)[mode]
+        rstep   = numpy.array(rstep,numpy.int64)[mode]
+
+        def fill(mask,values,initial):
+            # value of the last token in mask at or before each token
+            last = numpy.maximum.accumulate(numpy.where(mask,numpy.arange(ntok),-1))
+            return numpy.where(last >= 0,values[numpy.maximum(last,0)],initial)
+
+        is_x = (kind == RIGHT) | (kind == LEFT)
+        is_y = (kind == UP) | (kind == DOWN)
+        xdir = fill(is_x,numpy.where(kind == RIGHT,1,-1),state["xdir"])
+        ydir = fill(is_y,numpy.where(kind == UP,1,-1),state["ydir"])
+        laser = fill((kind == ON) | (kind == OFF),kind == ON,state["laser"])
+        prev_xdir = numpy.concatenate(([state["xdir"]],xdir[:-1]))
+
+        dx = numpy.where(is_x,xdir*dist,0)+numpy.where(kind == ANGLE,xdir*dist,0)
+        dy = numpy.where(is_y,ydir*dist,0)+numpy.where(kind == ANGLE,ydir*dist,0)
+        moves = numpy.flatnonzero(is_motion & (kind != ON) & (kind != OFF) & (dist > 0))
+        steps = numpy.flatnonzero(is_x & compact & (rstep > 0) & (xdir != prev_xdir))
+
+        # raster steps come before the move of the same token
+        event = numpy.concatenate((steps*2,moves*2+1))
+        order = numpy.argsort(event,kind='mergesort')
+        tok   = numpy.concatenate((steps,moves))[order]
+        is_step = order < len(steps)
+        ev_dx = numpy.where(is_step,0,dx[tok])
+        ev_dy = numpy.where(is_step,ydir[tok]*rstep[tok],dy[tok])
+        ev_on = ~is_step & laser[tok] & compact[tok]
+        ev_t  = numpy.sqrt((ev_dx*ev_dx+ev_dy*ev_dy).astype(numpy.float64))/speed[tok]
+
+        x = state["x"]+numpy.cumsum(ev_dx)
+        y = state["y"]+numpy.cumsum(ev_dy)
+        if len(x):
+            state["x"] = int(x[-1])
+            state["y"] = int(y[-1])
+        state["xdir"]  = int(xdir[-1])
+        state["ydir"]  = int(ydir[-1])
+        state["laser"] = bool(laser[-1])
+        return (x.astype(numpy.int32),y.astype(numpy.int32),
+                ev_on.astype(bool),ev_t.astype(numpy.float32))
+
+
+if __name__ == '__main__':
+    # Decode generated data, compare with the byte by byte decoder and time
+    # a large raster job: python egv_reader.py [MB]
+    import sys
+    import random
+    from time import time
+    from egv import egv
+    random.seed(3)
+    coords = []
+    loop = 0
+    for i in range(4000):
+        if i%5 == 0:
+            loop = loop+1
+        coords.append([random.uniform(0,4),random.uniform(-4,0),loop])
+    reader = EgvReader()
+    for rapid in (0,0,30.0):
+        data = bytearray()
+        egv(target=data).make_egv_data(coords,startX=0,startY=0,Feed=random.choice([5.0,20.0]),
+                                       Raster_step=0,Rapid_Feed_Rate=rapid)
+        fast = reader.decode(bytearray(b"I")+data)
+        slow = reader.decode_python(bytearray(b"I")+data)
+        same = list(fast.x) == list(slow.x) and list(fast.y) == list(slow.y) and list(fast.laser) == list(slow.laser)
+        print("vector  rapid %4.1f: %6d segments  back at start %s  same as byte by byte: %s  %.1f s" %(
+            rapid,len(fast),fast.end_position()==(0,0),same,fast.total_time()))
+
+    size = 20
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    raster = []
+    loop = 1
+    for row in range(400):
+        y = -row*0.003
+        x = 0.0
+        while x < 6.0:
+            x = x+random.uniform(0.001,0.05)
+            x2 = x+random.uniform(0.001,0.05)
+            raster.append([x,y,loop])
+            raster.append([x2,y,loop])
+            loop = loop+1
+            x = x2
+    data = bytearray()
+    egv(target=data).make_egv_data(raster,startX=0,startY=0,Feed=100.0,Raster_step=-3)
+    segs = reader.decode(bytearray(b"I")+data)
+    print("raster: %6d segments  back at start %s  bounds %s" %(len(segs),segs.end_position()==(0,0),segs.bounds(True)))
+    job = bytearray(b"I")
+    while len(job) < size*1024*1024:
+        data[-4] = ord("@")
+        job.extend(data)
+    t0 = time()
+    segs = reader.decode(job)
+    t1 = time()
+    print("%.1f MB decoded in %.2f s: %d segments, job time %.0f s" %(len(job)/1048576.0,t1-t0,len(segs),segs.total_time()))
@@ -22,16 +22,23 @@ title_text = "K40 Whisperer V"+version
 
 import sys
 from math import *
-from egv import egv
+from egv import egv, EgvSink, EgvOperation, write_egv_job, make_egv_job, encode_operations, RapidPlanner, FeedPolicy
 from nano_library import K40_CLASS
+from stream_queue import threaded_stream
+from laser_transport import LaserTransport
 from dxf import DXF_CLASS
 from svg_reader import SVG_READER
 from svg_reader import SVG_TEXT_EXCEPTION
 from svg_reader import SVG_PXPI_EXCEPTION
 from g_code_library import G_Code_Rip
-from interpolate import interpolate
 from ecoords import ECoord
 from convex_hull import hull2D
+from raster_scan import RasterScan, TiledRaster, RasterIslands
+from raster_pipeline import RasterPipeline
+from render_cache import RenderCache
+from egv_cache import EgvCache
+from egv_reader import read_egv_file
+from dither import Dither
 
 import inkex
 import simplestyle
@@ -80,6 +87,7 @@ import binascii
 import getopt
 import operator
 import webbrowser
+import multiprocessing
 from PIL import Image
 from PIL import ImageOps
 from PIL import ImageFilter
@@ -131,6 +139,7 @@ class Application(Frame):
         self.SCALE = 1
         self.Design_bounds = (0,0,0,0)
         self.UI_image = None
+        self.svg_raster_reader = None
         #if self.HomeUR.get():
         self.move_head_window_temporary([0.0,0.0])
         #else:
@@ -143,6 +152,8 @@ class Application(Frame):
         self.stop=[True]
         
         self.k40 = None
+        self.transport = LaserTransport()
+        self.raster_pipeline = RasterPipeline()
         self.run_time = 0
         
         self.master.bind("<Configure>", self.Master_Configure)
@@ -217,6 +228,10 @@ class Application(Frame):
         self.inputCSYS    = BooleanVar()
         self.HomeUR       = BooleanVar()
         self.engraveUP    = BooleanVar()
+        self.tiled_raster = BooleanVar()
+        self.island_raster= BooleanVar()
+        self.svg_ystep    = BooleanVar()
+        self.svg_rerender = BooleanVar()
         self.init_home    = BooleanVar()
         self.post_home    = BooleanVar()
         self.post_beep    = BooleanVar()
@@ -224,11 +239,17 @@ class Application(Frame):
         self.post_exec    = BooleanVar()
         
         self.pre_pr_crc   = BooleanVar()
+        self.stream_egv   = BooleanVar()
+        self.egv_parallel = BooleanVar()
+        self.plan_rapids  = BooleanVar()
         self.inside_first = BooleanVar()
         self.rotary       = BooleanVar()
         
 
         self.ht_size    = StringVar()
+        self.ht_method  = StringVar()
+        self.tile_mem   = StringVar()
+        self.raster_procs = StringVar()
         self.Reng_feed  = StringVar()
         self.Veng_feed  = StringVar()
         self.Vcut_feed  = StringVar()
@@ -276,6 +297,13 @@ class Application(Frame):
         self.inkscape_path = StringVar()
         self.batch_path    = StringVar()
         self.ink_timeout   = StringVar()
+        self.ink_cache_mb  = StringVar()
+        self.egv_cache_mb  = StringVar()
+        self.gcode_feed_tol  = StringVar()
+        self.gcode_feed_min  = StringVar()
+        self.gcode_feed_max  = StringVar()
+        self.gcode_feed_step = StringVar()
+        self.usb_skip_check  = BooleanVar()
         
         self.t_timeout  = StringVar()
         self.n_timeouts  = StringVar()
@@ -312,6 +340,10 @@ class Application(Frame):
         self.inputCSYS.set(0)
         self.HomeUR.set(0)
         self.engraveUP.set(0)
+        self.tiled_raster.set(0)
+        self.island_raster.set(0)
+        self.svg_ystep.set(0)
+        self.svg_rerender.set(1)
         self.init_home.set(1)
         self.post_home.set(0)
         self.post_beep.set(0)
@@ -319,10 +351,16 @@ class Application(Frame):
         self.post_exec.set(0)
         
         self.pre_pr_crc.set(1)
+        self.stream_egv.set(0)
+        self.egv_parallel.set(0)
+        self.plan_rapids.set(0)
         self.inside_first.set(1)
         self.rotary.set(0)
         
         self.ht_size.set(500)
+        self.ht_method.set(Dither.FLOYD_STEINBERG)
+        self.tile_mem.set("64")
+        self.raster_procs.set("1")
 
         self.Reng_feed.set("100")
         self.Veng_feed.set("20")
@@ -358,6 +396,13 @@ class Application(Frame):
         self.units.set("mm")            # Options are "in" and "mm"
 
         self.ink_timeout.set("3")
+        self.ink_cache_mb.set("200")
+        self.egv_cache_mb.set("0")
+        self.gcode_feed_tol.set("0")
+        self.gcode_feed_min.set("0")
+        self.gcode_feed_max.set("0")
+        self.gcode_feed_step.set("0")
+        self.usb_skip_check.set(0)
         self.t_timeout.set("200")
         self.n_timeouts.set("30")
 
@@ -366,6 +411,9 @@ class Application(Frame):
         if not os.path.isdir(self.HOME_DIR):
             self.HOME_DIR = ""
 
+        self.render_cache = RenderCache(os.path.join(self.HOME_DIR,".k40w_cache"))
+        self.egv_cache    = EgvCache(disk_cache=RenderCache(os.path.join(self.HOME_DIR,".k40w_egv_cache"),max_bytes=0))
+
         self.DESIGN_FILE = (self.HOME_DIR+"/None")
         self.EGV_FILE    = None
         
@@ -416,6 +464,7 @@ class Application(Frame):
         self.SCALE = 1
         self.Design_bounds = (0,0,0,0)
         self.UI_image = None
+        self.svg_raster_reader = None
         self.pos_offset=[0.0,0.0]
         self.inkscape_warning = False
         
@@ -896,6 +945,10 @@ class Application(Frame):
         header.append('(k40_whisperer_set negate        %s )'  %( int(self.negate.get())        ))
         
         header.append('(k40_whisperer_set engraveUP     %s )'  %( int(self.engraveUP.get())     ))
+        header.append('(k40_whisperer_set tiled_raster  %s )'  %( int(self.tiled_raster.get())  ))
+        header.append('(k40_whisperer_set island_raster %s )'  %( int(self.island_raster.get()) ))
+        header.append('(k40_whisperer_set svg_ystep     %s )'  %( int(self.svg_ystep.get())     ))
+        header.append('(k40_whisperer_set svg_rerender  %s )'  %( int(self.svg_rerender.get())  ))
         header.append('(k40_whisperer_set init_home     %s )'  %( int(self.init_home.get())     ))
         header.append('(k40_whisperer_set post_home     %s )'  %( int(self.post_home.get())     ))
         header.append('(k40_whisperer_set post_beep     %s )'  %( int(self.post_beep.get())     ))
@@ -903,6 +956,9 @@ class Application(Frame):
         header.append('(k40_whisperer_set post_exec     %s )'  %( int(self.post_exec.get())     ))
         
         header.append('(k40_whisperer_set pre_pr_crc    %s )'  %( int(self.pre_pr_crc.get())    ))
+        header.append('(k40_whisperer_set stream_egv    %s )'  %( int(self.stream_egv.get())    ))
+        header.append('(k40_whisperer_set egv_parallel  %s )'  %( int(self.egv_parallel.get())  ))
+        header.append('(k40_whisperer_set plan_rapids   %s )'  %( int(self.plan_rapids.get())   ))
         header.append('(k40_whisperer_set inside_first  %s )'  %( int(self.inside_first.get())  ))
 
         header.append('(k40_whisperer_set comb_engrave  %s )'  %( int(self.comb_engrave.get())  ))
@@ -927,6 +983,9 @@ class Application(Frame):
 
         header.append('(k40_whisperer_set rast_step     %s )'  %( self.rast_step.get()      ))
         header.append('(k40_whisperer_set ht_size       %s )'  %( self.ht_size.get()        ))
+        header.append('(k40_whisperer_set ht_method     %s )'  %( self.ht_method.get()      ))
+        header.append('(k40_whisperer_set tile_mem      %s )'  %( self.tile_mem.get()       ))
+        header.append('(k40_whisperer_set raster_procs  %s )'  %( self.raster_procs.get()   ))
         
         header.append('(k40_whisperer_set LaserXsize    %s )'  %( self.LaserXsize.get()     ))
         header.append('(k40_whisperer_set LaserYsize    %s )'  %( self.LaserYsize.get()     ))
@@ -954,6 +1013,13 @@ class Application(Frame):
         header.append('(k40_whisperer_set n_timeouts    %s )'  %( self.n_timeouts.get()     ))
 
         header.append('(k40_whisperer_set ink_timeout   %s )'  %( self.ink_timeout.get()    ))
+        header.append('(k40_whisperer_set ink_cache_mb  %s )'  %( self.ink_cache_mb.get()   ))
+        header.append('(k40_whisperer_set egv_cache_mb  %s )'  %( self.egv_cache_mb.get()   ))
+        header.append('(k40_whisperer_set gcode_feed_tol  %s )'  %( self.gcode_feed_tol.get()  ))
+        header.append('(k40_whisperer_set gcode_feed_min  %s )'  %( self.gcode_feed_min.get()  ))
+        header.append('(k40_whisperer_set gcode_feed_max  %s )'  %( self.gcode_feed_max.get()  ))
+        header.append('(k40_whisperer_set gcode_feed_step %s )'  %( self.gcode_feed_step.get() ))
+        header.append('(k40_whisperer_set usb_skip_check %s )'  %( int(self.usb_skip_check.get()) ))
 
         
         header.append('(k40_whisperer_set designfile    \042%s\042 )' %( self.DESIGN_FILE   ))
@@ -1161,29 +1227,53 @@ class Application(Frame):
             Reng_time=0
         else:
             Reng_time  = None
+        Reng_saved = 0
         Veng_time  = 0
         Vcut_time  = 0
+        Veng_saved = 0
+        Vcut_saved = 0
+        if self.rotary.get():
+            Rapid_Feed = float(self.rapid_feed.get())*self.feed_factor()
+        else:
+            Rapid_Feed = 0.0
         
         if self.RengData.len!=None:
-            # these equations are a terrible hack based on measured raster engraving times
-            # to be fixed someday
-            if Raster_eng_feed*60.0 <= 300:
-                accel_time=8.3264*(Raster_eng_feed*60.0)**(-0.7451)
-            else:
-                accel_time=2.5913*(Raster_eng_feed*60.0)**(-0.4795)
+            # based on measured raster engraving times (inches/s to mm/s)
+            accel_time = RapidPlanner.accel_time(Raster_eng_feed*25.4)
                 
             t_accel = self.RengData.n_scanlines * accel_time
             Reng_time  =  ( (self.RengData.len)/Raster_eng_feed ) * Raster_eng_passes + t_accel
+            if hasattr(self.RengData.ecoords,"blocks"):
+                islands = self.RengData.ecoords
+                Reng_time = Reng_time + islands.travel/rapid_feed * Raster_eng_passes
+                full_time = ( islands.full_len/Raster_eng_feed + islands.full_travel/rapid_feed ) * Raster_eng_passes \
+                            + islands.full_n_scanlines * accel_time
+                Reng_saved = full_time - Reng_time
         if self.VengData.len!=None:
             Veng_time  =  (self.VengData.len / Vector_eng_feed + self.VengData.move / rapid_feed) * Vector_eng_passes
+            if self.plan_rapids.get():
+                planner = RapidPlanner(self.board_name.get())
+                Veng_saved = planner.plan(self.VengData.ecoords,Vector_eng_feed*25.4,Rapid_Feed) * Vector_eng_passes
         if self.VcutData.len!=None:
             Vcut_time  =  (self.VcutData.len / Vector_cut_feed + self.VcutData.move / rapid_feed) * Vector_cut_passes
+            if self.plan_rapids.get():
+                planner = RapidPlanner(self.board_name.get())
+                Vcut_saved = planner.plan(self.VcutData.ecoords,Vector_cut_feed*25.4,Rapid_Feed) * Vector_cut_passes
             
         Gcode_time =  self.GcodeData.gcode_time * Gcode_passes
 
-        self.Reng_time.set("Raster Engrave: %s" %(self.format_time(Reng_time)))  
-        self.Veng_time.set("Vector Engrave: %s" %(self.format_time(Veng_time)))
-        self.Vcut_time.set("    Vector Cut: %s" %(self.format_time(Vcut_time)))
+        if Reng_saved > 0:
+            self.Reng_time.set("Raster Engrave: %s (islands save %s)" %(self.format_time(Reng_time),self.format_time(Reng_saved)))
+        else:
+            self.Reng_time.set("Raster Engrave: %s" %(self.format_time(Reng_time)))  
+        if Veng_saved > 0:
+            self.Veng_time.set("Vector Engrave: %s (planned moves save %s)" %(self.format_time(Veng_time),self.format_time(Veng_saved)))
+        else:
+            self.Veng_time.set("Vector Engrave: %s" %(self.format_time(Veng_time)))
+        if Vcut_saved > 0:
+            self.Vcut_time.set("    Vector Cut: %s (planned moves save %s)" %(self.format_time(Vcut_time),self.format_time(Vcut_saved)))
+        else:
+            self.Vcut_time.set("    Vector Cut: %s" %(self.format_time(Vcut_time)))
         self.Gcde_time.set("         Gcode: %s" %(self.format_time(Gcode_time)))
         
         ##########################################
@@ -1334,6 +1424,34 @@ class Application(Frame):
         self.refreshTime()
         self.entry_set(self.Entry_Rstep, self.Entry_Rstep_Check(), new=1)
 
+    #############################
+    def Entry_Tile_Mem_Check(self):
+        try:
+            value = float(self.tile_mem.get())
+            if  value < 1:
+                self.statusMessage.set(" Memory limit should be at least 1 MB")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Tile_Mem_Callback(self, varName, index, mode):
+        self.RengData.reset_path()
+        self.refreshTime()
+        self.entry_set(self.Entry_Tile_Mem, self.Entry_Tile_Mem_Check(), new=1)
+
+    #############################
+    def Entry_Raster_Procs_Check(self):
+        try:
+            value = int(self.raster_procs.get())
+            if  value < 1 or value > 64:
+                self.statusMessage.set(" Processes should be between 1 and 64")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Raster_Procs_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Raster_Procs, self.Entry_Raster_Procs_Check(), new=1)
+
 ##    #############################
 ##    def Entry_Unsharp_Radius_Check(self):
 ##        try:
@@ -1419,6 +1537,87 @@ class Application(Frame):
         return 0         # Value is a valid number
     def Entry_Ink_Timeout_Callback(self, varName, index, mode):
         self.entry_set(self.Entry_Ink_Timeout,self.Entry_Ink_Timeout_Check(), new=1)
+
+    #############################
+    def Entry_Ink_Cache_Check(self):
+        try:
+            value = float(self.ink_cache_mb.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Cache size should be 0 or greater")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Ink_Cache_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Ink_Cache,self.Entry_Ink_Cache_Check(), new=1)
+
+    #############################
+    def Entry_EGV_Cache_Check(self):
+        try:
+            value = float(self.egv_cache_mb.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Cache size should be 0 or greater")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_EGV_Cache_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_EGV_Cache,self.Entry_EGV_Cache_Check(), new=1)
+
+    #############################
+    def Entry_Gcode_Feed_Tol_Check(self):
+        try:
+            value = float(self.gcode_feed_tol.get())
+            if  value < 0.0 or value >= 100.0:
+                self.statusMessage.set(" Feed tolerance should be 0 or greater and less than 100")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Gcode_Feed_Tol_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Gcode_Feed_Tol,self.Entry_Gcode_Feed_Tol_Check(), new=1)
+
+    #############################
+    def Entry_Gcode_Feed_Step_Check(self):
+        try:
+            value = float(self.gcode_feed_step.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Feed step should be 0 or greater")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Gcode_Feed_Step_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Gcode_Feed_Step,self.Entry_Gcode_Feed_Step_Check(), new=1)
+
+    #############################
+    def Entry_Gcode_Feed_Min_Check(self):
+        try:
+            value = float(self.gcode_feed_min.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Minimum feed should be 0 or greater")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Gcode_Feed_Min_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Gcode_Feed_Min,self.Entry_Gcode_Feed_Min_Check(), new=1)
+
+    #############################
+    def Entry_Gcode_Feed_Max_Check(self):
+        try:
+            value = float(self.gcode_feed_max.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Maximum feed should be 0 or greater")
+                return 2 # Value is invalid number
+            if  value != 0 and value < float(self.gcode_feed_min.get()):
+                self.statusMessage.set(" Maximum feed should be 0 (no limit) or greater than the minimum feed")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Gcode_Feed_Max_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Gcode_Feed_Max,self.Entry_Gcode_Feed_Max_Check(), new=1)
         
      
     #############################
@@ -1683,6 +1882,9 @@ class Application(Frame):
         self.Vcut_feed.set  ( self.Scale_Text_Value('%.1f',self.Vcut_feed.get()   ,vfactor) )
         self.trace_speed.set( self.Scale_Text_Value('%.1f',self.trace_speed.get() ,vfactor) )
         self.rapid_feed.set ( self.Scale_Text_Value('%.1f',self.rapid_feed.get()  ,vfactor) )
+        self.gcode_feed_min.set ( self.Scale_Text_Value('%.1f',self.gcode_feed_min.get()  ,vfactor) )
+        self.gcode_feed_max.set ( self.Scale_Text_Value('%.1f',self.gcode_feed_max.get()  ,vfactor) )
+        self.gcode_feed_step.set( self.Scale_Text_Value('%.2f',self.gcode_feed_step.get() ,vfactor) )
 
     def Scale_Text_Value(self,format_txt,Text_Value,factor):
         try:
@@ -1848,57 +2050,11 @@ class Application(Frame):
         
     def Open_EGV(self,filemname,n_passes=1):
         self.stop[0]=False
-        EGV_data=[]
-        value1 = ""
-        value2 = ""
-        value3 = ""
-        value4 = ""
-        data=""
-        #value1 and value2 are the absolute y and x starting positions
-        #value3 and value4 are the absolute y and x end positions
-        with open(filemname) as f:
-            while True:
-                ## Skip header
-                c = f.read(1)
-                while c!="%" and c:
-                    c = f.read(1)
-                ## Read 1st Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value1 = value1 + c
-                    c = f.read(1)
-                y_start_mils = int(value1) 
-                ## Read 2nd Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value2 = value2 + c
-                    c = f.read(1)
-                x_start_mils = int(value2)   
-                ## Read 3rd Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value3 = value3 + c
-                    c = f.read(1)
-                y_end_mils = int(value3)
-                ## Read 4th Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value4 = value4 + c
-                    c = f.read(1)
-                x_end_mils = int(value4)
-                break
-
-            ## Read Data
-            while True:
-                c = f.read(1)
-                if not c:
-                    break
-                if c=='\n' or c==' ' or c=='\r':
-                    pass
-                else:
-                    data=data+"%c" %c
-                    EGV_data.append(ord(c))
-                    
+        #y_start_mils and x_start_mils are the absolute y and x starting positions
+        #y_end_mils and x_end_mils are the absolute y and x end positions
+        values,EGV_data = read_egv_file(filemname)
+        y_start_mils,x_start_mils,y_end_mils,x_end_mils = values
+
         if ( (x_end_mils != 0) or (y_end_mils != 0) ):
             n_passes=1
         else:
@@ -1940,7 +2096,21 @@ class Application(Frame):
         svg_reader.set_inkscape_path(self.inkscape_path.get())
         self.input_dpi = 1000
         svg_reader.image_dpi = self.input_dpi
+        # Render the raster with one row per scan line (full resolution
+        # along the scan lines) instead of at 1000 dpi in both directions
+        if self.svg_ystep.get():
+            image_ystep = max(1,self.get_raster_step_1000in())
+        else:
+            image_ystep = 1
+        svg_reader.image_ystep = image_ystep
         svg_reader.timout = int(float( self.ink_timeout.get())*60.0) 
+        try:
+            self.render_cache.max_bytes = int(float(self.ink_cache_mb.get())*1024*1024)
+        except:
+            pass
+        svg_reader.render_cache = self.render_cache
+        cache_hits   = self.render_cache.hits
+        cache_misses = self.render_cache.misses
         dialog_pxpi    = None
         dialog_viewbox = None
         try:
@@ -1957,6 +2127,8 @@ class Application(Frame):
                     
                     svg_reader = SVG_READER()
                     svg_reader.set_inkscape_path(self.inkscape_path.get())
+                    svg_reader.image_ystep = image_ystep
+                    svg_reader.render_cache = self.render_cache
                     if pxpi_dialog.result == None:
                         return
                     
@@ -1968,6 +2140,8 @@ class Application(Frame):
             except SVG_TEXT_EXCEPTION as e:
                 svg_reader = SVG_READER()
                 svg_reader.set_inkscape_path(self.inkscape_path.get())
+                svg_reader.image_ystep = image_ystep
+                svg_reader.render_cache = self.render_cache
                 self.statusMessage.set("Converting TEXT to PATHS.")
                 self.master.update()
                 svg_reader.parse_svg(self.SVG_FILE)
@@ -2003,13 +2177,22 @@ class Application(Frame):
         ##########################
         ###   Load Image       ###
         ##########################
-        self.RengData.set_image(svg_reader.raster_PIL)
+        self.RengData.set_image(svg_reader.raster_PIL,ystep=svg_reader.image_ystep)
+        if self.compute_raster.get() and svg_reader.image_ystep != 1:
+            # keep the parsed SVG to render the raster again if the scanline
+            # step is changed
+            self.svg_raster_reader = svg_reader
         
         if (self.RengData.image != None):
             self.wim, self.him = self.RengData.image.size
+            self.him = self.him*self.RengData.image_ystep
             self.aspect_ratio =  float(self.wim-1) / float(self.him-1)
             #self.make_raster_coords()
         self.refreshTime()
+        cache_hits   = self.render_cache.hits   - cache_hits
+        cache_misses = self.render_cache.misses - cache_misses
+        if cache_hits+cache_misses > 0:
+            self.statusMessage.set("Inkscape cache: %d hits, %d misses" %(cache_hits,cache_misses))
         margin=0.0625 # A bit of margin to prevent the warningwindow for designs that are close to being within the bounds
         if self.Design_bounds[0] > self.VengData.bounds[0]+margin or\
            self.Design_bounds[0] > self.VcutData.bounds[0]+margin or\
@@ -2035,7 +2218,6 @@ class Application(Frame):
             if (self.RengData.image != None and self.RengData.ecoords==[]):
                 ecoords=[]
                 cutoff=128
-                image_temp = self.RengData.image.convert("L")
 ##                if self.unsharp_flag.get():
 ##                    from PIL import ImageFilter       
 ##                    #image_temp = image_temp.filter(UnsharpMask(radius=self.unsharp_r, percent=self.unsharp_p, threshold=self.unsharp_t))
@@ -2045,130 +2227,120 @@ class Application(Frame):
 ##                    filter.threshold = int(float(self.unsharp_t.get())) # Threshold 0
 ##                    image_temp = image_temp.filter(filter)
 
-                if self.negate.get():
-                    image_temp = ImageOps.invert(image_temp)
-                    
-                if self.mirror.get():
-                    image_temp = ImageOps.mirror(image_temp)
-
-                if self.rotate.get():
-                    #image_temp = image_temp.rotate(90,expand=True)
-                    image_temp = self.rotate_raster(image_temp)
-
                 Xscale = float(self.LaserXscale.get())
                 Yscale = float(self.LaserYscale.get())    
                 if self.rotary.get():
                     Rscale = float(self.LaserRscale.get())
                     Yscale = Yscale*Rscale
 
-                if Xscale != 1.0 or Yscale != 1.0:
-                    wim,him = image_temp.size
-                    nw = int(wim*Xscale)
-                    nh = int(him*Yscale)
-                    image_temp = image_temp.resize((nw,nh))
-
-                    
                 if self.halftone.get():
-                    #start = time()
                     ht_size_mils =  round( 1000.0 / float(self.ht_size.get()) ,1)
                     npixels = int( round(ht_size_mils,1) )
                     if npixels == 0:
                         return
-                    wim,him = image_temp.size
-                    # Convert to Halftoning and save
-                    nw=int(wim / npixels)
-                    nh=int(him / npixels)
-                    image_temp = image_temp.resize((nw,nh))
-                    
-                    image_temp = self.convert_halftoning(image_temp)
-                    image_temp = image_temp.resize((wim,him))
-                    #print time()-start
+                    M1 = float(self.bezier_M1.get())
+                    M2 = float(self.bezier_M2.get())
+                    w  = float(self.bezier_weight.get())
+                    halftone_params  = (npixels,M1,M2,w,self.ht_method.get())
+                    threshold_params = None
                 else:
-                    image_temp = image_temp.point(lambda x: 0 if x<128 else 255, '1')
-                    #image_temp = image_temp.convert('1',dither=Image.NONE)
-                    
-                    
-                if DEBUG:
-                    image_name = os.path.expanduser("~")+"/IMAGE.png"
-                    image_temp.save(image_name,"PNG")
-
-                Reng_np = image_temp.load()
-                wim,him = image_temp.size
-                del image_temp
-                #######################################
-                x=0
-                y=0
-                loop=1
-                LENGTH=0
-                n_scanlines = 0 
-                
-                my_hull = hull2D()
-                bignumber = 9999999;
+                    halftone_params  = None
+                    threshold_params = (cutoff,)
+
                 Raster_step = self.get_raster_step_1000in()
-                timestamp=0
-                for i in range(0,him,Raster_step):
-                    stamp=int(3*time()) #update every 1/3 of a second
-                    if (stamp != timestamp):
-                        timestamp=stamp #interlock
-                        self.statusMessage.set("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
+
+                # Images rendered at the scanline step are only expanded to
+                # full resolution for the steps that need square pixels
+                image_ystep = self.RengData.image_ystep
+                if image_ystep == 1 or self.rotate.get() or halftone_params != None:
+                    scan_ystep = 1
+                else:
+                    scan_ystep = Raster_step
+                    if image_ystep != Raster_step and self.svg_rerender.get() \
+                       and self.svg_raster_reader != None:
+                        self.statusMessage.set("Rendering SVG raster for the new scanline step.")
                         self.master.update()
-                    if self.stop[0]==True:
-                        raise Exception("Action stopped by User.")
-                    line = []
-                    cnt=1
-                    LEFT  = bignumber;
-                    RIGHT =-bignumber;
-                    for j in range(1,wim):
-                        if (Reng_np[j,i] == Reng_np[j-1,i]):
-                            cnt = cnt+1
-                        else:
-                            #laser = "U" if Reng_np[j-1,i] > cutoff else "D"
-                            if Reng_np[j-1,i]:
-                                laser = "U"
-                            else:
-                                laser = "D"
-                                LEFT  = min(j-cnt,LEFT)
-                                RIGHT = max(j,RIGHT)
-                                
-                            line.append((cnt,laser))
-                            cnt=1
-                    #laser = "U" if Reng_np[j-1,i] > cutoff else "D"
-                    if Reng_np[j-1,i] > cutoff:
-                        laser = "U"
+                        image = self.svg_raster_reader.render_raster(Raster_step)
+                        self.RengData.set_image(image,ystep=Raster_step)
+                        image_ystep = Raster_step
+                if image_ystep != scan_ystep:
+                    ystep_params = (image_ystep,scan_ystep)
+                else:
+                    ystep_params = None
+                row_step = Raster_step//scan_ystep
+
+                def make_scanlines(image_temp):
+                    if DEBUG:
+                        image_name = os.path.expanduser("~")+"/IMAGE.png"
+                        image_temp.save(image_name,"PNG")
+                    scanner = RasterScan(cutoff=cutoff)
+                    return scanner.make_scanlines(image_temp,
+                                                  row_step,
+                                                  update_gui=self.update_gui,
+                                                  stop_calc=self.stop,
+                                                  processes=self.get_raster_processes(),
+                                                  ystep=scan_ystep)
+
+                # Each stage is only recomputed when its settings (or the
+                # settings of a stage before it) have changed
+                if self.raster_pipeline.source is not self.RengData.image:
+                    self.raster_pipeline.set_source(self.RengData.image)
+                # params of None skip a stage
+                on = lambda value: () if value else None
+                if Xscale != 1.0 or Yscale != 1.0:
+                    scale_params = (Xscale,Yscale)
+                else:
+                    scale_params = None
+                stages = [
+                    ("convert_L", ()                   , lambda im: im.convert("L")),
+                    ("ystep"    , ystep_params         , lambda im: self.resample_raster_rows(im,image_ystep,scan_ystep)),
+                    ("negate"   , on(self.negate.get()), ImageOps.invert),
+                    ("mirror"   , on(self.mirror.get()), ImageOps.mirror),
+                    ("rotate"   , on(self.rotate.get()), self.rotate_raster),
+                    ("scale"    , scale_params         , lambda im: self.scale_raster(im,Xscale,Yscale)),
+                    ("halftone" , halftone_params      , lambda im: self.halftone_raster(im,npixels)),
+                    ("threshold", threshold_params     , lambda im: im.point(lambda x: 0 if x<cutoff else 255, '1')),
+                    ]
+                if self.tiled_raster.get() and TiledRaster.available():
+                    if scale_params == None and halftone_params == None and ystep_params == None \
+                       and not self.rotate.get():
+                        # The remaining stages work row by row so each band is
+                        # cut from the source image and processed on its own
+                        band_source = self.RengData.image
+                        band_stages = stages
                     else:
-                        laser = "D"
-                        LEFT  = min(j-cnt,LEFT)
-                        RIGHT = max(j,RIGHT)
-                        
-                    line.append((cnt,laser))
-                    if LEFT != bignumber and RIGHT != -bignumber:
-                        LENGTH = LENGTH + (RIGHT - LEFT)/1000.0
-                        n_scanlines = n_scanlines + 1
-                    
-                    y=(him-i)/1000.0
-                    x=0
-                    if LEFT != bignumber:
-                        hcoords.append([LEFT/1000.0,y])
-                    if RIGHT != -bignumber:
-                        hcoords.append([RIGHT/1000.0,y])
-                    if hcoords!=[]:
-                        hcoords = my_hull.convexHullecoords(hcoords)
-                        
-                    #rng = range(0,len(line),1)
-                    rng = list(range(0,len(line),1))
-                        
-                    for i in rng:
-                        seg = line[i]
-                        delta = seg[0]/1000.0
-                        if seg[1]=="D":
-                            loop=loop+1
-                            ecoords.append([x      ,y,loop])
-                            ecoords.append([x+delta,y,loop])
-                        x = x + delta
-                #if ecoords!=[]:
-                self.RengData.set_ecoords(ecoords,data_sorted=True)
-                self.RengData.len=LENGTH
-                self.RengData.n_scanlines = n_scanlines
+                        band_source = self.raster_pipeline.run_once(self.RengData.image,stages)
+                        band_stages = []
+                    def get_band(y0,y1):
+                        band = band_source.crop((0,y0,band_source.size[0],y1))
+                        return self.raster_pipeline.run_once(band,band_stages)
+                    mem_budget = float(self.tile_mem.get())*1024*1024
+                    tiled = TiledRaster(band_source.size,
+                                        row_step,
+                                        get_band,
+                                        mem_budget=mem_budget,
+                                        update_gui=self.update_gui,
+                                        stop_calc=self.stop,
+                                        ystep=scan_ystep)
+                    band_source = None
+                    if tiled.n_scanlines > 0:
+                        ecoords = tiled
+                    else:
+                        ecoords = []
+                    self.RengData.set_raster(ecoords,tiled.LENGTH,tiled.n_scanlines)
+                    hcoords = tiled.hull_coords
+                else:
+                    ecoords,LENGTH,n_scanlines,hcoords = self.raster_pipeline.run(
+                        stages + [("scanlines", (row_step,scan_ystep), make_scanlines)])
+                    if self.island_raster.get() and hasattr(ecoords,"row_ptr"):
+                        islands = RasterIslands(ecoords,LENGTH)
+                        islands.order_blocks(0.0,float(ecoords.row_y.max()),self.engraveUP.get())
+                        if islands.worthwhile():
+                            ecoords     = islands
+                            LENGTH      = islands.LENGTH
+                            n_scanlines = islands.n_scanlines
+                    #if ecoords!=[]:
+                    self.RengData.set_raster(ecoords,LENGTH,n_scanlines)
             #Set Flag indicating raster paths have been calculated    
             self.RengData.rpaths = True
             self.RengData.hull_coords = hcoords
@@ -2191,6 +2363,12 @@ class Application(Frame):
     #######################################################################
 
 
+    def resample_raster_rows(self,image_in,ystep_in,ystep_out):
+        # Change the spacing of the image rows from ystep_in to ystep_out mils
+        wim,him = image_in.size
+        nh = max(1,int(round(him*ystep_in/float(ystep_out))))
+        return image_in.resize((wim,nh),Image.NEAREST)
+
     def rotate_raster(self,image_in):
         wim,him = image_in.size
         im_rotated = Image.new("L", (him, wim), "white")
@@ -2203,11 +2381,32 @@ class Application(Frame):
                 im_rotated_np[i,wim-j] = image_in_np[j,i]
         return im_rotated
     
+    def scale_raster(self,image_in,Xscale,Yscale):
+        wim,him = image_in.size
+        nw = int(wim*Xscale)
+        nh = int(him*Yscale)
+        return image_in.resize((nw,nh))
+
+    def halftone_raster(self,image_in,npixels):
+        wim,him = image_in.size
+        # Convert to Halftoning and save
+        nw=int(wim / npixels)
+        nh=int(him / npixels)
+        image_temp = image_in.resize((nw,nh))
+        image_temp = self.convert_halftoning(image_temp)
+        return image_temp.resize((wim,him))
+    
     def get_raster_step_1000in(self):
         val_in = float(self.rast_step.get())
         value = int(round(val_in*1000.0,1))
         return value
 
+    def get_raster_processes(self):
+        try:
+            return max(1,int(self.raster_procs.get()))
+        except:
+            return 1
+
 
     def generate_bezier(self,M1,M2,w,n=100):
         if (M1==M2):
@@ -2230,8 +2429,7 @@ class Application(Frame):
     # Create a Half-tone version of the image
     def convert_halftoning(self,image):
         image = image.convert('L')
-        x_lim, y_lim = image.size
-        pixel = image.load()
+        dither = Dither()
         
         M1 = float(self.bezier_M1.get())
         M2 = float(self.bezier_M2.get())
@@ -2239,27 +2437,14 @@ class Application(Frame):
         
         if w > 0:
             x,y = self.generate_bezier(M1,M2,w)
-            
-            interp = interpolate(x, y) # Set up interpolate class
-            val_map=[]
-            # Map Bezier Curve to values between 0 and 255
-            for val in range(0,256):
-                val_out = int(round(interp[val])) # Get the interpolated value at each value
-                val_map.append(val_out)
-            # Adjust image
-            timestamp=0
-            for y in range(1, y_lim):
-                stamp=int(3*time()) #update every 1/3 of a second
-                if (stamp != timestamp):
-                    timestamp=stamp #interlock
-                    self.statusMessage.set("Adjusting Image Darkness: %.1f %%" %( (100.0*y)/y_lim ) )
-                    self.master.update()
-                for x in range(1, x_lim):
-                    pixel[x, y] = val_map[ pixel[x, y] ]
+            # Map Bezier Curve to values between 0 and 255 and adjust image
+            self.statusMessage.set("Adjusting Image Darkness." )
+            self.master.update()
+            image = image.point(dither.make_lut(x,y))
 
         self.statusMessage.set("Creating Halftone Image." )
         self.master.update()
-        image = image.convert('1')
+        image = dither.dither(image,self.ht_method.get())
         return image
 
     #######################################################################
@@ -2460,6 +2645,14 @@ class Application(Frame):
                         self.rotate.set(line[line.find("rotate"):].split()[1])
                     elif "engraveUP"  in line:
                         self.engraveUP.set(line[line.find("engraveUP"):].split()[1])
+                    elif "tiled_raster"  in line:
+                        self.tiled_raster.set(line[line.find("tiled_raster"):].split()[1])
+                    elif "island_raster"  in line:
+                        self.island_raster.set(line[line.find("island_raster"):].split()[1])
+                    elif "svg_ystep"  in line:
+                        self.svg_ystep.set(line[line.find("svg_ystep"):].split()[1])
+                    elif "svg_rerender"  in line:
+                        self.svg_rerender.set(line[line.find("svg_rerender"):].split()[1])
                     elif "init_home"  in line:
                         self.init_home.set(line[line.find("init_home"):].split()[1])
                     elif "post_home"  in line:
@@ -2473,6 +2666,12 @@ class Application(Frame):
                         
                     elif "pre_pr_crc"  in line:
                         self.pre_pr_crc.set(line[line.find("pre_pr_crc"):].split()[1])
+                    elif "stream_egv"  in line:
+                        self.stream_egv.set(line[line.find("stream_egv"):].split()[1])
+                    elif "egv_parallel"  in line:
+                        self.egv_parallel.set(line[line.find("egv_parallel"):].split()[1])
+                    elif "plan_rapids"  in line:
+                        self.plan_rapids.set(line[line.find("plan_rapids"):].split()[1])
                     elif "inside_first"  in line:
                         self.inside_first.set(line[line.find("inside_first"):].split()[1])
                     elif "comb_engrave"  in line:
@@ -2514,6 +2713,12 @@ class Application(Frame):
                          self.rast_step.set(line[line.find("rast_step"):].split()[1])
                     elif "ht_size"    in line:
                          self.ht_size.set(line[line.find("ht_size"):].split()[1])
+                    elif "ht_method"    in line:
+                         self.ht_method.set(line[line.find("ht_method"):].split()[1])
+                    elif "tile_mem"    in line:
+                         self.tile_mem.set(line[line.find("tile_mem"):].split()[1])
+                    elif "raster_procs"    in line:
+                         self.raster_procs.set(line[line.find("raster_procs"):].split()[1])
 
                     elif "LaserXsize"    in line:
                          self.LaserXsize.set(line[line.find("LaserXsize"):].split()[1])
@@ -2562,6 +2767,20 @@ class Application(Frame):
 
                     elif "ink_timeout"    in line:
                          self.ink_timeout.set(line[line.find("ink_timeout"):].split()[1])
+                    elif "ink_cache_mb"    in line:
+                         self.ink_cache_mb.set(line[line.find("ink_cache_mb"):].split()[1])
+                    elif "egv_cache_mb"    in line:
+                         self.egv_cache_mb.set(line[line.find("egv_cache_mb"):].split()[1])
+                    elif "gcode_feed_tol"  in line:
+                         self.gcode_feed_tol.set(line[line.find("gcode_feed_tol"):].split()[1])
+                    elif "gcode_feed_min"  in line:
+                         self.gcode_feed_min.set(line[line.find("gcode_feed_min"):].split()[1])
+                    elif "gcode_feed_max"  in line:
+                         self.gcode_feed_max.set(line[line.find("gcode_feed_max"):].split()[1])
+                    elif "gcode_feed_step" in line:
+                         self.gcode_feed_step.set(line[line.find("gcode_feed_step"):].split()[1])
+                    elif "usb_skip_check"  in line:
+                         self.usb_skip_check.set(line[line.find("usb_skip_check"):].split()[1])
 
                     elif "designfile"    in line:
                            self.DESIGN_FILE=(line[line.find("designfile"):].split("\042")[1])
@@ -2828,7 +3047,7 @@ class Application(Frame):
                 if self.rotary.get() and float(self.rapid_feed.get()):
                     self.slow_jog(int(dxmils),int(dymils))
                 else:
-                    self.k40.rapid_move(int(dxmils),int(dymils))
+                    self.laser_call(lambda k40,progress,cancel: k40.rapid_move(int(dxmils),int(dymils)))
 
                 return True
             else:
@@ -2849,8 +3068,8 @@ class Application(Frame):
         if int(dxmils)==0 and int(dymils)==0:
             return
         self.stop[0]=False
-        Rapid_data=[]
-        Rapid_inst = egv(target=lambda s:Rapid_data.append(s))
+        Rapid_data=bytearray()
+        Rapid_inst = egv(target=Rapid_data)
         Rapid_feed = float(self.rapid_feed.get())*self.feed_factor()
         Rapid_inst.make_egv_rapid(dxmils,dymils,Feed=Rapid_feed,board_name=self.board_name.get())
         self.send_egv_data(Rapid_data, 1, None)
@@ -2863,6 +3082,34 @@ class Application(Frame):
         self.master.update()
         return True
 
+    def laser_call(self,function):
+        # Run function(k40,progress,cancel) on the transport thread, which
+        # does all of the USB work, and wait for it while Tk keeps running.
+        # The progress messages are picked up by an after() loop.
+        job = self.transport.submit(function,self.k40)
+        if not job.done.wait(0.05):
+            finished = IntVar()
+            def poll():
+                self.show_transport_events()
+                if job.done.is_set():
+                    finished.set(1)
+                else:
+                    self.master.after(50,poll)
+            self.master.after(50,poll)
+            self.master.wait_variable(finished)
+        self.show_transport_events()
+        if job.error != None:
+            debug_message(job.traceback)
+            raise job.error
+        return job.result
+
+    def show_transport_events(self):
+        # only the last progress message is shown
+        for kind,message,bgcolor in self.transport.events():
+            if kind == LaserTransport.PROGRESS:
+                self.statusMessage.set(message)
+                self.statusbar.configure( bg = bgcolor )
+
     def set_gui(self,new_state="normal"):
         if new_state=="normal":
             self.GUI_Disabled=False
@@ -3382,11 +3629,12 @@ class Application(Frame):
             else:
                 Rapid_Feed = 0.0
                 
-            Raster_Eng_data=[]
-            Vector_Eng_data=[]
-            Trace_Eng_data=[]
-            Vector_Cut_data=[]
-            G_code_Cut_data=[]
+            Raster_Eng_op=None
+            Vector_Eng_op=None
+            Trace_Eng_op=None
+            Vector_Cut_op=None
+            G_code_Cut_op=None
+            feed_policy=None
                         
             if (operation_type.find("Vector_Cut") > -1) and  (self.VcutData.ecoords!=[]):
                 Feed_Rate = float(self.Vcut_feed.get())*feed_factor
@@ -3426,19 +3674,17 @@ class Application(Frame):
                     Vcut_coords = self.mirror_rotate_vector_coords(Vcut_coords)
 
                 Vcut_coords,startx,starty = self.scale_vector_coords(Vcut_coords,startx,starty)
-                Vector_Cut_egv_inst = egv(target=lambda s:Vector_Cut_data.append(s))   
-                Vector_Cut_egv_inst.make_egv_data(
+                Vector_Cut_op = EgvOperation(
                                                 Vcut_coords,                      \
                                                 startX=startx,                    \
                                                 startY=starty,                    \
                                                 Feed = Feed_Rate,                 \
                                                 board_name=self.board_name.get(), \
                                                 Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
                                                 FlipXoffset=FlipXoffset,          \
                                                 Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
+                                                use_laser=True,                   \
+                                                plan_rapids=self.plan_rapids.get()
                                                 )
 
             if (operation_type.find("Vector_Eng") > -1) and  (self.VengData.ecoords!=[]):
@@ -3455,19 +3701,17 @@ class Application(Frame):
                     Veng_coords = self.mirror_rotate_vector_coords(Veng_coords)
 
                 Veng_coords,startx,starty = self.scale_vector_coords(Veng_coords,startx,starty)
-                Vector_Eng_egv_inst = egv(target=lambda s:Vector_Eng_data.append(s))
-                Vector_Eng_egv_inst.make_egv_data(
+                Vector_Eng_op = EgvOperation(
                                                 Veng_coords,                      \
                                                 startX=startx,                    \
                                                 startY=starty,                    \
                                                 Feed = Feed_Rate,                 \
                                                 board_name=self.board_name.get(), \
                                                 Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
                                                 FlipXoffset=FlipXoffset,          \
                                                 Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
+                                                use_laser=True,                   \
+                                                plan_rapids=self.plan_rapids.get()
                                                 )
 
 
@@ -3476,19 +3720,17 @@ class Application(Frame):
                 laser_on = self.trace_w_laser.get()
                 self.statusMessage.set("Generating EGV data...")
                 self.master.update()
-                Trace_Eng_egv_inst = egv(target=lambda s:Trace_Eng_data.append(s))
-                Trace_Eng_egv_inst.make_egv_data(
+                Trace_Eng_op = EgvOperation(
                                                 self.trace_coords,                \
                                                 startX=startx,                    \
                                                 startY=starty,                    \
                                                 Feed = Feed_Rate,                 \
                                                 board_name=self.board_name.get(), \
                                                 Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
                                                 FlipXoffset=FlipXoffset,          \
                                                 Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=laser_on
+                                                use_laser=laser_on,               \
+                                                plan_rapids=self.plan_rapids.get()
                                                 )
                 
                 
@@ -3506,21 +3748,28 @@ class Application(Frame):
                     Yscale = Yscale*Rscale
                 raster_starty = Yscale*starty
 
+                # tiled raster data is generated band by band, keep it in one process
+                if isinstance(self.RengData.ecoords,TiledRaster):
+                    raster_processes = 1
+                else:
+                    raster_processes = self.get_raster_processes()
+
+                if hasattr(self.RengData.ecoords,"order_blocks"):
+                    self.RengData.ecoords.order_blocks(raster_startx,raster_starty,Raster_step > 0,FlipXoffset)
+
                 self.statusMessage.set("Generating EGV data...")
                 self.master.update()
-                Raster_Eng_egv_inst = egv(target=lambda s:Raster_Eng_data.append(s))
-                Raster_Eng_egv_inst.make_egv_data(
+                Raster_Eng_op = EgvOperation(
                                                 self.RengData.ecoords,            \
                                                 startX=raster_startx,             \
                                                 startY=raster_starty,             \
                                                 Feed = Feed_Rate,                 \
                                                 board_name=self.board_name.get(), \
                                                 Raster_step = Raster_step,        \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
                                                 FlipXoffset=FlipXoffset,          \
                                                 Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
+                                                use_laser=True,                   \
+                                                processes=raster_processes
                                                 )
                 #self.RengData.reset_path()
 
@@ -3528,67 +3777,86 @@ class Application(Frame):
                 self.statusMessage.set("Generating EGV data...")
                 self.master.update()
                 Gcode_coords = self.GcodeData.ecoords
+                # join feeds that are nearly the same into fewer speed changes
+                feed_policy = FeedPolicy(float(self.gcode_feed_tol.get())/100.0,
+                                         float(self.gcode_feed_min.get())*feed_factor,
+                                         float(self.gcode_feed_max.get())*feed_factor,
+                                         float(self.gcode_feed_step.get())*feed_factor)
+                if feed_policy.enabled():
+                    Gcode_coords = feed_policy.apply(Gcode_coords)
                 if self.mirror.get() or self.rotate.get():
                     Gcode_coords = self.mirror_rotate_vector_coords(Gcode_coords)
 
                 Gcode_coords,startx,starty = self.scale_vector_coords(Gcode_coords,startx,starty)
-                G_code_Cut_egv_inst = egv(target=lambda s:G_code_Cut_data.append(s))
-                G_code_Cut_egv_inst.make_egv_data(
+                G_code_Cut_op = EgvOperation(
                                                 Gcode_coords,                     \
                                                 startX=startx,                    \
                                                 startY=starty,                    \
                                                 Feed = None,                      \
                                                 board_name=self.board_name.get(), \
                                                 Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
                                                 FlipXoffset=FlipXoffset,          \
                                                 Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
+                                                use_laser=True,                   \
+                                                plan_rapids=self.plan_rapids.get()
                                                 )
                 
             ### Join Resulting Data together ###
-            data=[]
-            data.append(ord("I"))
-            if Trace_Eng_data!=[]:
+            operations=[]
+            if Trace_Eng_op != None:
                 trace_passes=1
-                for k in range(trace_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Trace_Eng_data)
-            if Raster_Eng_data!=[]:
-                num_passes = int(float(self.Reng_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Raster_Eng_data)
-            if Vector_Eng_data!=[]:
-                num_passes = int(float(self.Veng_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Vector_Eng_data)
-            if Vector_Cut_data!=[]:
-                num_passes = int(float(self.Vcut_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Vector_Cut_data)
-            if G_code_Cut_data!=[]:
-                num_passes = int(float(self.Gcde_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(G_code_Cut_data)
-            if len(data)< 4:
+                operations.append((Trace_Eng_op,trace_passes))
+            if Raster_Eng_op != None:
+                operations.append((Raster_Eng_op,int(float(self.Reng_passes.get()))))
+            if Vector_Eng_op != None:
+                operations.append((Vector_Eng_op,int(float(self.Veng_passes.get()))))
+            if Vector_Cut_op != None:
+                operations.append((Vector_Cut_op,int(float(self.Vcut_passes.get()))))
+            if G_code_Cut_op != None:
+                operations.append((G_code_Cut_op,int(float(self.Gcde_passes.get()))))
+            if operations == []:
+                raise Exception("No laser data was generated.")
+
+            # use the data made for an earlier send if nothing has changed
+            self.egv_cache.disk_cache.max_bytes = int(float(self.egv_cache_mb.get())*1024*1024)
+            operations = self.egv_cache.lookup(operations)
+
+            if self.stream_egv.get() and output_filename == None and self.k40 != None:
+                # Generate the data in a thread and send it as it is made
+                # (Parallel Operations is not used, see Set_Input_States_STREAM)
+                def stream_job(put):
+                    write_egv_job(operations,EgvSink(out=put,chunk_size=1024,hold=4),stop_calc=self.stop)
+                self.statusMessage.set("Sending Data to Laser...")
+                self.master.update()
+                self.send_egv_stream(threaded_stream(stream_job,maxsize=16))
+                self.menu_View_Refresh()
+                return
+
+            todo = [k for k in range(len(operations)) if callable(operations[k][0])]
+            if self.egv_parallel.get() and len(todo) > 1:
+                # make the data of all operations at the same time
+                self.statusMessage.set("Generating EGV data...")
+                self.master.update()
+                encoded = encode_operations([operations[k][0].operation for k in todo],
+                                            multiprocessing.cpu_count(),
+                                            self.update_gui,self.stop)
+                for k,data in zip(todo,encoded):
+                    operations[k][0].store(data)
+                    operations[k] = (data,operations[k][1])
+
+            # each operation is stored once however many passes it has
+            job=make_egv_job(operations,self.update_gui,self.stop)
+            if len(job)< 4:
                 raise Exception("No laser data was generated.")    
                 
             self.master.update()
             if output_filename != None:
-                self.write_egv_to_file(data,output_filename)
+                self.write_egv_to_file(job,output_filename)
             else:
-                self.send_egv_data(data, 1, output_filename)
+                self.send_egv_data(job, 1, output_filename)
                 self.menu_View_Refresh()
+            if feed_policy != None and feed_policy.enabled():
+                self.statusMessage.set("%s  (%d G-code speed changes removed)" %(self.statusMessage.get(),feed_policy.changes_removed()))
                 
         except MemoryError as e:
             msg1 = "Memory Error:"
@@ -3613,8 +3881,9 @@ class Application(Frame):
         if self.k40 != None:
             self.k40.timeout       = int(float( self.t_timeout.get()  )) 
             self.k40.n_timeouts    = int(float( self.n_timeouts.get() ))
+            self.k40.skip_ready_check = self.usb_skip_check.get()
             time_start = time()
-            self.k40.send_data(data,self.update_gui,self.stop,num_passes,pre_process_CRC, wait_for_laser=True)
+            self.laser_call(lambda k40,progress,cancel: k40.send_data(data,progress,cancel,num_passes,pre_process_CRC,wait_for_laser=True))
             self.run_time = time()-time_start
             if DEBUG:
                 print(("Elapsed Time: %.6f" %(time()-time_start)))
@@ -3625,26 +3894,39 @@ class Application(Frame):
             return
         self.menu_View_Refresh()
         
+    def send_egv_stream(self,chunks):
+        self.k40.timeout       = int(float( self.t_timeout.get()  ))
+        self.k40.n_timeouts    = int(float( self.n_timeouts.get() ))
+        self.k40.skip_ready_check = self.usb_skip_check.get()
+        time_start = time()
+        self.laser_call(lambda k40,progress,cancel: k40.send_stream(chunks,progress,cancel,wait_for_laser=True))
+        self.run_time = time()-time_start
+        if DEBUG:
+            print(("Elapsed Time: %.6f" %(time()-time_start)))
+
     ##########################################################################
     ##########################################################################
     def write_egv_to_file(self,data,fname):
         if len(data) == 0:
             raise Exception("No data available to write to file.")
         try:
-            fout = open(fname,'w')
+            fout = open(fname,'wb')
         except:
             raise Exception("Unable to open file ( %s ) for writing." %(fname))
-        fout.write("Document type : LHYMICRO-GL file\n")
-        fout.write("Creator-Software: K40 Whisperer\n")
-        
-        fout.write("\n")
-        fout.write("%0%0%0%0%")
-        for char_val in data:
-            char = chr(char_val)
-            fout.write("%s" %(char))
+        header = "Document type : LHYMICRO-GL file\n" + \
+                 "Creator-Software: K40 Whisperer\n" + \
+                 "\n"
+        # same line endings as the text mode file that used to be written
+        fout.write(header.replace("\n",os.linesep).encode('ascii'))
+        fout.write(b"%0%0%0%0%")
+        if hasattr(data,"chunks"):
+            for chunk in data.chunks():
+                fout.write(chunk)
+        else:
+            fout.write(data)
             
         #fout.write("\n")
-        fout.close
+        fout.close()
         self.menu_View_Refresh()
         self.statusMessage.set("Data saved to: %s" %(fname))
         
@@ -3652,7 +3934,7 @@ class Application(Frame):
         if self.GUI_Disabled:
             return
         if self.k40 != None:
-            self.k40.home_position()
+            self.laser_call(lambda k40,progress,cancel: k40.home_position())
         self.laserX  = 0.0
         self.laserY  = 0.0
         self.pos_offset = [0.0,0.0]
@@ -3662,7 +3944,7 @@ class Application(Frame):
         xpos = float(self.gotoX.get())
         ypos = float(self.gotoY.get())
         if self.k40 != None:
-            self.k40.home_position()
+            self.laser_call(lambda k40,progress,cancel: k40.home_position())
         self.laserX  = 0.0
         self.laserY  = 0.0
         self.Rapid_Move(xpos,ypos)
@@ -3671,7 +3953,7 @@ class Application(Frame):
     def Reset(self):
         if self.k40 != None:
             try:
-                self.k40.reset_usb()
+                self.laser_call(lambda k40,progress,cancel: k40.reset_usb())
                 self.statusMessage.set("USB Reset Succeeded")
             except:
                 debug_message(traceback.format_exc())
@@ -3683,14 +3965,17 @@ class Application(Frame):
         line1 = "Sending data to the laser from K40 Whisperer is currently Paused."
         line2 = "Press \"OK\" to abort any jobs currently running."
         line3 = "Press \"Cancel\" to resume."
-        if self.k40 != None:
-            self.k40.pause_un_pause()
+        # the pause is sent by the transport thread, also in the middle of a job
+        k40 = self.k40
+        if k40 != None:
+            self.transport.command(k40.pause_un_pause)
             
         if message_ask_ok_cancel("Stop Laser Job.", "%s\n\n%s\n%s" %(line1,line2,line3)):
             self.stop[0]=True
+            self.transport.cancel()
         else:
-            if self.k40 != None:
-                self.k40.pause_un_pause()
+            if k40 != None:
+                self.transport.command(k40.pause_un_pause)
 
     def Hide_Advanced(self,event=None):
         self.advanced.set(0)
@@ -3699,7 +3984,7 @@ class Application(Frame):
     def Release_USB(self):
         if self.k40 != None:
             try:
-                self.k40.release_usb()
+                self.laser_call(lambda k40,progress,cancel: k40.release_usb())
                 self.statusMessage.set("USB Release Succeeded")
             except:
                 debug_message(traceback.format_exc())
@@ -3715,8 +4000,8 @@ class Application(Frame):
         self.move_head_window_temporary([0.0,0.0])      
         self.k40=K40_CLASS()
         try:
-            self.k40.initialize_device()
-            self.k40.say_hello()
+            self.laser_call(lambda k40,progress,cancel: k40.initialize_device())
+            self.laser_call(lambda k40,progress,cancel: k40.say_hello())
             if self.init_home.get():
                 self.Home()
             else:
@@ -3742,7 +4027,7 @@ class Application(Frame):
             return
         if self.k40 != None:
             try:
-                self.k40.unlock_rail()
+                self.laser_call(lambda k40,progress,cancel: k40.unlock_rail())
                 self.statusMessage.set("Rail Unlock Succeeded")
                 self.statusbar.configure( bg = 'white' )
             except:
@@ -4265,10 +4550,28 @@ class Application(Frame):
         self.Set_Input_States()
 
     def Set_Input_States_RASTER(self,event=None):
+        if self.tiled_raster.get():
+            self.Label_Tile_Mem.configure(state="normal")
+            self.Label_Tile_Mem_u.configure(state="normal")
+            self.Entry_Tile_Mem.configure(state="normal")
+        else:
+            self.Label_Tile_Mem.configure(state="disabled")
+            self.Label_Tile_Mem_u.configure(state="disabled")
+            self.Entry_Tile_Mem.configure(state="disabled")
+
+        if self.svg_ystep.get():
+            self.Label_SVG_Rerender.configure(state="normal")
+            self.Checkbutton_SVG_Rerender.configure(state="normal")
+        else:
+            self.Label_SVG_Rerender.configure(state="disabled")
+            self.Checkbutton_SVG_Rerender.configure(state="disabled")
+
         if self.halftone.get():
             self.Label_Halftone_DPI.configure(state="normal")
             self.Halftone_DPI_OptionMenu.configure(state="normal")
             self.Label_Halftone_u.configure(state="normal")
+            self.Label_Halftone_Method.configure(state="normal")
+            self.Halftone_Method_OptionMenu.configure(state="normal")
             self.Label_bezier_M1.configure(state="normal")
             self.bezier_M1_Slider.configure(state="normal")
             self.Label_bezier_M2.configure(state="normal")
@@ -4279,6 +4582,8 @@ class Application(Frame):
             self.Label_Halftone_DPI.configure(state="disabled")
             self.Halftone_DPI_OptionMenu.configure(state="disabled")
             self.Label_Halftone_u.configure(state="disabled")
+            self.Label_Halftone_Method.configure(state="disabled")
+            self.Halftone_Method_OptionMenu.configure(state="disabled")
             self.Label_bezier_M1.configure(state="disabled")
             self.bezier_M1_Slider.configure(state="disabled")
             self.Label_bezier_M2.configure(state="disabled")
@@ -4291,6 +4596,16 @@ class Application(Frame):
             self.Entry_Batch_Path.configure(state="normal")
         else:
             self.Entry_Batch_Path.configure(state="disabled")
+
+    def Set_Input_States_STREAM(self):
+        # The streamed data is made operation by operation as it is sent,
+        # so there is nothing to make in parallel
+        if self.stream_egv.get():
+            self.Label_EGV_Parallel.configure(state="disabled")
+            self.Checkbutton_EGV_Parallel.configure(state="disabled")
+        else:
+            self.Label_EGV_Parallel.configure(state="normal")
+            self.Checkbutton_EGV_Parallel.configure(state="normal")
 ##    def Set_Input_States_Unsharp(self,event=None):        
 ##        if self.unsharp_flag.get():
 ##            self.Label_Unsharp_Radius.configure(state="normal")
@@ -4461,18 +4776,24 @@ class Application(Frame):
                 Yscale = Yscale*Rscale
             ######
 
-            for line in self.RengData.ecoords:
-                XY    = line
-                x1    = XY[0]*Xscale
-                y1    = XY[1]*Yscale-ymax
-                loop  = XY[2]
+            if hasattr(self.RengData.ecoords,"segments"):
                 color = "black"
-                # check and see if we need to move to a new discontinuous start point
-                if (loop == loop_old):
-                    self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, color)
-                loop_old = loop
-                xold=x1
-                yold=y1
+                for x1,x2,y in self.RengData.ecoords.segments():
+                    y1 = y*Yscale-ymax
+                    self.Plot_Line(x1*Xscale, y1, x2*Xscale, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, color)
+            else:
+                for line in self.RengData.ecoords:
+                    XY    = line
+                    x1    = XY[0]*Xscale
+                    y1    = XY[1]*Yscale-ymax
+                    loop  = XY[2]
+                    color = "black"
+                    # check and see if we need to move to a new discontinuous start point
+                    if (loop == loop_old):
+                        self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, color)
+                    loop_old = loop
+                    xold=x1
+                    yold=y1
 
             
         ######################################
@@ -4728,7 +5049,7 @@ class Application(Frame):
     ################################################################################
     def GEN_Settings_Window(self):
         gen_width = 560
-        gen_settings = Toplevel(width=gen_width, height=560) #460+75)
+        gen_settings = Toplevel(width=gen_width, height=818) #460+75)
         gen_settings.grab_set() # Use grab_set to prevent user input in the main window
         gen_settings.focus_set()
         gen_settings.resizable(0,0)
@@ -4812,6 +5133,89 @@ class Application(Frame):
         self.Checkbutton_Preprocess_CRC.place(x=xd_entry_L, y=D_Yloc, width=75, height=23)
         self.Checkbutton_Preprocess_CRC.configure(variable=self.pre_pr_crc)
 
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Stream_EGV = Label(gen_settings,text="Send While Generating")
+        self.Label_Stream_EGV.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_Stream_EGV = Checkbutton(gen_settings,text="", anchor=W, command=self.Set_Input_States_STREAM)
+        self.Checkbutton_Stream_EGV.place(x=xd_entry_L, y=D_Yloc, width=75, height=23)
+        self.Checkbutton_Stream_EGV.configure(variable=self.stream_egv)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_EGV_Parallel = Label(gen_settings,text="Parallel Operations")
+        self.Label_EGV_Parallel.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_EGV_Parallel = Checkbutton(gen_settings,text="", anchor=W)
+        self.Checkbutton_EGV_Parallel.place(x=xd_entry_L, y=D_Yloc, width=75, height=23)
+        self.Checkbutton_EGV_Parallel.configure(variable=self.egv_parallel)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Plan_Rapids = Label(gen_settings,text="Plan Laser Off Moves")
+        self.Label_Plan_Rapids.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_Plan_Rapids = Checkbutton(gen_settings,text="", anchor=W)
+        self.Checkbutton_Plan_Rapids.place(x=xd_entry_L, y=D_Yloc, width=75, height=23)
+        self.Checkbutton_Plan_Rapids.configure(variable=self.plan_rapids)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_EGV_Cache = Label(gen_settings,text="EGV Disk Cache Size")
+        self.Label_EGV_Cache.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_EGV_Cache_u = Label(gen_settings,text="MB", anchor=W)
+        self.Label_EGV_Cache_u.place(x=xd_units_L, y=D_Yloc, width=w_units*2, height=21)
+        self.Entry_EGV_Cache = Entry(gen_settings,width="15")
+        self.Entry_EGV_Cache.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_EGV_Cache.configure(textvariable=self.egv_cache_mb)
+        self.egv_cache_mb.trace_variable("w", self.Entry_EGV_Cache_Callback)
+        self.entry_set(self.Entry_EGV_Cache,self.Entry_EGV_Cache_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Gcode_Feed_Tol = Label(gen_settings,text="G-Code Feed Tolerance")
+        self.Label_Gcode_Feed_Tol.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Gcode_Feed_Tol_u = Label(gen_settings,text="%", anchor=W)
+        self.Label_Gcode_Feed_Tol_u.place(x=xd_units_L, y=D_Yloc, width=w_units, height=21)
+        self.Entry_Gcode_Feed_Tol = Entry(gen_settings,width="15")
+        self.Entry_Gcode_Feed_Tol.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Gcode_Feed_Tol.configure(textvariable=self.gcode_feed_tol)
+        self.gcode_feed_tol.trace_variable("w", self.Entry_Gcode_Feed_Tol_Callback)
+        self.entry_set(self.Entry_Gcode_Feed_Tol,self.Entry_Gcode_Feed_Tol_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Gcode_Feed_Step = Label(gen_settings,text="G-Code Feed Step")
+        self.Label_Gcode_Feed_Step.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Gcode_Feed_Step_u = Label(gen_settings,textvariable=self.funits, anchor=W)
+        self.Label_Gcode_Feed_Step_u.place(x=xd_units_L, y=D_Yloc, width=w_units, height=21)
+        self.Entry_Gcode_Feed_Step = Entry(gen_settings,width="15")
+        self.Entry_Gcode_Feed_Step.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Gcode_Feed_Step.configure(textvariable=self.gcode_feed_step)
+        self.gcode_feed_step.trace_variable("w", self.Entry_Gcode_Feed_Step_Callback)
+        self.entry_set(self.Entry_Gcode_Feed_Step,self.Entry_Gcode_Feed_Step_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Gcode_Feed_Min = Label(gen_settings,text="G-Code Minimum Feed")
+        self.Label_Gcode_Feed_Min.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Gcode_Feed_Min_u = Label(gen_settings,textvariable=self.funits, anchor=W)
+        self.Label_Gcode_Feed_Min_u.place(x=xd_units_L, y=D_Yloc, width=w_units, height=21)
+        self.Entry_Gcode_Feed_Min = Entry(gen_settings,width="15")
+        self.Entry_Gcode_Feed_Min.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Gcode_Feed_Min.configure(textvariable=self.gcode_feed_min)
+        self.gcode_feed_min.trace_variable("w", self.Entry_Gcode_Feed_Min_Callback)
+        self.entry_set(self.Entry_Gcode_Feed_Min,self.Entry_Gcode_Feed_Min_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Gcode_Feed_Max = Label(gen_settings,text="G-Code Maximum Feed")
+        self.Label_Gcode_Feed_Max.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Gcode_Feed_Max_u = Label(gen_settings,textvariable=self.funits, anchor=W)
+        self.Label_Gcode_Feed_Max_u.place(x=xd_units_L, y=D_Yloc, width=w_units, height=21)
+        self.Entry_Gcode_Feed_Max = Entry(gen_settings,width="15")
+        self.Entry_Gcode_Feed_Max.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Gcode_Feed_Max.configure(textvariable=self.gcode_feed_max)
+        self.gcode_feed_max.trace_variable("w", self.Entry_Gcode_Feed_Max_Callback)
+        self.entry_set(self.Entry_Gcode_Feed_Max,self.Entry_Gcode_Feed_Max_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_USB_Skip_Check = Label(gen_settings,text="Skip USB Ready Check")
+        self.Label_USB_Skip_Check.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_USB_Skip_Check = Checkbutton(gen_settings,text="", anchor=W)
+        self.Checkbutton_USB_Skip_Check.place(x=xd_entry_L, y=D_Yloc, width=75, height=23)
+        self.Checkbutton_USB_Skip_Check.configure(variable=self.usb_skip_check)
+
         #D_Yloc=D_Yloc+D_dY
         #self.Label_Timeout = Label(gen_settings,text="USB Timeout")
         #self.Label_Timeout.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
@@ -4863,6 +5267,17 @@ class Application(Frame):
         self.ink_timeout.trace_variable("w", self.Entry_Ink_Timeout_Callback)
         self.entry_set(self.Entry_Ink_Timeout,self.Entry_Ink_Timeout_Check(),2)
 
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Ink_Cache = Label(gen_settings,text="Inkscape Cache Size")
+        self.Label_Ink_Cache.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Ink_Cache_u = Label(gen_settings,text="MB", anchor=W)
+        self.Label_Ink_Cache_u.place(x=xd_units_L, y=D_Yloc, width=w_units*2, height=21)
+        self.Entry_Ink_Cache = Entry(gen_settings,width="15")
+        self.Entry_Ink_Cache.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Ink_Cache.configure(textvariable=self.ink_cache_mb)
+        self.ink_cache_mb.trace_variable("w", self.Entry_Ink_Cache_Callback)
+        self.entry_set(self.Entry_Ink_Cache,self.Entry_Ink_Cache_Check(),2)
+
         D_Yloc=D_Yloc+D_dY*1.25
         self.gen_separator2 = Frame(gen_settings, height=2, bd=1, relief=SUNKEN)
         self.gen_separator2.place(x=xd_label_L, y=D_Yloc,width=gen_width-40, height=2)
@@ -4946,13 +5361,14 @@ class Application(Frame):
         self.GEN_Close.bind("<ButtonRelease-1>", self.Close_Current_Window_Click)
 
         self.Set_Input_States_BATCH()
+        self.Set_Input_States_STREAM()
 
     ################################################################################
     #                          Raster Settings Window                              #
     ################################################################################
     def RASTER_Settings_Window(self):
         Wset=425+280
-        Hset=330 #260
+        Hset=498 #260
         raster_settings = Toplevel(width=Wset, height=Hset)
         raster_settings.grab_set() # Use grab_set to prevent user input in the main window
         raster_settings.focus_set()
@@ -4994,6 +5410,55 @@ class Application(Frame):
         self.Checkbutton_EngraveUP.configure(variable=self.engraveUP)
         self.Label_EngraveUP.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
         self.Checkbutton_EngraveUP.place(x=w_label+22, y=D_Yloc, width=75, height=23)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Tiled_Raster = Label(raster_settings,text="Low Memory Raster")
+        self.Checkbutton_Tiled_Raster = Checkbutton(raster_settings,text=" ", anchor=W, command=self.Set_Input_States_RASTER)
+        self.Checkbutton_Tiled_Raster.configure(variable=self.tiled_raster)
+        self.Label_Tiled_Raster.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_Tiled_Raster.place(x=w_label+22, y=D_Yloc, width=75, height=23)
+        self.tiled_raster.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Island_Raster = Label(raster_settings,text="Raster Islands Separately")
+        self.Checkbutton_Island_Raster = Checkbutton(raster_settings,text=" ", anchor=W)
+        self.Checkbutton_Island_Raster.configure(variable=self.island_raster)
+        self.Label_Island_Raster.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_Island_Raster.place(x=w_label+22, y=D_Yloc, width=75, height=23)
+        self.island_raster.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_SVG_Ystep = Label(raster_settings,text="Render SVG at Scan Step")
+        self.Checkbutton_SVG_Ystep = Checkbutton(raster_settings,text=" ", anchor=W, command=self.Set_Input_States_RASTER)
+        self.Checkbutton_SVG_Ystep.configure(variable=self.svg_ystep)
+        self.Label_SVG_Ystep.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_SVG_Ystep.place(x=w_label+22, y=D_Yloc, width=75, height=23)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_SVG_Rerender = Label(raster_settings,text="Re-render on Step Change")
+        self.Checkbutton_SVG_Rerender = Checkbutton(raster_settings,text=" ", anchor=W)
+        self.Checkbutton_SVG_Rerender.configure(variable=self.svg_rerender)
+        self.Label_SVG_Rerender.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_SVG_Rerender.place(x=w_label+22, y=D_Yloc, width=75, height=23)
+        self.svg_rerender.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Raster_Procs = Label(raster_settings,text="Raster Processes", anchor=CENTER )
+        self.Label_Raster_Procs.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Entry_Raster_Procs = Entry(raster_settings,width="15")
+        self.Entry_Raster_Procs.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Raster_Procs.configure(textvariable=self.raster_procs)
+        self.raster_procs.trace_variable("w", self.Entry_Raster_Procs_Callback)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Tile_Mem   = Label(raster_settings,text="Raster Memory Limit", anchor=CENTER )
+        self.Label_Tile_Mem.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Tile_Mem_u = Label(raster_settings,text="MB", anchor=W)
+        self.Label_Tile_Mem_u.place(x=xd_units_L, y=D_Yloc, width=w_units, height=21)
+        self.Entry_Tile_Mem   = Entry(raster_settings,width="15")
+        self.Entry_Tile_Mem.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Tile_Mem.configure(textvariable=self.tile_mem)
+        self.tile_mem.trace_variable("w", self.Entry_Tile_Mem_Callback)
         
         D_Yloc=D_Yloc+D_dY
         self.Label_Halftone = Label(raster_settings,text="Halftone (Dither)")
@@ -5022,6 +5487,13 @@ class Application(Frame):
         self.Label_Halftone_u = Label(raster_settings,text="dpi", anchor=W)
         self.Label_Halftone_u.place(x=xd_units_L+30, y=D_Yloc, width=w_units, height=21)
 
+        D_Yloc=D_Yloc+D_dY 
+        self.Label_Halftone_Method      = Label(raster_settings,text="Halftone Method", anchor=CENTER )
+        self.Halftone_Method_OptionMenu = OptionMenu(raster_settings, self.ht_method, *Dither.METHODS)
+        self.Label_Halftone_Method.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Halftone_Method_OptionMenu.place(x=xd_entry_L, y=D_Yloc, width=w_entry+65, height=23)
+        self.ht_method.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
         ############
         D_Yloc=D_Yloc+D_dY+5
         self.Label_bezier_M1  = Label(raster_settings,
@@ -5731,59 +6203,63 @@ class pxpiDialog(tkSimpleDialog.Dialog):
 #                          Startup Application                                 #
 ################################################################################
     
-root = Tk()
-app = Application(root)
-app.master.title(title_text)
-app.master.iconname("K40")
-app.master.minsize(800,560)
-app.master.geometry("1400x850")
-try:
+if __name__ == "__main__":
+    # Needed for the raster worker processes in frozen (py2exe) builds
+    multiprocessing.freeze_support()
+
+    root = Tk()
+    app = Application(root)
+    app.master.title(title_text)
+    app.master.iconname("K40")
+    app.master.minsize(800,560)
+    app.master.geometry("1400x850")
     try:
-        import tkFont
-        default_font = tkFont.nametofont("TkDefaultFont")
-    except:
-        import tkinter.font
-        default_font = tkinter.font.nametofont("TkDefaultFont")
+        try:
+            import tkFont
+            default_font = tkFont.nametofont("TkDefaultFont")
+        except:
+            import tkinter.font
+            default_font = tkinter.font.nametofont("TkDefaultFont")
 
-    default_font.configure(size=9)
-    default_font.configure(family='arial')
-    #print(default_font.cget("size"))
-    #print(default_font.cget("family"))
-except:
-    debug_message("Font Set Failed.")
+        default_font.configure(size=9)
+        default_font.configure(family='arial')
+        #print(default_font.cget("size"))
+        #print(default_font.cget("family"))
+    except:
+        debug_message("Font Set Failed.")
 
-try:
     try:
-        app.master.iconbitmap(r'emblem')
+        try:
+            app.master.iconbitmap(r'emblem')
+        except:
+            app.master.iconbitmap(bitmap="@emblem64")
     except:
-        app.master.iconbitmap(bitmap="@emblem64")
-except:
-    pass
-
-if LOAD_MSG != "":
-    message_box("K40 Whisperer",LOAD_MSG)
-debug_message("Debuging is turned on.")
+        pass
 
+    if LOAD_MSG != "":
+        message_box("K40 Whisperer",LOAD_MSG)
+    debug_message("Debuging is turned on.")
 
-opts, args = None, None
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "hp",["help", "pi"])
-except:
-    print('Unable interpret command line options')
-    sys.exit()
 
-for option, value in opts:
-    if option in ('-h','--help'):
-        pass
-        print(' ')
-        print('Usage: python k40_whisperer.py [-h -p]')
-        print('-h    : print this help (also --help)')
-        print('-p    : Small screen option (for small raspberry pi display) (also --pi)')
+    opts, args = None, None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp",["help", "pi"])
+    except:
+        print('Unable interpret command line options')
         sys.exit()
-    elif option in ('-p','--pi'):
-        print("pi mode")
-        app.master.minsize(480,320)
-        app.master.geometry("480x320")
-
 
-root.mainloop()
+    for option, value in opts:
+        if option in ('-h','--help'):
+            pass
+            print(' ')
+            print('Usage: python k40_whisperer.py [-h -p]')
+            print('-h    : print this help (also --help)')
+            print('-p    : Small screen option (for small raspberry pi display) (also --pi)')
+            sys.exit()
+        elif option in ('-p','--pi'):
+            print("pi mode")
+            app.master.minsize(480,320)
+            app.master.geometry("480x320")
+
+
+    root.mainloop()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+    Thread that does all of the USB work with the laser
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import threading
+import traceback
+try:
+    import queue
+except:
+    import Queue as queue
+
+
+class TransportJob:
+    '''
+    A job for the transport thread: function(k40,progress,cancel) is
+    called with the K40_CLASS to use, a progress function that takes the
+    place of update_gui and the threading.Event that is set to cancel the
+    job (K40_CLASS takes it as stop_calc).  When the job is done the
+    return value is in result or the exception it raised in error, and
+    done is set.
+    '''
+    def __init__(self,function,k40):
+        self.function  = function
+        self.k40       = k40
+        self.cancel    = threading.Event()
+        self.done      = threading.Event()
+        self.result    = None
+        self.error     = None
+        self.traceback = ""
+
+
+class LaserTransport:
+    '''
+    Runs the jobs passed to submit() one after the other in a thread of
+    its own, so sending data to the laser does not wait for the GUI and
+    the GUI does not wait for the laser.  The GUI picks up the progress
+    messages with events(), e.g. from a function run by after().
+
+    cancel() stops the job that is running (K40_CLASS sends an e-stop
+    when it sees the cancel event) and the jobs waiting to run.
+    command() runs a function on the thread as soon as possible, also in
+    the middle of a job (e.g. to pause the laser).
+    '''
+    PROGRESS = "progress"
+    DONE     = "done"
+
+    def __init__(self):
+        self.jobs     = queue.Queue()
+        self.messages = queue.Queue()
+        self.commands = queue.Queue()
+        self.lock     = threading.Lock()
+        self.waiting  = []     # jobs submitted but not started
+        self.current  = None   # job that is running
+        self.last     = None   # last progress message
+        self.thread   = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self,function,k40):
+        job = TransportJob(function,k40)
+        with self.lock:
+            self.waiting.append(job)
+        self.jobs.put(job)
+        return job
+
+    def command(self,function):
+        with self.lock:
+            if self.current != None:
+                self.commands.put(function)
+                return None
+        return self.submit(lambda k40,progress,cancel: function(),None)
+
+    def cancel(self):
+        with self.lock:
+            jobs = self.waiting[:]
+            if self.current != None:
+                jobs.append(self.current)
+        for job in jobs:
+            job.cancel.set()
+
+    def e_stop(self,k40):
+        # stop everything and stop the laser, also when it is not busy
+        self.cancel()
+        return self.submit(lambda k40,progress,cancel: k40.e_stop(),k40)
+
+    def busy(self):
+        with self.lock:
+            return self.current != None or self.waiting != []
+
+    def run_commands(self):
+        while True:
+            try:
+                function = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                function()
+            except Exception as e:
+                self.messages.put((self.PROGRESS,"%s" %(e),'red'))
+
+    def progress(self,message=None,bgcolor='white'):
+        # takes the place of update_gui for the jobs
+        self.run_commands()
+        if message != None and (message,bgcolor) != self.last:
+            self.last = (message,bgcolor)
+            self.messages.put((self.PROGRESS,message,bgcolor))
+        return True
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.waiting.remove(job)
+                self.current = job
+            try:
+                if job.cancel.is_set():
+                    raise Exception("Action Stopped by User.")
+                job.result = job.function(job.k40,self.progress,job.cancel)
+            except Exception as e:
+                job.error = e
+                job.traceback = traceback.format_exc()
+            with self.lock:
+                self.current = None
+            self.run_commands()
+            job.done.set()
+            self.messages.put((self.DONE,job,None))
+
+    def events(self):
+        '''
+        Returns the events since the last call as a list of (PROGRESS,
+        message, bgcolor) and (DONE, job, None).
+        '''
+        events = []
+        while True:
+            try:
+                events.append(self.messages.get_nowait())
+            except queue.Empty:
+                return events
+
+
+if __name__ == '__main__':
+    # Jobs run in order on the transport thread, a cancel stops the job that
+    # is running with an e-stop and the jobs that are waiting
+    from time import time, sleep
+    from nano_library import K40_CLASS
+    from nano_emulator import EmulatedController
+    k40 = K40_CLASS()
+    k40.dev = EmulatedController()
+    data = bytearray(b"I")+bytearray(b"Babcde")*50000+bytearray(b"FNSE")
+    transport = LaserTransport()
+    send = lambda k40,progress,cancel: k40.send_data(data,progress,cancel)
+
+    t0 = time()
+    jobs = [transport.submit(send,k40) for i in range(2)]
+    messages = 0
+    while transport.busy():
+        messages = messages+len(transport.events())
+        sleep(0.05)
+    print("2 jobs: %.2fs  %d progress messages  errors: %s  data sent: %s" %(
+        time()-t0,messages,[job.error for job in jobs],k40.dev.data[:len(data)] == data))
+
+    k40.dev = EmulatedController()
+    jobs = [transport.submit(send,k40) for i in range(3)]
+    while k40.dev.transfers < 1000:
+        sleep(0.01)
+    transport.cancel()
+    for job in jobs:
+        job.done.wait()
+    estop = bytearray(k40.estop[2:32])
+    print("cancel: %s  e-stop sent: %s  %d of %d bytes sent" %(
+        [str(job.error) for job in jobs],k40.dev.data.endswith(estop),len(k40.dev.data)-len(estop),3*len(data)))
+
+    paused = []
+    job = transport.submit(send,k40)
+    while transport.current != job:
+        sleep(0.001)
+    transport.command(lambda: paused.append(transport.current == job))
+    job.done.wait()
+    print("command run during the job: %s" %(paused == [True]))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+    Emulated K40 controller for measuring the USB transfer of EGV data
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import random
+from egv import onewire_crc
+
+OK            = 206
+BUFFER_FULL   = 238
+CRC_ERROR     = 207
+TASK_COMPLETE = 236
+HELLO         = 160
+
+
+class EmulatedController:
+    '''
+    Stands in for the USB device (K40_CLASS.dev) with the same write()
+    and read() calls.  Nothing waits for real: every USB transfer moves a
+    clock forward by transfer_time seconds, and the laser takes packets
+    out of the controller's buffer at packet_rate packets per second of
+    that clock.  So clock is the time the transfer would take.
+
+    The controller works the way K40_CLASS expects it to:
+
+    - a packet with a bad CRC is dropped and the status is CRC_ERROR
+    - a packet that fits in the buffer is kept and the status is OK, or
+      BUFFER_FULL once buffer_size packets are waiting
+    - after BUFFER_FULL there is room for spare more packets, a packet
+      sent when that is used up is dropped (how much room a real
+      controller has left is not known)
+    - the status only tells about the last packet
+
+    crc_error_rate is the chance of a packet arriving with a bad CRC.  The
+    data of every packet that was kept is collected in data, so it can be
+    compared with what was sent.
+    '''
+    def __init__(self,transfer_time=0.001,packet_rate=2000.0,buffer_size=64,spare=16,crc_error_rate=0.0,seed=1):
+        self.transfer_time  = transfer_time
+        self.packet_rate    = packet_rate
+        self.buffer_size    = buffer_size
+        self.spare          = spare
+        self.crc_error_rate = crc_error_rate
+        self.random         = random.Random(seed)
+        self.clock     = 0.0
+        self.waiting   = 0.0   # packets in the buffer
+        self.status    = OK
+        self.data      = bytearray()
+        self.transfers = 0
+        self.crc_errors = 0
+        self.dropped   = 0
+
+    def run(self):
+        # time passes for one USB transfer
+        self.transfers = self.transfers+1
+        self.clock     = self.clock+self.transfer_time
+        self.waiting   = max(0.0,self.waiting-self.packet_rate*self.transfer_time)
+
+    def write(self,addr,line,timeout=None):
+        self.run()
+        line = bytearray(line)
+        if len(line) == 1 and line[0] == HELLO:
+            return len(line)
+        if self.random.random() < self.crc_error_rate:
+            self.crc_errors = self.crc_errors+1
+            self.status = CRC_ERROR
+        elif onewire_crc(line[1:-2]) != line[-1]:
+            self.status = CRC_ERROR
+        elif self.waiting >= self.buffer_size+self.spare:
+            self.dropped = self.dropped+1
+            self.status  = BUFFER_FULL
+        else:
+            self.data.extend(line[2:-2])
+            self.waiting = self.waiting+1
+            if self.waiting >= self.buffer_size:
+                self.status = BUFFER_FULL
+            else:
+                self.status = OK
+        return len(line)
+
+    def read(self,addr,length,timeout=None):
+        self.run()
+        status = self.status
+        if status == BUFFER_FULL and self.waiting < self.buffer_size:
+            status = OK
+        if status == OK and self.waiting == 0:
+            status = TASK_COMPLETE
+        return [255,status,111,8,19,0]
+
+    def reset(self):
+        pass
+
+
+if __name__ == '__main__':
+    # Send the same job with and without the status check before each
+    # packet, compare the time the transfer takes on the emulated
+    # controller and check that the controller got exactly the data sent
+    from nano_library import K40_CLASS
+    random.seed(5)
+    data = bytearray(b"I")+bytearray([random.choice(bytearray(b"BTLRabcdefgh")) for i in range(300000)])+bytearray(b"FNSE")
+    npackets = (len(data)+29)//30
+    sent = bytearray(data)+bytearray(b"F")*(30*npackets-len(data))
+
+    failed = []
+    def run(skip_ready_check,stream,**kwargs):
+        k40 = K40_CLASS()
+        k40.dev = EmulatedController(**kwargs)
+        k40.skip_ready_check = skip_ready_check
+        if stream:
+            k40.send_stream(iter([data[i:i+1000] for i in range(0,len(data),1000)]))
+        else:
+            k40.send_data(data)
+        dev = k40.dev
+        name = " ".join([["check","skip"][skip_ready_check],["data","stream"][stream]]+
+                        ["%s=%g" %(key,value) for key,value in sorted(kwargs.items())])
+        correct = dev.data == sent
+        print("%-56s %7.2fs  %5.2f transfers/packet  %3d CRC errors  %d dropped  data correct: %s" %(
+            name,dev.clock,float(dev.transfers)/npackets,dev.crc_errors,dev.dropped,correct))
+        if not correct:
+            failed.append(name)
+
+    for kwargs in ({},{"packet_rate":200.0},{"packet_rate":200.0,"spare":0},
+                   {"crc_error_rate":0.001},{"crc_error_rate":0.01,"packet_rate":200.0,"spare":0}):
+        for skip_ready_check in (False,True):
+            run(skip_ready_check,False,**kwargs)
+    run(True,True,crc_error_rate=0.01,packet_rate=200.0,spare=0)
+
+    # Stop a stream while the data is still being made.  The chunks have to
+    # be closed by the thread that reads them, when it gets the next one
+    import threading
+    from time import sleep
+    closed = threading.Event()
+    def slow_chunks():
+        try:
+            for i in range(0,len(data),1000):
+                sleep(0.05)
+                yield data[i:i+1000]
+        finally:
+            closed.set()
+    k40 = K40_CLASS()
+    k40.dev = EmulatedController()
+    stop = threading.Event()
+    threading.Timer(0.5,stop.set).start()
+    try:
+        k40.send_stream(slow_chunks(),stop_calc=stop)
+        error = "not stopped"
+    except Exception as e:
+        error = "%s" %(e)
+    chunks_closed = closed.wait(1.0)
+    print("%-56s %s  chunks closed: %s  e-stop sent: %s" %(
+        "stop stream",error,chunks_closed,k40.dev.data.endswith(bytearray(k40.estop[2:32]))))
+    if error != "Action Stopped by User." or not chunks_closed:
+        failed.append("stop stream")
+    if failed:
+        raise Exception("Emulated controller checks failed: %s" %(", ".join(failed)))
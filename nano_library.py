@@ -28,11 +28,75 @@ import sys
 import struct
 import os
 from shutil import copyfile
-from egv import egv
+from egv import egv, EgvJob, CRC_TABLE, onewire_crc
+from stream_queue import threaded_stream
 import traceback
 from windowsinhibitor import WindowsInhibitor
 from time import time
 
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY=False
+
+##############################################################################
+# A packet is 166, 0, 30 bytes of EGV data (padded with "F"), 166 and the
+# CRC of the 31 bytes after the first 166.
+PACKET_SIZE = 34
+PACKET_DATA = 30
+
+def packet_crcs(payload):
+    '''
+    Returns the CRC of each 30 byte packet of payload as a bytearray.  The
+    0 in front of the data does not change the CRC so only the data is
+    used.  With numpy one byte of every packet is done at a time.
+    '''
+    npackets = len(payload)//PACKET_DATA
+    if NUMPY:
+        data  = numpy.frombuffer(payload,dtype=numpy.uint8).reshape(npackets,PACKET_DATA)
+        table = numpy.array(CRC_TABLE,dtype=numpy.uint8)
+        crc   = numpy.zeros(npackets,dtype=numpy.uint8)
+        for j in range(PACKET_DATA):
+            crc = table[crc ^ data[:,j]]
+        return bytearray(crc.tobytes())
+    crcs = bytearray(npackets)
+    for k in range(npackets):
+        crc = 0
+        for inbyte in payload[k*PACKET_DATA:(k+1)*PACKET_DATA]:
+            crc = CRC_TABLE[crc ^ inbyte]
+        crcs[k] = crc
+    return crcs
+
+def packet_buffer(payload):
+    '''
+    Returns the packets for payload (a bytearray with a multiple of 30
+    bytes) in one bytearray of 34 bytes per packet.
+    '''
+    npackets = len(payload)//PACKET_DATA
+    packets  = bytearray(npackets*PACKET_SIZE)
+    marks    = bytearray([166])*npackets
+    packets[0::PACKET_SIZE]  = marks
+    packets[32::PACKET_SIZE] = marks
+    for j in range(PACKET_DATA):
+        packets[2+j::PACKET_SIZE] = payload[j::PACKET_DATA]
+    packets[33::PACKET_SIZE] = packet_crcs(payload)
+    return packets
+
+def make_packet_buffer(job):
+    '''
+    Returns all of the packets of an EgvJob in one bytearray.  The data is
+    copied once into a buffer of the final size and the last packet is
+    padded with "F".
+    '''
+    npackets = max(1,(len(job)+PACKET_DATA-1)//PACKET_DATA)
+    payload  = bytearray(b"F")*(npackets*PACKET_DATA)
+    pos = 0
+    for chunk in job.chunks():
+        payload[pos:pos+len(chunk)] = chunk
+        pos = pos+len(chunk)
+    return packet_buffer(payload)
+
 ##############################################################################
 
 class K40_CLASS:
@@ -56,6 +120,10 @@ class K40_CLASS:
         self.home    = [166,0,73,80,80,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,228]
         self.estop  =  [166,0,73,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,130]
         self.USB_Location = None
+        # Skip the status check before a packet when the status after the
+        # packet before it said there is room (see send_packet_w_error_checking)
+        self.skip_ready_check = False
+        self.ready            = False
 
 
     def say_hello(self):
@@ -136,16 +204,7 @@ class K40_CLASS:
     #  http://www.pjrc.com/teensy/td_libs_OneWire.html
     #######################################################################
     def OneWireCRC(self,line):
-        crc=0
-        for i in range(len(line)):
-            inbyte=line[i]
-            for j in range(8):
-                mix = (crc ^ inbyte) & 0x01
-                crc >>= 1
-                if (mix):
-                    crc ^= 0x8C
-                inbyte >>= 1
-        return crc
+        return onewire_crc(line)
     #######################################################################
     def none_function(self,dummy=None,bgcolor=None):
         #Don't delete this function (used in send_data)
@@ -161,78 +220,132 @@ class K40_CLASS:
         NoSleep = WindowsInhibitor()
         NoSleep.inhibit()
 
-        blank   = [166,0,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,0]
-        packets = []
-        packet  = blank[:]
-        cnt=2
-        len_data = len(data)
-        for j in range(passes):
-            if j == 0:
-                istart = 0
-            else:
-                istart = 1
-            if passes > 1:
-                if j == passes-1:
-                    data[-4]=ord("F")
-                else:
-                    data[-4]=ord("@")
-            timestamp=0   
-            for i in range(istart,len_data):
-                if cnt > 31:
-                    packet[-1] = self.OneWireCRC(packet[1:len(packet)-2])
-                    stamp=int(3*time()) #update every 1/3 of a second
-                    if not preprocess_crc:
-                        self.send_packet_w_error_checking(packet,update_gui,stop_calc)
-                        if (stamp != timestamp):
-                            timestamp=stamp #interlock
-                            update_gui("Sending Data to Laser = %.1f%%" %(100.0*float(i)/float(len_data)))
-                    else:
-                        packets.append(packet)
-                        if (stamp != timestamp):
-                            timestamp=stamp #interlock
-                            update_gui("Calculating CRC data and Generate Packets: %.1f%%" %(100.0*float(i)/float(len_data)))
-                    packet = blank[:]
-                    cnt = 2
-                    
-                    if stop_calc[0]==True:
-                        NoSleep.uninhibit()
-                        self.stop_sending_data()
-                        #raise Exception("Action Stopped by User.")
-                packet[cnt]=data[i]
-                cnt=cnt+1
-        packet[-1]=self.OneWireCRC(packet[1:len(packet)-2])
+        # data can be an EgvJob, a bytearray or a list of codes.  The passes
+        # are sent from the same data (see EgvJob.chunks) instead of copies.
+        if not hasattr(data,"chunks"):
+            if not isinstance(data,(bytes,bytearray)):
+                data = bytearray(data)
+            job = EgvJob(header=data[:1])
+            job.append(memoryview(data)[1:],passes)
+            data = job
+        npackets = max(1,(len(data)+PACKET_DATA-1)//PACKET_DATA)
+
         if not preprocess_crc:
-            self.send_packet_w_error_checking(packet,update_gui,stop_calc)
+            count   = [0,0] # packets sent, time stamp
+            def put(packet):
+                self.send_packet_w_error_checking(packet,update_gui,stop_calc)
+                count[0] = count[0]+1
+                stamp=int(3*time()) #update every 1/3 of a second
+                if (stamp != count[1]):
+                    count[1]=stamp #interlock
+                    update_gui("Sending Data to Laser = %.1f%%" %(100.0*count[0]/npackets))
+                if self.stopped(stop_calc):
+                    NoSleep.uninhibit()
+                    self.stop_sending_data()
+            self.make_packets(data.chunks(),put)
         else:
-            packets.append(packet)
+            # all of the packets are made at once in one buffer
+            packets = make_packet_buffer(data)
             update_gui("CRC data and Packets are Ready")
-        packet_cnt = 0
-
-        for line in packets:
-            update_gui()
-            self.send_packet_w_error_checking(line,update_gui,stop_calc)
-            packet_cnt = packet_cnt+1.0
-            update_gui( "Sending Data to Laser = %.1f%%" %( 100.0*packet_cnt/len(packets) ) )
+            for packet_cnt in range(npackets):
+                update_gui()
+                i = packet_cnt*PACKET_SIZE
+                self.send_packet_w_error_checking(bytes(packets[i:i+PACKET_SIZE]),update_gui,stop_calc)
+                update_gui( "Sending Data to Laser = %.1f%%" %( 100.0*(packet_cnt+1)/npackets ) )
         ##############################################################
         if wait_for_laser:
             self.wait_for_laser_to_finish(update_gui,stop_calc)
         NoSleep.uninhibit()
 
 
+    def make_packets(self,chunks,put):
+        # Split the data in chunks into packets with CRC.  The packets
+        # that are full after each chunk are made together (packet_buffer)
+        pending = bytearray()
+        npackets = 0
+        try:
+            for data in chunks:
+                pending.extend(data)
+                n = len(pending)-len(pending)%PACKET_DATA
+                if n == 0:
+                    continue
+                packets = packet_buffer(pending[:n])
+                del pending[:n]
+                for i in range(0,len(packets),PACKET_SIZE):
+                    put(bytes(packets[i:i+PACKET_SIZE]))
+                npackets = npackets+n//PACKET_DATA
+        finally:
+            # chunks is closed here, by the thread that reads it, also when
+            # put() raises StreamClosed because the sending stopped
+            if hasattr(chunks,"close"):
+                chunks.close()
+        if len(pending) > 0 or npackets == 0:
+            pending.extend(bytearray(b"F")*(PACKET_DATA-len(pending)))
+            put(bytes(packet_buffer(pending)))
+
+    def send_stream(self,chunks,update_gui=None,stop_calc=None,wait_for_laser=False,queue_size=256):
+        '''
+        Send data to the laser while it is still being made.  chunks is an
+        iterable of bytearrays, e.g. from threaded_stream() with the EGV
+        data written into an EgvSink.  The packets are made in a second
+        thread and passed through a bounded queue, so the first packet is
+        sent as soon as the first chunk is ready and only a few hundred
+        packets are kept in memory.
+        '''
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        if update_gui == None:
+            update_gui = self.none_function
+
+        def waiting():
+            update_gui("Sending Data to Laser: Waiting for Data")
+            if self.stopped(stop_calc):
+                self.stop_sending_data()
+
+        NoSleep = WindowsInhibitor()
+        NoSleep.inhibit()
+        packets = threaded_stream(lambda put: self.make_packets(chunks,put),queue_size,waiting)
+        try:
+            timestamp=0
+            packet_cnt=0
+            for packet in packets:
+                self.send_packet_w_error_checking(packet,update_gui,stop_calc)
+                packet_cnt=packet_cnt+1
+                stamp=int(3*time()) #update every 1/3 of a second
+                if (stamp != timestamp):
+                    timestamp=stamp #interlock
+                    update_gui("Sending Data to Laser: %d packets sent" %(packet_cnt))
+                if self.stopped(stop_calc):
+                    self.stop_sending_data()
+        finally:
+            packets.close()
+            NoSleep.uninhibit()
+        if wait_for_laser:
+            NoSleep.inhibit()
+            self.wait_for_laser_to_finish(update_gui,stop_calc)
+            NoSleep.uninhibit()
+
     def send_packet_w_error_checking(self,line,update_gui=None,stop_calc=None):
+        # The status after a packet only tells about that packet, so it is
+        # read after every packet.  The status check before a packet only
+        # waits for room in the buffer, with skip_ready_check it is left out
+        # when the status after the last packet was OK (room for at least
+        # one more packet).  After any other status it is done as usual.
         timeout_cnt = 1
         crc_cnt     = 1
         while True:
-            if stop_calc[0]:
+            if self.stopped(stop_calc):
                 self.stop_sending_data()
                 
-            response = self.say_hello()                    
-            if response == self.BUFFER_FULL:
-                while response == self.BUFFER_FULL:
-                    response = self.say_hello()
-                    update_gui()
-                    if stop_calc[0]:
-                        self.stop_sending_data()
+            if not (self.skip_ready_check and self.ready):
+                response = self.say_hello()
+                if response == self.BUFFER_FULL:
+                    while response == self.BUFFER_FULL:
+                        response = self.say_hello()
+                        update_gui()
+                        if self.stopped(stop_calc):
+                            self.stop_sending_data()
             try:
                 self.send_packet(line)
             except:
@@ -257,6 +370,7 @@ class K40_CLASS:
                 continue
             ######################################
             response = self.say_hello()
+            self.ready = response == self.OK or response == self.TASK_COMPLETE
 
             if response == self.CRC_ERROR:
                 crc_cnt=crc_cnt+1
@@ -294,15 +408,24 @@ class K40_CLASS:
             else: #assume: response == self.OK:
                 msg = "Waiting for the laser to finish."
                 update_gui(msg)
-            if stop_calc[0]:
+            if self.stopped(stop_calc):
                 self.stop_sending_data()
 
 
+    def stopped(self,stop_calc):
+        # stop_calc is a threading.Event (see laser_transport) or a list
+        # with the stop flag in the first item
+        if hasattr(stop_calc,"is_set"):
+            return stop_calc.is_set()
+        return stop_calc[0]
+
     def stop_sending_data(self):
         self.e_stop()
         raise Exception("Action Stopped by User.")
 
     def send_packet(self,line):
+        # the packet may use up the room the last status reported
+        self.ready = False
         self.dev.write(self.write_addr,line,self.timeout)
 
     def rapid_move(self,dxmils,dymils):
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+    Cached raster preprocessing pipeline
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from collections import OrderedDict
+
+
+class RasterPipeline:
+    '''
+    Runs the raster preprocessing steps (negate, mirror, rotate, scale,
+    halftone, ...) as a chain of stages and remembers the output of each
+    stage.  A stage is identified by its name, its parameters and the key
+    of the stage before it, so changing one setting only recomputes the
+    stages from that point on, and switching a setting back reuses the
+    results that are already stored.  Stored results are dropped least
+    recently used first when their total size exceeds max_bytes.
+    '''
+    def __init__(self,max_bytes=256*1024*1024):
+        self.max_bytes  = max_bytes
+        self.cache      = OrderedDict()
+        self.sizes      = {}
+        self.used_bytes = 0
+        self.source     = None
+        self.source_key = None
+        self.serial     = 0
+        self.hits       = 0
+        self.misses     = 0
+
+    def set_source(self,image):
+        self.clear()
+        self.serial = self.serial+1
+        self.source = image
+        self.source_key = ("source",self.serial)
+
+    def clear(self):
+        self.cache.clear()
+        self.sizes.clear()
+        self.used_bytes = 0
+
+    def run(self,stages):
+        '''
+        stages is a list of (name, params, function) tuples.  params must be
+        hashable and describe everything the function depends on besides its
+        input.  Stages with params set to None are skipped.  Returns the
+        output of the last stage.
+        '''
+        key = self.source_key
+        keyed_stages = []
+        for name,params,function in stages:
+            if params == None:
+                continue
+            key = (name,params,key)
+            keyed_stages.append((key,function))
+
+        # Start from the last stage that is already available
+        data  = self.source
+        start = 0
+        for i in range(len(keyed_stages)-1,-1,-1):
+            key = keyed_stages[i][0]
+            if key in self.cache:
+                data  = self.cache.pop(key)
+                self.cache[key] = data
+                start = i+1
+                self.hits = self.hits+1
+                break
+
+        for key,function in keyed_stages[start:]:
+            data = function(data)
+            self.misses = self.misses+1
+            self.store(key,data)
+        return data
+
+    def run_once(self,image,stages):
+        '''
+        Run the stages on image without using or changing the cache.
+        '''
+        data = image
+        for name,params,function in stages:
+            if params != None:
+                data = function(data)
+        return data
+
+    def store(self,key,data):
+        nbytes = self.nbytes(data)
+        if nbytes > self.max_bytes:
+            return
+        while self.used_bytes+nbytes > self.max_bytes and self.cache:
+            old_key,old_data = self.cache.popitem(last=False)
+            self.used_bytes = self.used_bytes-self.sizes.pop(old_key)
+        self.cache[key] = data
+        self.sizes[key] = nbytes
+        self.used_bytes = self.used_bytes+nbytes
+
+    def nbytes(self,data):
+        # Rough memory use of a stage result
+        if hasattr(data,"nbytes"):
+            return data.nbytes
+        if hasattr(data,"mode") and hasattr(data,"size"):
+            wim,him = data.size
+            if data.mode in ("1","L","P"):
+                return wim*him
+            return wim*him*4
+        if isinstance(data,tuple):
+            total = 0
+            for item in data:
+                total = total+self.nbytes(item)
+            return total
+        if isinstance(data,list):
+            # [x,y,loop] entries take about 150 bytes each
+            return len(data)*150
+        return 64
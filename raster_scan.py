@@ -0,0 +1,714 @@
+#!/usr/bin/env python
+"""
+    Raster scan line extraction
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from time import time
+from math import sqrt
+from itertools import permutations
+import hashlib
+import tempfile
+import multiprocessing
+from convex_hull import hull2D_accumulator
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY=False
+
+
+class RasterScan:
+    def __init__(self,cutoff=128):
+        self.cutoff = cutoff
+        self.bignumber = 9999999
+        self.ystep = 1
+
+    def none_function(self,dummy=None):
+        #Don't delete this function (used in make_scanlines)
+        pass
+
+    def make_scanlines(self,image,Raster_step,update_gui=None,stop_calc=None,processes=1,ystep=1):
+        '''
+        Convert a bilevel ("1" mode) image into raster engraving coordinates.
+        Every Raster_step'th row is scanned.  Returns the tuple
+        (ecoords, LENGTH, n_scanlines, hcoords).  The NumPy engine is used
+        when NumPy is available, otherwise the pixel by pixel loop is used.
+        With processes > 1 the rows are scanned in a pool of processes.
+        ystep is the spacing of the image rows in mils (1 for an image at
+        1000 dpi in both directions).
+        '''
+        self.ystep = ystep
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        if update_gui == None:
+            update_gui = self.none_function
+
+        wim,him = image.size
+        if NUMPY and wim > 1 and processes > 1:
+            return self.scan_parallel(image,Raster_step,update_gui,stop_calc,processes)
+        elif NUMPY and wim > 1:
+            return self.scan_numpy(image,Raster_step,update_gui,stop_calc)
+        else:
+            return self.scan_python(image,Raster_step,update_gui,stop_calc)
+
+    def scan_python(self,image,Raster_step,update_gui,stop_calc):
+        Reng_np = image.load()
+        wim,him = image.size
+        cutoff = self.cutoff
+        bignumber = self.bignumber
+        ecoords=[]
+        x=0
+        y=0
+        loop=1
+        LENGTH=0
+        n_scanlines = 0
+        my_hull = hull2D_accumulator()
+        timestamp=0
+        for i in range(0,him,Raster_step):
+            stamp=int(3*time()) #update every 1/3 of a second
+            if (stamp != timestamp):
+                timestamp=stamp #interlock
+                update_gui("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
+            if stop_calc[0]==True:
+                raise Exception("Action stopped by User.")
+            line = []
+            cnt=1
+            LEFT  = bignumber;
+            RIGHT =-bignumber;
+            for j in range(1,wim):
+                if (Reng_np[j,i] == Reng_np[j-1,i]):
+                    cnt = cnt+1
+                else:
+                    if Reng_np[j-1,i]:
+                        laser = "U"
+                    else:
+                        laser = "D"
+                        LEFT  = min(j-cnt,LEFT)
+                        RIGHT = max(j,RIGHT)
+
+                    line.append((cnt,laser))
+                    cnt=1
+            if Reng_np[j-1,i] > cutoff:
+                laser = "U"
+            else:
+                laser = "D"
+                LEFT  = min(j-cnt,LEFT)
+                RIGHT = max(j,RIGHT)
+
+            line.append((cnt,laser))
+            if LEFT != bignumber and RIGHT != -bignumber:
+                LENGTH = LENGTH + (RIGHT - LEFT)/1000.0
+                n_scanlines = n_scanlines + 1
+
+            y=(him-i)*self.ystep/1000.0
+            x=0
+            if LEFT != bignumber:
+                my_hull.add_point(LEFT/1000.0,y)
+            if RIGHT != -bignumber:
+                my_hull.add_point(RIGHT/1000.0,y)
+
+            for seg in line:
+                delta = seg[0]/1000.0
+                if seg[1]=="D":
+                    loop=loop+1
+                    ecoords.append([x      ,y,loop])
+                    ecoords.append([x+delta,y,loop])
+                x = x + delta
+        return ecoords,LENGTH,n_scanlines,my_hull.ecoords()
+
+    def row_runs(self,dark_row):
+        '''
+        Split one row of the thresholded image (True = engrave) into runs.
+        Returns (starts, ends, dark) arrays with one entry per run.  The
+        value of the last run is taken from the next to last pixel to
+        match the behavior of the pixel by pixel loop.
+        '''
+        wim = len(dark_row)
+        edges  = numpy.flatnonzero(dark_row[1:] != dark_row[:-1]) + 1
+        starts = numpy.concatenate(([0],edges))
+        ends   = numpy.concatenate((edges,[wim]))
+        dark   = dark_row[starts]
+        dark[-1] = dark_row[wim-2]
+        return starts,ends,dark
+
+    def row_scan(self,dark_row):
+        '''
+        Find the dark runs of one row.  Returns None if there are none,
+        otherwise (LEFT, RIGHT, xbeg, xend): the extent of the row in
+        pixels and arrays with the start and end of each dark run in inches.
+        '''
+        wim = len(dark_row)
+        starts,ends,dark = self.row_runs(dark_row)
+        idark = numpy.flatnonzero(dark)
+        if len(idark) == 0:
+            return None
+
+        # The loop reports the last run one pixel to the left
+        lefts  = starts[idark]
+        rights = ends[idark]
+        if dark[-1]:
+            lefts[-1]  = starts[-1]-1
+            rights[-1] = wim-1
+        LEFT  = int(lefts.min())
+        RIGHT = int(rights.max())
+
+        # cumsum adds the run widths in order, exactly like "x = x + delta"
+        delta = (ends-starts)/1000.0
+        xend  = numpy.cumsum(delta)
+        xbeg  = numpy.empty_like(xend)
+        xbeg[0]  = 0.0
+        xbeg[1:] = xend[:-1]
+        return LEFT,RIGHT,xbeg[idark],xend[idark]
+
+    def scan_numpy(self,image,Raster_step,update_gui,stop_calc):
+        wim,him = image.size
+        image_np = numpy.asarray(image)
+        rows = range(0,him,Raster_step)
+        row_scans = (self.row_scan(image_np[i]==0) for i in rows)
+        return self.collect_rows(him,rows,row_scans,update_gui,stop_calc)
+
+    def scan_parallel(self,image,Raster_step,update_gui,stop_calc,processes):
+        wim,him = image.size
+        image_np = numpy.asarray(image)
+        rows = range(0,him,Raster_step)
+        size = max(1,(len(rows)+processes*4-1)//(processes*4))
+        chunks = (image_np[rows[i:i+size]]==0 for i in range(0,len(rows),size))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap(scan_rows,chunks)
+            row_scans = (row for chunk in results for row in chunk)
+            return self.collect_rows(him,rows,row_scans,update_gui,stop_calc)
+        finally:
+            pool.terminate()
+
+    def collect_rows(self,him,rows,row_scans,update_gui,stop_calc):
+        '''
+        Build the raster data from the row_scan() results of the scanned rows
+        '''
+        row_y   = []
+        row_ptr = [0]
+        x1_rows = []
+        x2_rows = []
+        LENGTH=0
+        n_scanlines = 0
+        my_hull = hull2D_accumulator()
+        timestamp=0
+        for i,row in zip(rows,row_scans):
+            stamp=int(3*time()) #update every 1/3 of a second
+            if (stamp != timestamp):
+                timestamp=stamp #interlock
+                update_gui("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
+            if stop_calc[0]==True:
+                raise Exception("Action stopped by User.")
+
+            if row == None:
+                continue
+            LEFT,RIGHT,xbeg,xend = row
+            y=(him-i)*self.ystep/1000.0
+            LENGTH = LENGTH + (RIGHT - LEFT)/1000.0
+            n_scanlines = n_scanlines + 1
+
+            my_hull.add_row(LEFT/1000.0,RIGHT/1000.0,y)
+
+            row_y.append(y)
+            row_ptr.append(row_ptr[-1]+len(xbeg))
+            x1_rows.append(xbeg)
+            x2_rows.append(xend)
+
+        if n_scanlines == 0:
+            return [],LENGTH,n_scanlines,my_hull.ecoords()
+        ecoords = RasterRuns(numpy.array(row_y),
+                             numpy.array(row_ptr),
+                             numpy.concatenate(x1_rows),
+                             numpy.concatenate(x2_rows))
+        return ecoords,LENGTH,n_scanlines,my_hull.ecoords()
+
+
+def scan_rows(dark_rows):
+    '''
+    row_scan() for a chunk of rows (used by RasterScan.scan_parallel)
+    '''
+    scan = RasterScan()
+    return [scan.row_scan(dark_row) for dark_row in dark_rows]
+
+
+class RasterRuns:
+    '''
+    Raster engraving coordinates stored as arrays instead of a list of
+    [x,y,loop] points.  Scan line k is at height row_y[k] and holds the
+    dark runs x1[i] to x2[i] for row_ptr[k] <= i < row_ptr[k+1].  Run i
+    has the loop number first_loop+i.  Iterating gives the same [x,y,loop]
+    points as the ecoords list.
+    '''
+    def __init__(self,row_y,row_ptr,x1,x2,first_loop=2):
+        self.row_y   = row_y
+        self.row_ptr = row_ptr
+        self.x1      = x1
+        self.x2      = x2
+        self.first_loop  = first_loop
+        self.n_scanlines = len(row_y)
+
+    @property
+    def nbytes(self):
+        return self.row_y.nbytes+self.row_ptr.nbytes+self.x1.nbytes+self.x2.nbytes
+
+    def scanline(self,k,reverse_x=False):
+        a = int(self.row_ptr[k])
+        b = int(self.row_ptr[k+1])
+        y = float(self.row_y[k])
+        points=[]
+        loop = self.first_loop+a
+        for x1,x2 in zip(self.x1[a:b].tolist(),self.x2[a:b].tolist()):
+            points.append([x1,y,loop])
+            points.append([x2,y,loop])
+            loop=loop+1
+        if reverse_x:
+            points.reverse()
+        return points
+
+    def scanlines(self,bottom_up=False,reverse_x=False):
+        '''
+        Generate the scan lines (lists of [x,y,loop] points) from the top
+        row down or from the bottom row up.  reverse_x reverses the order
+        of the points within each scan line.
+        '''
+        if bottom_up:
+            rows = range(self.n_scanlines-1,-1,-1)
+        else:
+            rows = range(self.n_scanlines)
+        for k in rows:
+            yield self.scanline(k,reverse_x)
+
+    def segments(self):
+        '''
+        Generate (x1, x2, y) for every dark run, top row first.
+        '''
+        for k in range(self.n_scanlines):
+            a = int(self.row_ptr[k])
+            b = int(self.row_ptr[k+1])
+            y = float(self.row_y[k])
+            for x1,x2 in zip(self.x1[a:b].tolist(),self.x2[a:b].tolist()):
+                yield x1,x2,y
+
+    def path_lengths(self):
+        '''
+        Returns (on, move, bounds) the same way ECoord.computeEcoordsLen
+        works them out from the list of points (which skips the first run).
+        '''
+        y  = numpy.repeat(self.row_y,numpy.diff(self.row_ptr))
+        on = float(numpy.sum(numpy.abs(self.x2[1:]-self.x1[1:])))
+        dx = self.x1[1:]-self.x2[:-1]
+        dy = y[1:]-y[:-1]
+        move = float(numpy.sum(numpy.sqrt(dx*dx+dy*dy)))
+        x  = numpy.concatenate((self.x1[1:],self.x2))
+        bounds = (float(x.min()),float(x.max()),float(y.min()),float(y.max()))
+        return on,move,bounds
+
+    def cache_key(self):
+        # hash of the runs (used by EgvCache)
+        digest = hashlib.sha1()
+        for values in (self.row_y,self.row_ptr,self.x1,self.x2):
+            digest.update(numpy.ascontiguousarray(values).view(numpy.uint8))
+        digest.update(("%d" %(self.first_loop)).encode('utf-8'))
+        return digest.digest()
+
+    def __len__(self):
+        return 2*len(self.x1)
+
+    def __iter__(self):
+        for points in self.scanlines():
+            for point in points:
+                yield point
+
+
+class TiledRaster:
+    '''
+    Raster engraving data for images that are too large to keep as a list
+    of ecoords.  The thresholded image is stored one bit per pixel in a
+    memory mapped temporary file and the scan lines are generated band by
+    band whenever they are needed (EGV generation, preview), so only one
+    band of rows is ever held in memory.
+
+    get_band(y0,y1) must return rows y0 to y1 of the bilevel ("1" mode)
+    image.  The band height is chosen to keep the working memory below
+    mem_budget bytes.  ystep is the spacing of the image rows in mils.
+    The object can be iterated like a list of ecoords.
+    '''
+    def __init__(self,size,Raster_step,get_band,mem_budget=64*1024*1024,update_gui=None,stop_calc=None,ystep=1):
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        scan = RasterScan()
+        if update_gui == None:
+            update_gui = scan.none_function
+
+        wim,him = size
+        self.wim = wim
+        self.him = him
+        self.Raster_step = Raster_step
+        self.ystep = ystep
+        # band image, thresholded copy and unpacked bits are about
+        # 10 bytes per pixel while a band is processed
+        row_bytes = 10*wim
+        self.band_rows = max(1,int(mem_budget/row_bytes))
+        self.packed = numpy.memmap(tempfile.TemporaryFile(), dtype=numpy.uint8,
+                                   mode='w+', shape=(him,(wim+7)//8))
+
+        # loop number before the first run of each scanned row
+        self.row_loop = numpy.zeros(len(range(0,him,Raster_step)),numpy.int64)
+        loop=1
+        LENGTH=0
+        n_scanlines = 0
+        my_hull = hull2D_accumulator()
+        timestamp=0
+        for y0,y1 in self.bands():
+            dark = numpy.asarray(get_band(y0,y1))==0
+            self.packed[y0:y1] = numpy.packbits(dark,axis=1)
+            for i in self.band_scan_rows(y0,y1):
+                stamp=int(3*time()) #update every 1/3 of a second
+                if (stamp != timestamp):
+                    timestamp=stamp #interlock
+                    update_gui("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
+                if stop_calc[0]==True:
+                    raise Exception("Action stopped by User.")
+                self.row_loop[i//Raster_step] = loop
+                row = scan.row_scan(dark[i-y0])
+                if row == None:
+                    continue
+                LEFT,RIGHT,xbeg,xend = row
+                y=(him-i)*ystep/1000.0
+                LENGTH = LENGTH + (RIGHT - LEFT)/1000.0
+                n_scanlines = n_scanlines + 1
+                my_hull.add_row(LEFT/1000.0,RIGHT/1000.0,y)
+                loop = loop+len(xbeg)
+            del dark
+        self.packed.flush()
+        self.digest = None
+        self.LENGTH = LENGTH
+        self.n_scanlines = n_scanlines
+        self.hull_coords = my_hull.ecoords()
+
+    @staticmethod
+    def available():
+        return NUMPY
+
+    def bands(self):
+        for y0 in range(0,self.him,self.band_rows):
+            yield y0,min(self.him,y0+self.band_rows)
+
+    def band_scan_rows(self,y0,y1):
+        step = self.Raster_step
+        i0 = ((y0+step-1)//step)*step
+        return range(i0,y1,step)
+
+    def scanlines(self,bottom_up=False,reverse_x=False):
+        '''
+        Generate the scan lines (lists of [x,y,loop] points) that contain
+        dark runs, from the top row down or from the bottom row up.
+        reverse_x reverses the order of the points within each scan line.
+        '''
+        scan = RasterScan()
+        bands = list(self.bands())
+        if bottom_up:
+            bands.reverse()
+        for y0,y1 in bands:
+            dark = numpy.unpackbits(self.packed[y0:y1],axis=1)[:,:self.wim] != 0
+            rows = list(self.band_scan_rows(y0,y1))
+            if bottom_up:
+                rows.reverse()
+            for i in rows:
+                row = scan.row_scan(dark[i-y0])
+                if row == None:
+                    continue
+                LEFT,RIGHT,xbeg,xend = row
+                y=(self.him-i)*self.ystep/1000.0
+                loop = int(self.row_loop[i//self.Raster_step])
+                points=[]
+                for x1,x2 in zip(xbeg.tolist(),xend.tolist()):
+                    loop=loop+1
+                    points.append([x1,y,loop])
+                    points.append([x2,y,loop])
+                if reverse_x:
+                    points.reverse()
+                yield points
+
+    def cache_key(self):
+        # hash of the image bits (used by EgvCache), made once
+        if self.digest == None:
+            digest = hashlib.sha1()
+            for y0,y1 in self.bands():
+                digest.update(numpy.ascontiguousarray(self.packed[y0:y1]))
+            digest.update(numpy.ascontiguousarray(self.row_loop).view(numpy.uint8))
+            digest.update(("%d %d %d %s" %(self.wim,self.him,self.Raster_step,self.ystep)).encode('utf-8'))
+            self.digest = digest.digest()
+        return self.digest
+
+    def segments(self):
+        for points in self.scanlines():
+            for i in range(0,len(points),2):
+                yield points[i][0],points[i+1][0],points[i][1]
+
+    def path_lengths(self):
+        '''
+        Returns (on, move, bounds) the same way ECoord.computeEcoordsLen
+        works them out from the list of points (which skips the first run),
+        one band at a time.
+        '''
+        on   = 0.0
+        move = 0.0
+        last = None
+        for x1,x2,y in self.segments():
+            if last == None:
+                xmin,xmax,ymin,ymax = x2,x2,y,y
+            else:
+                on   = on + abs(x2-x1)
+                move = move + sqrt((x1-last[0])**2 + (y-last[1])**2)
+                xmin = min(xmin,x1,x2)
+                xmax = max(xmax,x1,x2)
+                ymin = min(ymin,y)
+                ymax = max(ymax,y)
+            last = (x2,y)
+        if last == None:
+            return 0,0,(0,0,0,0)
+        return on,move,(float(xmin),float(xmax),float(ymin),float(ymax))
+
+    def __iter__(self):
+        for points in self.scanlines():
+            for point in points:
+                yield point
+
+
+class RasterIslands:
+    '''
+    Raster runs split into islands so that each island is engraved as a
+    separate raster block with a rapid move to the next one, instead of
+    sweeping the head across the empty space between them on every row.
+
+    The runs are marked on a grid of gap x gap (inch) cells and runs in
+    touching cells belong to the same island.  blocks holds one RasterRuns
+    per island in the order they will be engraved (see order_blocks).
+    Iterating, segments() and path_lengths() use all of the runs so the
+    preview does not change.
+    '''
+    def __init__(self,runs,LENGTH,gap=0.25):
+        self.runs = runs
+        self.gap  = gap
+        self.full_len = LENGTH
+        self.full_n_scanlines = runs.n_scanlines
+        self.run_row = numpy.repeat(numpy.arange(runs.n_scanlines),numpy.diff(runs.row_ptr))
+
+        labels = self.label_runs()
+        order  = numpy.argsort(labels,kind="mergesort")
+        bounds = numpy.flatnonzero(numpy.diff(labels[order]))+1
+        self.blocks = []
+        for idx in numpy.split(order,bounds):
+            self.blocks.append(self.make_block(idx))
+
+        # Reduce the engraving length by the sweep that is no longer needed
+        swept = 0.0
+        self.n_scanlines = 0
+        for block in self.blocks:
+            swept = swept+self.swept_length(block)
+            self.n_scanlines = self.n_scanlines+block.n_scanlines
+        self.swept_saved = self.swept_length(runs)-swept
+        self.LENGTH = LENGTH-self.swept_saved
+        self.travel = 0.0
+        self.full_travel = 0.0
+
+    def label_runs(self):
+        runs = self.runs
+        gap  = self.gap
+        y  = runs.row_y[self.run_row]
+        gy  = numpy.floor((runs.row_y.max()-y)/gap).astype(numpy.int64)
+        gx0 = numpy.floor(runs.x1/gap).astype(numpy.int64)
+        gx1 = numpy.floor(runs.x2/gap).astype(numpy.int64)
+        ny = int(gy.max())+1
+        nx = int(gx1.max())+1
+        # mark every cell covered by a run
+        cover = numpy.zeros((ny,nx+1),numpy.int64)
+        numpy.add.at(cover,(gy,gx0), 1)
+        numpy.add.at(cover,(gy,gx1+1),-1)
+        occupied = numpy.cumsum(cover,axis=1)[:,:nx] > 0
+
+        # flood fill the occupied cells (8 connected)
+        grid = numpy.zeros((ny,nx),numpy.int64)
+        occupied_list = occupied.tolist()
+        cells = grid.tolist()
+        label = 0
+        for j0 in range(ny):
+            for i0 in range(nx):
+                if not occupied_list[j0][i0] or cells[j0][i0]:
+                    continue
+                label = label+1
+                cells[j0][i0] = label
+                stack = [(j0,i0)]
+                while stack:
+                    j,i = stack.pop()
+                    for jn in range(max(0,j-1),min(ny,j+2)):
+                        for im in range(max(0,i-1),min(nx,i+2)):
+                            if occupied_list[jn][im] and not cells[jn][im]:
+                                cells[jn][im] = label
+                                stack.append((jn,im))
+        grid = numpy.array(cells)
+        return grid[gy,gx0]
+
+    def make_block(self,idx):
+        runs = self.runs
+        rows = self.run_row[idx]
+        starts  = numpy.flatnonzero(numpy.diff(rows))+1
+        row_ptr = numpy.concatenate(([0],starts,[len(idx)]))
+        row_y   = runs.row_y[rows[row_ptr[:-1]]]
+        return RasterRuns(row_y,row_ptr,runs.x1[idx],runs.x2[idx],first_loop=runs.first_loop)
+
+    def swept_length(self,block):
+        a = block.row_ptr[:-1]
+        b = block.row_ptr[1:]-1
+        return float(numpy.sum(block.x2[b]-block.x1[a]))
+
+    def end_points(self,block,bottom_up,FlipXoffset):
+        '''
+        Where the head starts and finishes engraving the block in the (x,y)
+        coordinates used by make_egv_data.  Every scan line is engraved in
+        the opposite direction of the one before it, starting to the right.
+        '''
+        first = 0
+        last  = block.n_scanlines-1
+        if bottom_up:
+            first,last = last,first
+        ends = []
+        for k in (first,last):
+            xa = float(block.x1[block.row_ptr[k]])
+            xb = float(block.x2[block.row_ptr[k+1]-1])
+            if FlipXoffset > 0:
+                xa,xb = FlipXoffset-xb,FlipXoffset-xa
+            ends.append([xa,xb,float(block.row_y[k])])
+        start = (ends[0][0],ends[0][2])
+        if block.n_scanlines%2:
+            finish = (ends[1][1],ends[1][2])
+        else:
+            finish = (ends[1][0],ends[1][2])
+        return start,finish
+
+    def order_blocks(self,startX,startY,bottom_up,FlipXoffset=0):
+        '''
+        Put the blocks in the order that needs the least travel from the
+        start point through every block and back.  All orders are tried for
+        up to 7 blocks, otherwise the nearest block is picked each time.
+        '''
+        def dist(p0,p1):
+            return sqrt((p1[0]-p0[0])**2+(p1[1]-p0[1])**2)
+        home = (startX,startY)
+        ends = [self.end_points(block,bottom_up,FlipXoffset) for block in self.blocks]
+
+        def travel(order):
+            total = 0.0
+            pos = home
+            for i in order:
+                total = total+dist(pos,ends[i][0])
+                pos   = ends[i][1]
+            return total+dist(pos,home)
+
+        n = len(self.blocks)
+        if n <= 7:
+            best = min(permutations(range(n)),key=travel)
+        else:
+            best = []
+            left = list(range(n))
+            pos  = home
+            while left:
+                i = min(left,key=lambda i: dist(pos,ends[i][0]))
+                left.remove(i)
+                best.append(i)
+                pos = ends[i][1]
+        self.blocks = [self.blocks[i] for i in best]
+        self.travel = travel(best)
+        full_start,full_finish = self.end_points(self.runs,bottom_up,FlipXoffset)
+        self.full_travel = dist(home,full_start)+dist(full_finish,home)
+
+    def worthwhile(self):
+        # the sweep saved has to cover the extra travel between the blocks
+        return len(self.blocks) > 1 and self.swept_saved > self.travel-self.full_travel
+
+    @property
+    def nbytes(self):
+        return 2*self.runs.nbytes
+
+    def cache_key(self):
+        # the blocks in the order they are engraved
+        return b"".join([block.cache_key() for block in self.blocks])
+
+    def segments(self):
+        return self.runs.segments()
+
+    def path_lengths(self):
+        return self.runs.path_lengths()
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __iter__(self):
+        return iter(self.runs)
+
+
+if __name__ == '__main__':
+    # Benchmark the NumPy engine against the pixel by pixel loop
+    from PIL import Image, ImageDraw
+    import sys
+    size = 2000
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    im = Image.new("L", (size,size), 255)
+    draw = ImageDraw.Draw(im)
+    for k in range(0,size,size//20):
+        draw.ellipse((k,k//2,k+size//8,k//2+size//5),fill=0)
+        draw.rectangle((size-k-size//10,k,size-k,k+size//40),fill=0)
+    im = im.point(lambda x: 0 if x<128 else 255, '1')
+
+    scan = RasterScan()
+    for step in (1,3):
+        t0 = time()
+        ref = scan.scan_python(im,step,scan.none_function,[0])
+        t1 = time()
+        new = scan.scan_numpy(im,step,scan.none_function,[0])
+        t2 = time()
+        same = list(new[0])==ref[0] and new[1:]==ref[1:]
+        print("%dx%d step=%d  loop: %.2fs  numpy: %.2fs  identical: %s" \
+              %(size,size,step,t1-t0,t2-t1,same))
+
+        # Tiled version with bands of about a tenth of the image
+        tiled = TiledRaster(im.size,step,lambda y0,y1: im.crop((0,y0,size,y1)),
+                            mem_budget=size*10*(size//10))
+        t3 = time()
+        same = list(tiled)==ref[0] and (tiled.LENGTH,tiled.n_scanlines,tiled.hull_coords)==ref[1:]
+        print("%dx%d step=%d  tiled: %.2fs  identical: %s" %(size,size,step,t3-t2,same))
+
+    # Scaling of the process pool for scan lines and EGV data
+    from egv import egv
+    for processes in (1,2,4,8):
+        t0 = time()
+        new = scan.make_scanlines(im,1,processes=processes)
+        t1 = time()
+        data = bytearray()
+        egv(target=data.append).make_egv_data(new[0],Feed=100,Raster_step=1,processes=processes)
+        t2 = time()
+        if processes == 1:
+            ref_scan = new
+            ref_data = data
+        same = list(new[0])==list(ref_scan[0]) and new[1:]==ref_scan[1:] and data==ref_data
+        print("processes=%d  scan lines: %.2fs  EGV: %.2fs  identical: %s" %(processes,t1-t0,t2-t1,same))
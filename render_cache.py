@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+    Disk cache for files made by Inkscape (and other data that takes long
+    to make, see egv_cache.py)
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import shutil
+import hashlib
+
+
+class RenderCache:
+    '''
+    Keeps the output files of external programs (the PNG exported by
+    Inkscape, the SVG with text converted to paths) in a directory on disk.
+    A file is stored under a hash of everything that went into making it:
+    the SVG data, the Inkscape version and the command line options.  So
+    opening or reloading an unchanged design does not need to run Inkscape
+    again, and any change to the design or the settings is a new entry.
+
+    Files are removed least recently used first when the total size of the
+    cache is more than max_bytes.  A max_bytes of 0 turns the cache off.
+    '''
+    def __init__(self,cache_dir,max_bytes=200*1024*1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def make_key(self,*parts):
+        digest = hashlib.sha1()
+        for part in parts:
+            if not isinstance(part,bytes):
+                part = ("%s" %(part)).encode('utf-8')
+            # the length keeps ("ab","c") and ("a","bc") apart
+            digest.update(("%d:" %(len(part))).encode('utf-8'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.cache_dir,key)
+
+    def fetch(self,key):
+        '''
+        Returns the path of the cached file or None if it is not cached
+        '''
+        if not self.enabled():
+            return None
+        cache_file = self.path(key)
+        if os.path.isfile(cache_file):
+            try:
+                # the modification time is the last time the file was used
+                os.utime(cache_file,None)
+            except:
+                pass
+            self.hits = self.hits+1
+            return cache_file
+        self.misses = self.misses+1
+        return None
+
+    def store(self,key,filename):
+        '''
+        Copy filename into the cache.  Failing to write the cache is not an
+        error, the file is simply made again next time.
+        '''
+        if not self.enabled():
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cache_file = self.path(key)
+            temp_file  = cache_file+".tmp"
+            shutil.copyfile(filename,temp_file)
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            os.rename(temp_file,cache_file)
+            self.evict()
+        except:
+            pass
+
+    def fetch_data(self,key):
+        '''
+        Returns the cached data as a bytearray or None if it is not cached
+        '''
+        cache_file = self.fetch(key)
+        if cache_file == None:
+            return None
+        try:
+            fp = open(cache_file,"rb")
+            data = bytearray(fp.read())
+            fp.close()
+            return data
+        except:
+            return None
+
+    def store_data(self,key,data):
+        '''
+        Store data (bytes or bytearray) in the cache
+        '''
+        if not self.enabled():
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cache_file = self.path(key)
+            temp_file  = cache_file+".tmp"
+            fp = open(temp_file,"wb")
+            fp.write(data)
+            fp.close()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            os.rename(temp_file,cache_file)
+            self.evict()
+        except:
+            pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            cache_file = os.path.join(self.cache_dir,name)
+            try:
+                stat = os.stat(cache_file)
+            except:
+                continue
+            entries.append((stat.st_mtime,stat.st_size,cache_file))
+            total = total+stat.st_size
+        entries.sort()
+        for mtime,size,cache_file in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(cache_file)
+                total = total-size
+            except:
+                pass
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir,ignore_errors=True)
+
+    def stats(self):
+        return "%d hits, %d misses" %(self.hits,self.misses)
+
+
+if __name__ == '__main__':
+    # Store, fetch and evict in a temporary directory
+    import tempfile
+    from time import sleep
+    tmp_dir = tempfile.mkdtemp()
+    cache = RenderCache(os.path.join(tmp_dir,"cache"),max_bytes=2500)
+    keys = []
+    for i in range(3):
+        src = os.path.join(tmp_dir,"file%d" %(i))
+        fp = open(src,"wb")
+        fp.write(b"x"*1000)
+        fp.close()
+        key = cache.make_key(b"<svg/>",1000,"option%d" %(i))
+        if cache.fetch(key) == None:
+            cache.store(key,src)
+        keys.append(key)
+        sleep(0.05)
+    print("cached: %s" %([cache.fetch(key) != None for key in keys]))
+    print("%s" %(cache.stats()))
+    shutil.rmtree(tmp_dir)
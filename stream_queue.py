@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+    Bounded queue between a producer thread and a consumer
+
+    Copyright (C) <2020>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import threading
+try:
+    import queue
+except:
+    import Queue as queue
+
+
+class StreamClosed(Exception):
+    pass
+
+
+def threaded_stream(produce,maxsize=16,wait=None,wait_time=0.1):
+    '''
+    Run produce(put) in a background thread and return a generator over
+    the items it passes to put(), in order.  put() blocks while maxsize
+    items are waiting, so the producer never gets far ahead of the
+    consumer and memory use stays bounded.
+
+    An exception raised by produce is raised again in the consumer.  When
+    the consumer stops early (close() or garbage collection of the
+    generator) the next put() raises StreamClosed so the producer ends.
+    wait() is called every wait_time seconds while the consumer is waiting
+    for the producer, e.g. to keep the GUI responsive.
+    '''
+    items  = queue.Queue(maxsize)
+    closed = [False]
+    DATA,DONE,ERROR = 0,1,2
+
+    def put_item(kind,item):
+        while True:
+            if closed[0]:
+                raise StreamClosed()
+            try:
+                items.put((kind,item),True,wait_time)
+                return
+            except queue.Full:
+                pass
+
+    def run():
+        try:
+            produce(lambda item: put_item(DATA,item))
+            put_item(DONE,None)
+        except StreamClosed:
+            pass
+        except Exception as e:
+            try:
+                put_item(ERROR,e)
+            except StreamClosed:
+                pass
+
+    def stream():
+        try:
+            while True:
+                try:
+                    kind,item = items.get(True,wait_time)
+                except queue.Empty:
+                    if wait != None:
+                        wait()
+                    continue
+                if kind == DONE:
+                    break
+                if kind == ERROR:
+                    raise item
+                yield item
+        finally:
+            closed[0] = True
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return stream()
+
+
+if __name__ == '__main__':
+    # Items arrive in order, errors are passed on and closing stops the producer
+    from time import sleep
+    def count(put):
+        for i in range(1000):
+            put(i)
+    print("in order: %s" %(list(threaded_stream(count,maxsize=4)) == list(range(1000))))
+
+    def fail(put):
+        put(1)
+        raise Exception("producer failed")
+    try:
+        list(threaded_stream(fail))
+    except Exception as e:
+        print("error passed on: %s" %(e))
+
+    produced = []
+    def endless(put):
+        while True:
+            produced.append(1)
+            put(len(produced))
+    stream = threaded_stream(endless,maxsize=4)
+    next(stream)
+    stream.close()
+    sleep(0.5)
+    n = len(produced)
+    sleep(0.5)
+    print("producer stopped: %s (%d items made)" %(n == len(produced),n))
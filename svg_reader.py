@@ -24,6 +24,10 @@ import tempfile, os, sys, shutil
 
 import zipfile
 import re
+try:
+    from urllib.parse import unquote
+except:
+    from urllib import unquote
 # local library
 import inkex
 import simplestyle
@@ -70,6 +74,10 @@ def kill_sub_process(p,timeout_sec, FLAG):
     FLAG[0]=False
     p.kill()
 
+# version output ("inkscape -V", "convert -version") for each
+# (executable, modification time)
+PROGRAM_VERSIONS = {}
+
 ##################################
 class SVG_TEXT_EXCEPTION(Exception):
     def __init__(self, value):
@@ -129,6 +137,7 @@ class SVG_READER(inkex.Effect):
         inkex.Effect.__init__(self)
         self.flatness = 0.01
         self.image_dpi = 1000
+        self.image_ystep = 1 # rows of the raster are image_ystep pixels apart
         self.inkscape_exe_list = []
         self.inkscape_exe_list.append("C:\\Program Files\\Inkscape\\bin\\inkscape.exe")
         self.inkscape_exe_list.append("C:\\Program Files (x86)\\Inkscape\\bin\\inkscape.exe")
@@ -152,11 +161,13 @@ class SVG_READER(inkex.Effect):
         self.SVG_ViewBox = None
 
         self.raster_PIL = None
+        self.raster_crop = None
         self.cut_lines = []
         self.eng_lines = []
         self.id_cnt = 0
         
         self.png_area = "--export-area-page"
+        self.render_cache = None # RenderCache for the files made by Inkscape
         self.timout = 180 #timeout time for external calls to Inkscape in seconds 
               
         self.layers = ['0']
@@ -669,6 +680,129 @@ class SVG_READER(inkex.Effect):
         return retval
 
 
+    def image_ydpi(self):
+        return self.image_dpi / float(self.image_ystep)
+
+    def png_size(self):
+        # Size in pixels of the page rendered at image_dpi across and
+        # image_ydpi() down the page
+        dpmm_x = self.image_dpi / 25.4
+        dpmm_y = self.image_ydpi() / 25.4
+        w_mm, h_mm = self.SVG_Size[0:2]
+        return max(1, int(round(w_mm*dpmm_x))), max(1, int(round(h_mm*dpmm_y)))
+
+    def png_size_options(self):
+        if self.image_ystep == 1:
+            return []
+        width_px, height_px = self.png_size()
+        return ["--export-width", "%d" %(width_px), "--export-height", "%d" %(height_px)]
+
+    def fit_png_size(self, pil_image):
+        # Some versions of Inkscape (and ImageMagick) keep the aspect ratio
+        # of the page no matter what height is requested
+        if self.image_ystep == 1:
+            return pil_image
+        width_px, height_px = self.png_size()
+        if pil_image.size[1] != height_px:
+            pil_image = pil_image.resize((pil_image.size[0], height_px), Image.BILINEAR)
+        return pil_image
+
+    def crop_raster(self, pil_image, bbox):
+        """Wrapper around Image.crop() that accepts the Y-invert-mm coordiante frame"""
+        # convert back to pixels and then flip the Y-axis to put the origin back in the top left.
+        dpmm_x = (self.image_dpi / 25.4)
+        dpmm_y = (self.image_ydpi() / 25.4)
+        width_px, height_px = pil_image.size
+        return pil_image.crop((bbox[0]*dpmm_x, height_px-bbox[3]*dpmm_y,
+                               bbox[2]*dpmm_x, height_px-bbox[1]*dpmm_y))
+
+    def render_raster(self, image_ystep):
+        '''
+        Make the raster image again with a different row spacing without
+        reading the SVG file again (make_paths() must have been called with
+        make_png=True)
+        '''
+        self.image_ystep = image_ystep
+        self.Make_PNG()
+        if self.raster_crop != None:
+            self.raster_PIL = self.crop_raster(self.raster_PIL, self.raster_crop)
+        return self.raster_PIL
+
+    def program_version(self, exe, option):
+        # Only ask each executable for its version once
+        try:
+            exe_id = (exe, os.path.getmtime(exe))
+        except:
+            exe_id = (exe, None)
+        if exe_id not in PROGRAM_VERSIONS:
+            cmd = [ exe, option]
+            (stdout,stderr)=run_external(cmd, self.timout)
+            PROGRAM_VERSIONS[exe_id] = stdout
+        return PROGRAM_VERSIONS[exe_id]
+
+    def inkscape_version(self):
+        return self.program_version(self.inkscape_exe, "-V")
+
+    def linked_files(self, svg_file):
+        '''
+        Returns the path, size and modification time of each local file the
+        SVG links to (e.g. <image xlink:href="photo.png">), or None if a
+        link can not be resolved to a local file.
+        '''
+        links = []
+        svg_dir = os.path.dirname(svg_file)
+        for node in self.document.getroot().iter(tag=etree.Element):
+            href = node.get(inkex.addNS('href','xlink'))
+            if href == None:
+                href = node.get('href')
+            if href == None or href.startswith('#') or href.startswith('data:'):
+                continue
+            path = href.split('#')[0]
+            if path.startswith('file://'):
+                path = unquote(path[7:])
+            elif re.match('[a-zA-Z][a-zA-Z0-9+.-]+:', path):
+                return None # http: and other links that are not local files
+            found = None
+            for location in [path, os.path.join(svg_dir,path), node.get(inkex.addNS('absref','sodipodi'))]:
+                if location != None and os.path.isfile(location):
+                    found = location
+                    break
+            if found == None:
+                return None
+            stat = os.stat(found)
+            links.append("%s %d %s" %(os.path.abspath(found), stat.st_size, stat.st_mtime))
+        return links
+
+    def render_cache_key(self, svg_file, cmd, tmp_dir, version=b''):
+        # Everything the output depends on: the SVG data, the files it links
+        # to, the program version and the options (without the temporary
+        # file names).  None if the cache is off or a link can not be found.
+        if self.render_cache == None or not self.render_cache.enabled():
+            return None
+        links = self.linked_files(svg_file)
+        if links == None:
+            return None
+        fp = open(svg_file, 'rb')
+        svg_data = fp.read()
+        fp.close()
+        options = [opt for opt in cmd[1:] if opt.find(tmp_dir)==-1]
+        return self.render_cache.make_key(svg_data, version, *(options+links))
+
+    def run_cached(self, cmd, svg_file, out_file, tmp_dir, version=b''):
+        '''
+        Run cmd to make out_file from svg_file unless the result is already
+        in the render cache.  Returns the name of the file to use.
+        '''
+        key = self.render_cache_key(svg_file, cmd, tmp_dir, version)
+        if key != None:
+            cache_file = self.render_cache.fetch(key)
+            if cache_file != None:
+                return cache_file
+        run_external(cmd, self.timout)
+        if key != None:
+            self.render_cache.store(key, out_file)
+        return out_file
+
     def Make_PNG(self):
         #create OS temp folder
         tmp_dir = tempfile.mkdtemp()
@@ -681,20 +815,19 @@ class SVG_READER(inkex.Effect):
                 self.document.write(svg_temp_file)
 
                 # Check Version of Inkscape
-                cmd = [ self.inkscape_exe, "-V"]
-                (stdout,stderr)=run_external(cmd, self.timout)
+                stdout = self.inkscape_version()
                 if stdout.find(b'Inkscape 1.')==-1:
-                    cmd = [ self.inkscape_exe, self.png_area, "--export-dpi", dpi, \
+                    cmd = [ self.inkscape_exe, self.png_area, "--export-dpi", dpi] + self.png_size_options() + [ \
                             "--export-background","rgb(255, 255, 255)","--export-background-opacity", \
                             "255" ,"--export-png", png_temp_file, svg_temp_file ]
                 else:
-                    cmd = [ self.inkscape_exe, self.png_area, "--export-dpi", dpi, \
+                    cmd = [ self.inkscape_exe, self.png_area, "--export-dpi", dpi] + self.png_size_options() + [ \
                             "--export-background","rgb(255, 255, 255)","--export-background-opacity", \
                             "255" ,"--export-type=png", "--export-filename=%s" %(png_temp_file), svg_temp_file ]
 
-                run_external(cmd, self.timout)
-                self.raster_PIL = Image.open(png_temp_file)
-                self.raster_PIL = self.raster_PIL.convert("L")
+                png_file = self.run_cached(cmd, svg_temp_file, png_temp_file, tmp_dir, stdout)
+                self.raster_PIL = Image.open(png_file)
+                self.raster_PIL = self.fit_png_size(self.raster_PIL.convert("L"))
             except Exception as e:
                 try:
                     shutil.rmtree(tmp_dir) 
@@ -707,9 +840,12 @@ class SVG_READER(inkex.Effect):
                 svg_temp_file = os.path.join(tmp_dir, "k40w_temp.svg")
                 png_temp_file = os.path.join(tmp_dir, "k40w_image.png")
                 self.document.write(svg_temp_file)
-                run_external(['/usr/bin/convert', "-background", "white", "-density", str(self.image_dpi), svg_temp_file, png_temp_file], self.timout)
-                self.raster_PIL = Image.open(png_temp_file)
-                self.raster_PIL = self.raster_PIL.convert("L")
+                density = "%dx%d" %(self.image_dpi, self.image_ydpi())
+                cmd = ['/usr/bin/convert', "-background", "white", "-density", density, svg_temp_file, png_temp_file]
+                stdout = self.program_version('/usr/bin/convert', "-version")
+                png_file = self.run_cached(cmd, svg_temp_file, png_temp_file, tmp_dir, stdout)
+                self.raster_PIL = Image.open(png_file)
+                self.raster_PIL = self.fit_png_size(self.raster_PIL.convert("L"))
             except Exception as e:
                 try:
                     shutil.rmtree(tmp_dir)
@@ -756,8 +892,7 @@ class SVG_READER(inkex.Effect):
                 self.document.write(svg_temp_file)
 
                 # Check Version of Inkscape
-                cmd = [ self.inkscape_exe, "-V"]
-                (stdout,stderr)=run_external(cmd, self.timout)
+                stdout = self.inkscape_version()
                 if stdout.find(b'Inkscape 1.')==-1:
                     cmd = [ self.inkscape_exe, "--export-text-to-path","--export-plain-svg", \
                             txt2path_file, svg_temp_file,  ]
@@ -765,7 +900,7 @@ class SVG_READER(inkex.Effect):
                     cmd = [ self.inkscape_exe, "--export-text-to-path","--export-plain-svg", \
                             "--export-filename=%s" %(txt2path_file), svg_temp_file,  ]
                 
-                (stdout,stderr)=run_external(cmd, self.timout)
+                txt2path_file = self.run_cached(cmd, svg_temp_file, txt2path_file, tmp_dir, stdout)
                 self.parse_svg(txt2path_file)
             except Exception as e:
                 raise Exception("Inkscape Execution Failed (while converting text to paths).\n\n"+str(e))
@@ -863,8 +998,9 @@ class SVG_READER(inkex.Effect):
         else:
             # create an empty white background
             dpmm = (self.image_dpi / 25.4)
+            dpmm_y = (self.image_ydpi() / 25.4)
             self.raster_PIL = Image.new(mode='L',
-                                        size=(int(math.ceil(w_mm*dpmm)), int(math.ceil(h_mm*dpmm))),
+                                        size=(int(math.ceil(w_mm*dpmm)), int(math.ceil(h_mm*dpmm_y))),
                                         color=255)
 
 
@@ -914,16 +1050,7 @@ class SVG_READER(inkex.Effect):
                     bbox[2],
                     bbox[1])  # swapped
 
-        def crop_image(pil_image, dpi, bbox):
-            """Wrapper around Image.crop() that accepts the Y-invert-mm coordiante frame"""
-            # convert back to pixels and then flip the Y-axis to put the origin back in the top left.
-            dpmm = (dpi / 25.4)
-            width_px, height_px = pil_image.size
-            pixel_bbox = flip_y(scale_bbox(bbox, dpmm, dpmm), height_px)
-            return pil_image.crop(pixel_bbox)
-
-
-        def get_raster_bbox(pil_image, dpi):
+        def get_raster_bbox(pil_image, dpi, ydpi):
             """Returns the bounding box of the raster image in Y-inverted mm (same coordinate frame as self.lines)"""
 
             # Invert the pixel colors of the image, and get the non-zero pixel bounding box.
@@ -936,8 +1063,9 @@ class SVG_READER(inkex.Effect):
 
             # Handle the weird Y-inverted coordinate frame in pixel coordinates, and then convert to mm
             mmpd = (25.4 / dpi)
+            mmpd_y = (25.4 / ydpi)
             width_px, height_px = pil_image.size
-            return scale_bbox(flip_y(pixel_bbox, height_px), mmpd, mmpd)
+            return scale_bbox(flip_y(pixel_bbox, height_px), mmpd, mmpd_y)
 
 
         def get_line_bbox(lines):
@@ -956,7 +1084,7 @@ class SVG_READER(inkex.Effect):
             return None
 
         # NOTE: These bboxes are in the strange Y-inverted format.
-        raster_bbox = get_raster_bbox(self.raster_PIL, self.image_dpi)
+        raster_bbox = get_raster_bbox(self.raster_PIL, self.image_dpi, self.image_ydpi())
         line_bbox = get_line_bbox(self.lines)
 
         combined_bbox = combine_bboxes(raster_bbox, line_bbox)
@@ -966,7 +1094,8 @@ class SVG_READER(inkex.Effect):
             w_mm = combined_bbox[2] - combined_bbox[0]
             h_mm = combined_bbox[3] - combined_bbox[1]
 
-            self.raster_PIL = crop_image(self.raster_PIL, self.image_dpi, combined_bbox)
+            self.raster_PIL = self.crop_raster(self.raster_PIL, combined_bbox)
+            self.raster_crop = combined_bbox
 
             # top-left justify the vector content
             for line in self.lines: